@@ -2,8 +2,11 @@ import os
 import json
 import re
 import asyncio
-from hoshino import Service
-from .dailysum import handle_daily_report_cmd, start_scheduler, PLAYWRIGHT_AVAILABLE, init_dailysum_playwright
+from hoshino import Service, get_bot
+from .dailysum import handle_daily_report_cmd, start_scheduler, PLAYWRIGHT_AVAILABLE, init_dailysum_playwright, close_ai_client
+from .message_capture import capture_group_message, flush_captured_messages
+from .test_html_report_2 import close_browser_pool
+from .config import ENABLE_MESSAGE_CAPTURE
 from .logger_helper import log_info, log_warning, log_error_msg
 
 sv = Service('dailysum', enable_on_default=False, help_='群聊日报功能')
@@ -21,6 +24,25 @@ async def handle_dailysum(bot, ev):
     msg = ev.message.extract_plain_text().strip()
     await handle_daily_report_cmd(bot, ev, msg)
 
+# 实时捕获群消息，写入按群按天保存的聊天记录
+if ENABLE_MESSAGE_CAPTURE:
+    # 实时捕获群消息需要在所有群生效，与日报命令的开关分开
+    sv_capture = Service('dailysum-capture', enable_on_default=True, visible=False)
+
+    @sv_capture.on_message('group')
+    async def handle_dailysum_capture(bot, ev):
+        capture_group_message(ev)
+
+# 机器人退出时写入缓存的群消息，关闭AI接口连接池和常驻浏览器
+try:
+    @get_bot().server_app.after_serving
+    async def close_dailysum_clients():
+        await flush_captured_messages()
+        await close_ai_client()
+        await close_browser_pool()
+except Exception as e:
+    log_warning(f"注册退出清理任务失败: {str(e)}")
+
 # 初始化定时任务
 scheduler_started = False
 def init():
@@ -124,6 +124,7 @@ def run_diagnostic():
         log_path_exists = check_file_exists(getattr(config, 'LOG_PATH', ''))
         print(f"  日志文件存在: {'✓ 是' if log_path_exists else '✗ 否'}")
         
+        print(f"AI_BACKEND: {getattr(config, 'AI_BACKEND', 'deepseek')}")
         api_key = getattr(config, 'AI_API_KEY', '')
         print(f"AI_API_KEY: {'✓ 已设置' if api_key else '✗ 未设置'}")
         
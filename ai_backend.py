@@ -0,0 +1,416 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import traceback
+import httpx
+from collections import OrderedDict
+
+# HTTP/2需要额外安装h2
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+from .config import *
+from .logger_helper import log_debug, log_info, log_warning, log_error_msg
+from .token_budget import estimate_tokens
+from .rate_limiter import get_ai_limiter, parse_retry_after
+
+# 各AI接口的地址
+AI_BACKEND_URLS = {
+    'deepseek': "https://api.deepseek.com/v1",
+    'mock': "http://mock.local/v1",
+}
+
+# 兼容OpenAI接口格式的AI客户端
+class ChatCompletionClient:
+    """
+    调用OpenAI格式的/chat/completions接口，DeepSeek和其他兼容的服务都通过base_url区分
+    传入transport时请求不经过网络，由transport直接返回响应，用于模拟接口
+    """
+    def __init__(self, api_key, base_url, name="AI", transport=None, stream_usage=False):
+        self.api_key = api_key
+        self.name = name
+        self.base_url = base_url.rstrip("/") + "/chat/completions"
+        self.transport = transport
+        self.stream_usage = stream_usage  # 流式输出时是否通过stream_options请求返回token用量
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        self._client = None
+        self.last_metrics = None  # 最近一次请求的耗时统计
+        self.prompt_tokens_total = 0  # 累计的提示词token数
+        self.cache_hit_tokens_total = 0  # 累计命中接口缓存的提示词token数
+        log_info(f"{name} 客户端初始化完成，接口: {self.base_url}，API Key: {'已设置' if api_key else '未设置'}")
+    
+    def _get_client(self):
+        """
+        获取共享的HTTP客户端，所有请求复用同一个连接池，避免每次请求都重新建立TCP和TLS连接
+        """
+        if self._client is None or self._client.is_closed:
+            http2 = AI_HTTP2 and HTTP2_AVAILABLE
+            if AI_HTTP2 and not HTTP2_AVAILABLE:
+                log_warning("未安装h2，AI接口将使用HTTP/1.1")
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=AI_MAX_CONNECTIONS,
+                    max_keepalive_connections=AI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=AI_KEEPALIVE_EXPIRY
+                ),
+                transport=self.transport
+            )
+            log_debug(f"已创建AI接口连接池，HTTP/2: {'启用' if http2 else '未启用'}")
+        return self._client
+    
+    async def aclose(self):
+        """
+        关闭连接池
+        """
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            log_info("AI接口连接池已关闭")
+        self._client = None
+        
+    async def _complete(self, payload, timeout):
+        """
+        非流式请求，等待完整的生成结果
+        :return: (状态码, 生成内容或错误信息, 请求统计或失败时的Retry-After秒数)
+        """
+        start = time.perf_counter()
+        response = await self._get_client().post(self.base_url, json=payload, timeout=timeout)
+        if response.status_code != 200:
+            return response.status_code, response.text, parse_retry_after(response.headers.get("Retry-After"))
+        result = response.json()
+        content = result["choices"][0]["message"]["content"]
+        return 200, content, self._record_metrics(start, None, content, result.get("usage"))
+    
+    async def _complete_stream(self, payload, idle_timeout):
+        """
+        流式请求，逐块读取SSE数据，只限制两次收到数据之间的间隔而不限制总耗时
+        :return: (状态码, 生成内容或错误信息, 请求统计或失败时的Retry-After秒数)
+        """
+        start = time.perf_counter()
+        first_token_time = None
+        finish_reason = None
+        usage = None
+        parts = []
+        
+        payload = dict(payload, stream=True)
+        if self.stream_usage:
+            payload["stream_options"] = {"include_usage": True}
+        timeout = httpx.Timeout(idle_timeout, connect=AI_CONNECT_TIMEOUT)
+        async with self._get_client().stream("POST", self.base_url, json=payload, timeout=timeout) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response.status_code, response.text, parse_retry_after(response.headers.get("Retry-After"))
+            
+            async for line in response.aiter_lines():
+                # 空行分隔事件，冒号开头的是保持连接的注释
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                        parts.append(text)
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+        
+        if finish_reason is None:
+            raise httpx.RemoteProtocolError(f"流式输出在完成前中断，已收到 {len(parts)} 段内容")
+        
+        content = "".join(parts)
+        return 200, content, self._record_metrics(start, first_token_time, content, usage)
+    
+    def _record_metrics(self, start, first_token_time, content, usage):
+        """
+        记录首个token延迟和生成速度
+        :return: 本次请求的统计
+        """
+        elapsed = time.perf_counter() - start
+        usage = usage or {}
+        completion_tokens = usage.get("completion_tokens")
+        prompt_tokens = usage.get("prompt_tokens")
+        # DeepSeek返回prompt_cache_hit_tokens，OpenAI返回prompt_tokens_details.cached_tokens
+        cache_hit_tokens = usage.get("prompt_cache_hit_tokens")
+        if cache_hit_tokens is None:
+            cache_hit_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if prompt_tokens:
+            self.prompt_tokens_total += prompt_tokens
+            self.cache_hit_tokens_total += cache_hit_tokens or 0
+        ttft = first_token_time - start if first_token_time is not None else None
+        # 生成速度按首个token之后的时间计算，非流式请求只能按总耗时计算
+        generate_time = elapsed - ttft if ttft is not None else elapsed
+        tokens_per_second = completion_tokens / generate_time if completion_tokens and generate_time > 0 else None
+        self.last_metrics = {
+            "elapsed": elapsed,
+            "ttft": ttft,
+            "prompt_tokens": prompt_tokens,
+            "cache_hit_tokens": cache_hit_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": usage.get("total_tokens"),
+            "tokens_per_second": tokens_per_second,
+            "chars": len(content),
+        }
+        log_info(
+            f"AI请求耗时 {elapsed:.2f}s"
+            + (f"，首个token {ttft:.2f}s" if ttft is not None else "")
+            + (f"，提示词 {prompt_tokens} tokens（缓存命中 {cache_hit_tokens or 0}）" if prompt_tokens else "")
+            + (f"，生成 {completion_tokens} tokens" if completion_tokens else "")
+            + (f"，{tokens_per_second:.1f} tokens/s" if tokens_per_second else "")
+        )
+        return self.last_metrics
+    
+    def describe_cache(self):
+        """
+        :return: 累计的接口缓存命中情况
+        """
+        if not self.prompt_tokens_total:
+            return "AI接口缓存命中: 暂无数据"
+        rate = self.cache_hit_tokens_total / self.prompt_tokens_total
+        return f"AI接口缓存命中: {self.cache_hit_tokens_total}/{self.prompt_tokens_total} tokens ({rate:.0%})"
+    
+    async def generate(self, prompt, system_prompt=None, model=AI_MODEL, temperature=AI_TEMPERATURE, max_retries=3,
+                       timeout=120.0, stream=AI_STREAM, idle_timeout=AI_STREAM_IDLE_TIMEOUT):
+        """
+        调用AI接口生成内容
+        :param prompt: 提示词，作为用户消息
+        :param system_prompt: 系统消息，放在最前面，内容固定时可以命中接口的前缀缓存
+        :param model: 模型名称
+        :param temperature: 生成温度
+        :param max_retries: 最大重试次数
+        :param timeout: 非流式请求的总超时秒数
+        :param stream: 是否使用流式输出
+        :param idle_timeout: 流式输出时两次收到数据之间的最长等待秒数
+        :return: 生成的内容，失败时返回None
+        """
+        log_info(f"开始生成AI摘要，模型: {model}, 温度: {temperature}")
+        log_debug(f"提示词: {prompt[:200]}...")
+        
+        # 记录请求数据大小
+        request_size = len(prompt.encode('utf-8')) + len((system_prompt or "").encode('utf-8'))
+        log_info(f"请求数据大小: {request_size / 1024:.2f} KB")
+        
+        # 所有AI请求共用一个限流器，定时日报和手动命令同时进行时也不会超出接口限制
+        limiter = get_ai_limiter()
+        retry_count = 0
+        while retry_count < max_retries:
+            failed = False
+            retry_after = None
+            outcome = None
+            actual_tokens = None
+            estimated_tokens = estimate_tokens(prompt) + estimate_tokens(system_prompt or "") + AI_EXPECTED_COMPLETION_TOKENS
+            await limiter.acquire(estimated_tokens)
+            try:
+                log_debug(f"尝试API请求 (尝试 {retry_count + 1}/{max_retries})...")
+                messages = [{"role": "user", "content": prompt}]
+                if system_prompt:
+                    messages.insert(0, {"role": "system", "content": system_prompt})
+                payload = {
+                    "model": model,
+                    "messages": messages,
+                    "temperature": temperature
+                }
+                if stream:
+                    status_code, content, extra = await self._complete_stream(payload, idle_timeout)
+                else:
+                    status_code, content, extra = await self._complete(payload, timeout)
+                
+                if status_code == 200:
+                    outcome = 'ok'
+                    actual_tokens = extra.get("total_tokens")
+                    log_info(f"AI生成成功，生成内容长度: {len(content)}")
+                    log_debug(f"生成内容前100字符: {content[:100]}...")
+                    return content
+                elif status_code == 400 and stream and self.stream_usage and "stream_options" in content:
+                    # 接口不支持stream_options，之后的请求都不再发送
+                    log_warning(f"{self.name} 不支持stream_options，流式输出将不再请求token用量")
+                    self.stream_usage = False
+                    retry_count += 1
+                elif status_code == 400:
+                    # 如果是请求过大的错误，尝试减少输入长度
+                    log_warning(f"请求数据过大 (状态码: {status_code})，尝试减少输入大小")
+                    
+                    # 裁剪提示词到原来的70%，只裁剪用户消息里的聊天记录，系统消息保持不变
+                    prompt_parts = prompt.split("聊天记录：\n")
+                    if len(prompt_parts) == 2:
+                        instruction, chat_log = prompt_parts
+                        # 保留前70%的聊天记录
+                        reduced_chat_log = chat_log[:int(len(chat_log) * 0.7)]
+                        prompt = f"{instruction}聊天记录：\n{reduced_chat_log}\n\n[注: 由于长度限制，仅显示部分聊天记录]"
+                        log_info(f"提示词已减少到原来的70%，新大小: {len(prompt.encode('utf-8')) / 1024:.2f} KB")
+                        # 裁剪后重试也计入重试次数，接口因为其他原因一直返回400时不会无限重试
+                        retry_count += 1
+                    else:
+                        log_error_msg("无法裁剪提示词，格式不符合预期")
+                        return None
+                else:
+                    log_error_msg(f"{self.name} API调用失败: {status_code} {content}")
+                    # 如果不是400错误，可能是其他API问题，尝试重试
+                    retry_after = extra
+                    if status_code == 429 or status_code >= 500:
+                        outcome = 'overload'
+                    failed = True
+            except httpx.TimeoutException:
+                log_warning(f"API请求超时，尝试重试 ({retry_count + 1}/{max_retries})")
+                outcome = 'overload'
+                failed = True
+            except Exception as e:
+                log_error_msg(f"{self.name} API调用出错: {str(e)}")
+                log_error_msg(traceback.format_exc())
+                failed = True
+            finally:
+                await limiter.release(outcome, estimated_tokens, actual_tokens)
+            
+            if failed:
+                retry_count += 1
+                if retry_after is not None:
+                    await limiter.pause(retry_after)
+                if retry_count < max_retries:
+                    await asyncio.sleep(limiter.backoff_delay(retry_count, retry_after))
+        
+        log_error_msg(f"达到最大重试次数 ({max_retries})，AI生成失败")
+        return None
+
+# 模拟接口最多记录多少个请求的重试次数
+MOCK_ATTEMPTS_MAX = 4096
+
+# 模拟的AI接口
+class MockChatTransport(httpx.AsyncBaseTransport):
+    """
+    在进程内模拟OpenAI格式的/chat/completions接口，不需要网络，用于压力测试整个日报流程
+    相同的请求第几次发出时得到的结果是确定的，与请求之间的先后顺序无关
+    请求成功后不再记录它的重试次数，之后相同的请求重新从第一次开始计算
+    """
+    def __init__(self, latency=AI_MOCK_LATENCY, tokens_per_second=AI_MOCK_TOKENS_PER_SECOND,
+                 error_rate=AI_MOCK_ERROR_RATE, seed=AI_MOCK_SEED):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.seed = seed
+        self._attempts = OrderedDict()
+        self._cached_prefixes = set()
+        self.request_count = 0
+
+    async def handle_async_request(self, request):
+        payload = json.loads(await request.aread())
+        # 只按提示词和模型区分请求，是否流式输出不影响生成的内容
+        key = json.dumps([payload.get("model"), payload.get("messages")], ensure_ascii=False)
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        attempt = self._attempts.pop(digest, 0)
+        self.request_count += 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        failed = rng.random() < self.error_rate
+        # 只记录失败请求的重试次数，超过上限时丢弃最早的记录
+        if failed:
+            self._attempts[digest] = attempt + 1
+            while len(self._attempts) > MOCK_ATTEMPTS_MAX:
+                self._attempts.popitem(last=False)
+
+        # 模拟接口排队和处理提示词的时间
+        await asyncio.sleep(self.latency * rng.uniform(0.5, 1.5))
+        if failed:
+            if rng.random() < 0.5:
+                return httpx.Response(429, headers={"Retry-After": "1"}, json={"error": {"message": "mock rate limited"}})
+            return httpx.Response(500, json={"error": {"message": "mock server error"}})
+
+        prompt = "\n".join(message.get("content", "") for message in payload.get("messages", []))
+        content = self._make_content(prompt, rng)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(content)
+        # 模拟接口的前缀缓存：系统消息之前出现过时计为缓存命中
+        messages = payload.get("messages", [])
+        cache_hit_tokens = 0
+        if len(messages) > 1 and messages[0].get("role") == "system":
+            system_prompt = messages[0].get("content", "")
+            if system_prompt in self._cached_prefixes:
+                cache_hit_tokens = estimate_tokens(system_prompt)
+            self._cached_prefixes.add(system_prompt)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "prompt_cache_hit_tokens": cache_hit_tokens,
+            "prompt_cache_miss_tokens": prompt_tokens - cache_hit_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if not payload.get("stream"):
+            await self._generate_delay(completion_tokens)
+            return httpx.Response(200, json={
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/event-stream"},
+            stream=_MockEventStream(self, content, usage)
+        )
+
+    async def _generate_delay(self, tokens):
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(tokens / self.tokens_per_second)
+
+    def _make_content(self, prompt, rng):
+        """
+        按日报的格式生成内容，保证之后的解析和渲染流程都能正常进行
+        """
+        lines = [line for line in prompt.split("\n") if line.startswith("[")]
+        picks = [rng.choice(lines)[:60] for _ in range(3)] if lines else ["（无聊天记录）"] * 3
+        return (
+            "【今日热点话题】\n"
+            + "".join(f"{i}. 模拟话题{i}：{pick}\n" for i, pick in enumerate(picks, 1))
+            + "【重要消息】\n1. 这是模拟接口生成的内容\n"
+            + f"【金句】\n1. {picks[0]}\n"
+            + f"【今日总结】\n模拟总结，聊天记录共 {len(lines)} 行。"
+        )
+
+# 模拟接口的SSE数据流
+class _MockEventStream(httpx.AsyncByteStream):
+    def __init__(self, transport, content, usage, chunk_size=20):
+        self.transport = transport
+        self.content = content
+        self.usage = usage
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        for i in range(0, len(self.content), self.chunk_size):
+            text = self.content[i:i + self.chunk_size]
+            await self.transport._generate_delay(estimate_tokens(text))
+            chunk = {"choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+        chunk = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": self.usage}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\ndata: [DONE]\n\n".encode("utf-8")
+
+# 按配置创建AI客户端
+def create_ai_client(backend=AI_BACKEND):
+    """
+    按配置创建AI客户端
+    :param backend: 'deepseek'、'openai'（任意兼容OpenAI格式的接口，地址为AI_BASE_URL）或'mock'（进程内模拟接口）
+    :return: ChatCompletionClient
+    """
+    if backend == 'mock':
+        log_warning("AI接口使用模拟接口，生成的日报内容不是真实的总结")
+        return ChatCompletionClient(AI_API_KEY, AI_BACKEND_URLS['mock'], name="Mock", transport=MockChatTransport(),
+                                    stream_usage=AI_STREAM_USAGE is not False)
+    if backend == 'openai':
+        if not AI_BASE_URL:
+            raise ValueError("AI_BACKEND为openai时需要设置AI_BASE_URL")
+        return ChatCompletionClient(AI_API_KEY, AI_BASE_URL, name="OpenAI兼容接口", stream_usage=bool(AI_STREAM_USAGE))
+    if backend != 'deepseek':
+        raise ValueError(f"未知的AI接口类型: {backend}")
+    # 自定义地址可能是不支持stream_options的代理
+    stream_usage = AI_STREAM_USAGE if AI_STREAM_USAGE is not None else not AI_BASE_URL
+    return ChatCompletionClient(AI_API_KEY, AI_BASE_URL or AI_BACKEND_URLS['deepseek'], name="DeepSeek",
+                                stream_usage=stream_usage)
@@ -0,0 +1,301 @@
+import io
+import re
+import html
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# 布局参数，与SIMPLE_DARK_HTML_TEMPLATE的样式保持一致
+CANVAS_WIDTH = 800
+PADDING = 20
+GAP = 16
+LINE_HEIGHT_RATIO = 1.6
+
+BACKGROUND_COLOR = (0, 0, 0)
+CARD_COLOR = (28, 28, 30)
+CARD_RADIUS = 20
+CARD_PADDING = 20
+ACCENT_COLOR = (10, 132, 255)
+TEXT_COLOR = (238, 238, 238)
+TITLE_COLOR = (255, 255, 255)
+FOOTER_COLOR = (136, 136, 136)
+
+TITLE_SIZE = 28
+TITLE_MARGIN = 24
+CARD_TITLE_SIZE = 18
+CARD_TITLE_MARGIN = 12
+ICON_SIZE = 24
+ICON_RADIUS = 6
+ICON_MARGIN = 8
+ICON_TEXT_SIZE = 14
+CONTENT_SIZE = 15
+LIST_INDENT = 20
+LIST_MARGIN_TOP = 10
+LIST_ITEM_MARGIN = 8
+FOOTER_SIZE = 13
+FOOTER_MARGIN = 16
+
+# 各卡片：(parse_content_sections的键, 标题, 图标文字, 是否占满整行)
+CARDS = [
+    ("topics", "今日热点话题", "热", True),
+    ("important", "重要消息", "重", False),
+    ("quotes", "金句", "句", False),
+    ("summary", "总结", "总", True),
+]
+
+# format_content_html生成的段落和列表项
+BLOCK_REGEX = re.compile(r'<(p|li)>(.*?)</\1>|<ul>', re.S)
+TAG_REGEX = re.compile(r'<[^>]+>')
+
+# 换行时作为一个整体的英文单词、数字和链接，其他字符（包括中文）都可以在任意位置换行
+TOKEN_REGEX = re.compile(r'[A-Za-z0-9_\-.:/@#%&+=?!~]+|\s+|.', re.S)
+
+# 不能出现在行首的标点，放不下时挤在上一行的末尾
+NO_LINE_START = set('，。、；：！？）》」』】,.;:!?)')
+
+# 加载字体
+@lru_cache(maxsize=16)
+def get_font(font_path, size):
+    return ImageFont.truetype(font_path, size)
+
+# 每种字体每个字号的字符宽度缓存 {(字体路径, 字号): {字符: 宽度}}
+_glyph_widths = {}
+
+# 计算文本宽度
+def text_width(font_path, size, text):
+    """
+    按字符累加文本宽度，每个字符只测量一次，忽略字距调整
+    :param font_path: 字体路径
+    :param size: 字号
+    :param text: 文本
+    :return: 宽度（像素）
+    """
+    widths = _glyph_widths.get((font_path, size))
+    if widths is None:
+        widths = _glyph_widths[(font_path, size)] = {}
+    total = 0
+    font = None
+    for char in text:
+        width = widths.get(char)
+        if width is None:
+            if font is None:
+                font = get_font(font_path, size)
+            width = widths[char] = font.getlength(char)
+        total += width
+    return total
+
+# 每种字体每个字号渲染好的字形缓存 {(字体路径, 字号, 是否粗体, 字符): (字形蒙版, x偏移, y偏移)}
+# FreeType每次绘制都要重新光栅化每个字符，日报中的常用字反复出现，缓存后只需贴图
+_glyph_masks = {}
+
+def _get_glyph(font_path, size, bold, char):
+    key = (font_path, size, bold, char)
+    glyph = _glyph_masks.get(key)
+    if glyph is None:
+        font = get_font(font_path, size)
+        stroke = 1 if bold else 0
+        # 以基线左端为原点的字形范围
+        left, top, right, bottom = font.getbbox(char, anchor="ls", stroke_width=stroke)
+        if right <= left or bottom <= top:
+            glyph = (None, 0, 0)
+        else:
+            mask = Image.new("L", (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255, anchor="ls",
+                                      stroke_width=stroke, stroke_fill=255)
+            glyph = (mask, left, top)
+        _glyph_masks[key] = glyph
+    return glyph
+
+# 绘制一行文本
+def draw_text(image, x, middle, text, font_path, size, color, bold=False):
+    """
+    逐字贴上缓存的字形，粗体用描边模拟
+    :param x: 行首的x坐标
+    :param middle: 行的垂直中线
+    """
+    ascent, descent = get_font(font_path, size).getmetrics()
+    baseline = round(middle + (ascent - descent) / 2)
+    for char in text:
+        mask, left, top = _get_glyph(font_path, size, bold, char)
+        if mask is not None:
+            x0 = round(x) + left
+            y0 = baseline + top
+            image.paste(color, (x0, y0, x0 + mask.width, y0 + mask.height), mask)
+        x += text_width(font_path, size, char)
+
+# 按宽度折行
+def wrap_text(text, font_path, size, max_width):
+    """
+    按宽度折行，中文在任意字符处换行，英文单词和链接尽量不拆开
+    :return: 行列表
+    """
+    lines = []
+    line = ""
+    line_width = 0
+    for token in TOKEN_REGEX.findall(text):
+        if token == "\n":
+            lines.append(line)
+            line, line_width = "", 0
+            continue
+        width = text_width(font_path, size, token)
+        if line_width + width <= max_width or token in NO_LINE_START:
+            line += token
+            line_width += width
+            continue
+        if token.isspace():
+            # 行末的空白直接丢弃
+            continue
+        if line:
+            lines.append(line)
+        line, line_width = "", 0
+        # 比整行还长的单词按字符拆开
+        if width > max_width:
+            for char in token:
+                char_width = text_width(font_path, size, char)
+                if line and line_width + char_width > max_width:
+                    lines.append(line)
+                    line, line_width = "", 0
+                line += char
+                line_width += char_width
+        else:
+            line, line_width = token, width
+    if line or not lines:
+        lines.append(line)
+    return lines
+
+# 解析卡片内容
+def parse_blocks(content_html):
+    """
+    解析parse_content_sections生成的HTML片段
+    :param content_html: 由<p>和<ul><li>组成的HTML
+    :return: 块列表 [(类型, 文本)]，类型为'p'、'li'或'ul'（列表开始）
+    """
+    blocks = []
+    for match in BLOCK_REGEX.finditer(content_html):
+        if match.group(1) is None:
+            blocks.append(("ul", ""))
+        else:
+            text = html.unescape(TAG_REGEX.sub("", match.group(2))).strip()
+            blocks.append((match.group(1), text))
+    if not blocks:
+        text = html.unescape(TAG_REGEX.sub("", content_html)).strip()
+        blocks.append(("p", text or "无内容"))
+    return blocks
+
+# 排版卡片内容
+def layout_content(blocks, font_path, width):
+    """
+    :return: (内容高度, 绘制指令列表 [(x偏移, y偏移, 文本)])
+    """
+    line_height = round(CONTENT_SIZE * LINE_HEIGHT_RATIO)
+    ops = []
+    y = 0
+    for kind, text in blocks:
+        if kind == "ul":
+            y += LIST_MARGIN_TOP
+            continue
+        indent = LIST_INDENT if kind == "li" else 0
+        lines = wrap_text(text, font_path, CONTENT_SIZE, width - indent)
+        if kind == "li":
+            ops.append((indent - 12, y, "•"))
+        for line in lines:
+            ops.append((indent, y, line))
+            y += line_height
+        if kind == "li":
+            y += LIST_ITEM_MARGIN
+    return y, ops
+
+# 绘制Bento Grid日报
+def render_bento_report(title, sections, date_str, font_path):
+    """
+    不依赖浏览器，直接用Pillow绘制与SIMPLE_DARK_HTML_TEMPLATE相同布局的日报图片
+    :param title: 标题
+    :param sections: parse_content_sections的结果
+    :param date_str: 日期字符串
+    :param font_path: 中文字体路径
+    :return: PNG图片数据
+    """
+    inner_width = CANVAS_WIDTH - PADDING * 2
+    half_width = (inner_width - GAP) // 2
+    title_line = round(TITLE_SIZE * LINE_HEIGHT_RATIO)
+    card_title_line = max(ICON_SIZE, round(CARD_TITLE_SIZE * LINE_HEIGHT_RATIO))
+    footer_line = round(FOOTER_SIZE * LINE_HEIGHT_RATIO)
+
+    # 排版各卡片，半宽的卡片两两一行
+    rows = []
+    pending = []
+    for key, card_title, icon, full in CARDS:
+        card_width = inner_width if full else half_width
+        content_height, ops = layout_content(
+            parse_blocks(sections.get(key) or ""), font_path, card_width - CARD_PADDING * 2
+        )
+        card = (card_title, icon, card_width, content_height, ops)
+        if full:
+            if pending:
+                rows.append(pending)
+                pending = []
+            rows.append([card])
+        else:
+            pending.append(card)
+            if len(pending) == 2:
+                rows.append(pending)
+                pending = []
+    if pending:
+        rows.append(pending)
+
+    title_lines = wrap_text(title, font_path, TITLE_SIZE, inner_width)
+    row_heights = [
+        max(CARD_PADDING * 2 + card_title_line + CARD_TITLE_MARGIN + card[3] for card in row)
+        for row in rows
+    ]
+    height = (
+        PADDING + title_line * len(title_lines) + TITLE_MARGIN
+        + sum(row_heights) + GAP * (len(rows) - 1)
+        + FOOTER_MARGIN + footer_line + PADDING
+    )
+
+    image = Image.new("RGB", (CANVAS_WIDTH, height), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+
+    # 标题居中，用描边模拟粗体
+    y = PADDING
+    for line in title_lines:
+        x = (CANVAS_WIDTH - text_width(font_path, TITLE_SIZE, line)) / 2
+        draw_text(image, x, y + title_line / 2, line, font_path, TITLE_SIZE, TITLE_COLOR, bold=True)
+        y += title_line
+    y += TITLE_MARGIN
+
+    content_line = round(CONTENT_SIZE * LINE_HEIGHT_RATIO)
+    for row, row_height in zip(rows, row_heights):
+        x = PADDING
+        for card_title, icon, card_width, _, ops in row:
+            draw.rounded_rectangle((x, y, x + card_width - 1, y + row_height - 1), CARD_RADIUS, fill=CARD_COLOR)
+            left = x + CARD_PADDING
+            top = y + CARD_PADDING
+
+            # 卡片标题和图标
+            icon_top = top + (card_title_line - ICON_SIZE) / 2
+            draw.rounded_rectangle((left, icon_top, left + ICON_SIZE - 1, icon_top + ICON_SIZE - 1),
+                                   ICON_RADIUS, fill=ACCENT_COLOR)
+            icon_x = left + (ICON_SIZE - text_width(font_path, ICON_TEXT_SIZE, icon)) / 2
+            draw_text(image, icon_x, icon_top + ICON_SIZE / 2, icon, font_path, ICON_TEXT_SIZE, TITLE_COLOR)
+            draw_text(image, left + ICON_SIZE + ICON_MARGIN, top + card_title_line / 2, card_title,
+                      font_path, CARD_TITLE_SIZE, ACCENT_COLOR, bold=True)
+
+            # 卡片内容
+            content_top = top + card_title_line + CARD_TITLE_MARGIN
+            for dx, dy, text in ops:
+                draw_text(image, left + dx, content_top + dy + content_line / 2, text,
+                          font_path, CONTENT_SIZE, TEXT_COLOR)
+            x += card_width + GAP
+        y += row_height + GAP
+    y += FOOTER_MARGIN - GAP
+
+    footer = f"由AI生成 · {date_str}"
+    x = (CANVAS_WIDTH - text_width(font_path, FOOTER_SIZE, footer)) / 2
+    draw_text(image, x, y + footer_line / 2, footer, font_path, FOOTER_SIZE, FOOTER_COLOR)
+
+    buffer = io.BytesIO()
+    # 压缩级别对图片大小影响不大，编码速度快很多
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
@@ -18,20 +18,85 @@ SUMMARY_MINUTE = 30  # 每天几分发送日报
 SUMMARY_START_HOUR = 4  # 统计时间段的起始小时（例如：4点到次日4点）
 
 # AI配置
-AI_API_KEY = "sk-476330950dd24ff6869b6a301930f275"  # DeepSeek API密钥
+AI_BACKEND = "deepseek"  # AI接口类型：deepseek、openai（任意兼容OpenAI格式的接口）、mock（进程内模拟接口，用于离线测试）
+AI_BASE_URL = ""  # 接口地址，例如 https://api.openai.com/v1，为空时deepseek使用官方地址，openai必须设置
+AI_API_KEY = "sk-476330950dd24ff6869b6a301930f275"  # API密钥
 AI_MODEL = "deepseek-chat"  # AI模型名称
 AI_TEMPERATURE = 1.0  # AI生成温度
+AI_MAX_CONNECTIONS = 10  # 与AI接口之间的最大连接数
+AI_MAX_KEEPALIVE_CONNECTIONS = 10  # 空闲时保持的最大连接数，小于最大连接数时并发请求结束后多出的连接会被关闭
+AI_KEEPALIVE_EXPIRY = 60  # 空闲连接保持的秒数
+AI_HTTP2 = True  # 是否使用HTTP/2，需要安装h2（pip install httpx[http2]），未安装时自动使用HTTP/1.1
+AI_STREAM = True  # 是否使用流式输出，生成较慢但一直有进展的长摘要不会因为总超时被中断重试
+AI_STREAM_USAGE = None  # 流式输出时是否通过stream_options请求返回token用量，None表示只对DeepSeek官方地址和模拟接口开启，不支持该参数的接口会返回400
+AI_STREAM_IDLE_TIMEOUT = 60  # 流式输出时两次收到数据之间的最长等待秒数
+AI_CONNECT_TIMEOUT = 10  # 连接AI接口的超时秒数
+AI_MOCK_LATENCY = 1.0  # 模拟接口返回首个token前的平均等待秒数
+AI_MOCK_TOKENS_PER_SECOND = 50  # 模拟接口每秒生成的token数，0表示立即生成完
+AI_MOCK_ERROR_RATE = 0.0  # 模拟接口返回429或500错误的概率
+AI_MOCK_SEED = 0  # 模拟接口的随机种子，相同的种子和请求得到相同的结果
+
+# AI请求限流配置，所有群的定时日报和手动命令共用
+AI_REQUESTS_PER_MINUTE = 60  # 每分钟最多发出的请求数，0表示不限制
+AI_TOKENS_PER_MINUTE = 1000000  # 每分钟最多消耗的token数（按离线估算），0表示不限制
+AI_EXPECTED_COMPLETION_TOKENS = 2000  # 发出请求时预计生成的token数，请求完成后按实际用量修正
+AI_INITIAL_CONCURRENCY = 4  # 初始的并发请求上限，之后根据接口状况自动调整
+AI_MIN_CONCURRENCY = 1  # 接口过载时并发请求上限最低降到多少
+AI_MAX_CONCURRENCY = 8  # 接口正常时并发请求上限最高升到多少，不超过AI_MAX_CONNECTIONS
+AI_RETRY_BASE_DELAY = 2  # 重试等待的基础秒数，每次失败后翻倍并加上随机抖动
+AI_RETRY_MAX_DELAY = 60  # 重试最多等待的秒数
 
 # 群配置
 DAILY_SUM_GROUPS = []  # 日报功能启用的群列表，为空时对所有群启用
 # 示例：DAILY_SUM_GROUPS = ['123456789', '987654321'] # 只在这两个群启用日报功能
 
 # 并发控制
-MAX_CONCURRENT_TASKS = 3  # 最大并发任务数量
+MAX_CONCURRENT_TASKS = 3  # 同时发送日报的群数量，AI请求的并发由AI_*_CONCURRENCY控制
 TASK_INTERVAL_SECONDS = 10  # 每个群任务之间的间隔秒数
 
+# 日志解析配置
+PARSE_WORKERS = 0  # 解析大日志文件时使用的进程数，0表示使用全部CPU核心，1表示不使用多进程
+PARSE_PARALLEL_MIN_BYTES = 32 * 1024 * 1024  # 日志文件超过该大小(字节)时才使用多进程解析
+PARSE_PARALLEL_TIMEOUT = 300  # 多进程解析的最长秒数，超时后结束子进程并改为在当前进程中解析
+
+# 聊天记录存储配置
+STORE_SEGMENT_MAX_BYTES = 16 * 1024 * 1024  # 每个群每天的聊天记录分段文件超过该大小(字节)后新建下一个分段
+ENABLE_MESSAGE_ARCHIVE = True  # 是否同时把聊天记录归档到SQLite数据库，启用后按时间范围查询记录直接走数据库索引
+ARCHIVE_DB_PATH = os.path.join(DATA_DIR, 'messages.db')  # 聊天记录归档数据库路径
+
+# 实时消息捕获配置
+ENABLE_MESSAGE_CAPTURE = False  # 是否实时捕获群消息，启用后当天的记录直接来自捕获的消息，不再解析系统日志
+CAPTURE_BATCH_SIZE = 200  # 捕获的消息攒够多少条写入一次文件
+CAPTURE_FLUSH_INTERVAL = 30  # 捕获的消息最长多少秒写入一次文件
+
+# 聊天记录去重配置
+ENABLE_MESSAGE_DEDUP = True  # 是否合并复读、刷屏等重复消息，合并后只保留第一条并注明重复次数
+DEDUP_WINDOW_SIZE = 30  # 每条消息只和最近这么多条不同的消息比较
+DEDUP_WINDOW_SECONDS = 600  # 超过这么多秒没有再出现的消息不再参与比较
+DEDUP_SIMILARITY = 0.8  # 内容相似度（字符二元组的Jaccard相似度）达到该值即视为重复
+
+# 长聊天记录分段总结配置
+CHAT_LOG_TOKEN_BUDGET = 30000  # 聊天记录部分的token预算（离线估算），超出时先去掉低信息量的内容，仍然超出时分段总结或截断
+ENABLE_MAP_REDUCE = True  # 聊天记录压缩后仍超出预算时是否分段总结后再合并，关闭时截断过长的聊天记录
+MAP_CHUNK_SIZE = 20000  # 每段聊天记录的最大长度(字符)
+
+# 摘要缓存配置
+ENABLE_SUMMARY_CACHE = True  # 聊天记录和提示词都没有变化时直接使用缓存的摘要，不再调用AI接口
+SUMMARY_CACHE_TTL = 7 * 24 * 3600  # 摘要缓存的有效期(秒)，从最近一次使用开始计算
+SUMMARY_CACHE_MAX_ENTRIES = 500  # 最多缓存的摘要数量，超出时删除最久未使用的缓存
+
+# 图片渲染配置
+BROWSER_POOL_SIZE = 4  # 同时打开的渲染页面数，页面渲染完不关闭，留给之后的日报复用
+BROWSER_IDLE_TIMEOUT = 600  # 浏览器空闲超过这么多秒后自动关闭，下次渲染时重新启动
+RENDER_CONCURRENCY = 0  # 批量生成日报图片时同时渲染的数量，0表示按CPU核数设置，使用浏览器渲染时还受BROWSER_POOL_SIZE限制
+RENDER_READY_TIMEOUT = 5  # 等待页面字体加载完成、布局稳定的最长秒数
+RENDER_FALLBACK_WAIT = 1  # 超过RENDER_READY_TIMEOUT仍未就绪时再固定等待的秒数，之后直接截图
+REPORT_RENDERER = "playwright"  # 图片日报的渲染方式：playwright（浏览器渲染HTML）或pillow（直接绘制，不需要浏览器），未安装Playwright时自动使用pillow
+SAVE_REPORT_HTML = False  # 是否把渲染前的HTML保存到data目录，用于调试日报样式
+
 # 提示词配置
-PROMPT_TEMPLATE = """请根据【{group_name}】今天的聊天记录，整理一份QQ群日报，要求：  
+# 说明部分作为系统消息，所有群完全相同，群号和聊天记录放在后面的用户消息里，AI接口可以缓存相同的开头部分
+SUMMARY_SYSTEM_PROMPT = """请根据用户提供的QQ群今天的聊天记录，整理一份QQ群日报，要求：  
 
 0. 不要使用md格式，直接返回纯文本
 1. **数据必须严格按照下列格式组织**，每个部分必须带明确标题，使用【】符号：
@@ -63,13 +128,35 @@ PROMPT_TEMPLATE = """请根据【{group_name}】今天的聊天记录，整理
 3.
 
 【今日总结】
+"""
 
+# 每个群不同的部分，聊天记录必须放在"聊天记录：\n"之后，请求过大时会从这里开始截断
+SUMMARY_USER_TEMPLATE = """群聊：【{group_name}】
 
+聊天记录：
+{chat_log}
+"""
+
+# 分段总结的提示词配置
+MAP_SYSTEM_PROMPT = """用户会提供QQ群今天的聊天内容按时间顺序分段后的其中一段，请提取这一段的要点，之后会把所有分段的要点合并成一份完整的群日报，要求：
+
+0. 不要使用md格式，直接返回纯文本，不超过600字
+1. 【话题】这一段讨论的主要话题，每个话题一两句话概括，注明大致时间
+2. 【重要消息】通知、决定、活动安排等重要信息，没有则写"无"
+3. 【金句】原文摘录精彩发言，注明发言人
+"""
+
+MAP_USER_TEMPLATE = """群聊：【{group_name}】，第{index}/{total}段（{time_range}）
 
 聊天记录：
 {chat_log}
 """
 
+# 合并分段要点时加在SUMMARY_USER_TEMPLATE前面的说明
+REDUCE_PROMPT_PREFIX = """注意：今天的聊天记录过长，已按时间顺序分成{chunk_count}段分别整理了要点。下面的聊天记录是各段的要点而不是原始消息，请综合所有分段，覆盖全天的内容，不要只关注其中一段。
+
+"""
+
 # HTML直接生成的提示词配置
 PROMPT_HTML_TEMPLATE = """请根据【{group_name}】今天的聊天记录，生成一个精美的苹果风格Bento Grid布局的日报HTML页面，要求：
 
@@ -220,7 +307,7 @@ SIMPLE_DARK_HTML_TEMPLATE = """
     <style>
         @font-face {
             font-family: 'CustomFont';
-            src: url('file://{font_path}') format('truetype');
+            src: url('{font_url}') format('truetype');
             font-weight: normal;
             font-style: normal;
         }
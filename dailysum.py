@@ -1,11 +1,11 @@
 import os
 import re
 import json
+import time
 import datetime
 import asyncio
 import traceback
 from datetime import datetime, timedelta
-import httpx
 from PIL import Image
 import io
 import base64
@@ -32,9 +32,20 @@ from nonebot.message import MessageSegment
 from hoshino import priv, logger, get_bot
 from .config import *
 from .logger_helper import log_debug, log_info, log_warning, log_error_msg, log_critical, logged
+from .log_parser import simplify_cq_code
+from .message_store import load_window_messages, list_groups, save_group_messages, has_group_messages, load_group_messages
+from .message_batch import iter_message_columns, ts_to_hm
+from .log_ingest import ingest_new_logs, explode_log_file, is_day_complete, find_backup_log
+from .message_capture import flush_captured_messages
+from .summary_cache import make_cache_key, get_cached_summary, save_cached_summary
+from .token_budget import LOW_INFO_MESSAGES, estimate_tokens, compact_chat_log, truncate_chat_log
+from .message_dedup import collapse_repeats
+from .rate_limiter import get_ai_limiter
+from .ai_backend import create_ai_client
 
 # 导入HTML图片日报功能所需函数
-from .test_html_report_2 import init_playwright, get_font_path, preprocess_content, html_to_screenshot
+from .test_html_report_2 import init_playwright, get_font_path, get_asset_url, preprocess_content, html_to_png
+from .bento_renderer import render_bento_report
 
 # 初始化Playwright（异步启动）
 async def init_dailysum_playwright():
@@ -43,16 +54,16 @@ async def init_dailysum_playwright():
         await init_playwright()
         log_info("Playwright初始化完成")
     else:
-        log_warning("Playwright未安装，将使用文本方式发送日报")
+        log_warning("Playwright未安装，将使用Pillow绘制图片日报")
 
 # 自定义HTML转图片函数
 async def html_to_image(title, content, date_str):
     """
-    生成HTML报告并转换为图片
+    生成HTML报告并在内存中渲染为图片
     :param title: 标题
     :param content: 内容
     :param date_str: 日期字符串
-    :return: HTML文件路径和图片文件路径的元组
+    :return: PNG图片数据，失败时返回None
     """
     try:
         log_info("开始生成HTML并转换为图片...")
@@ -60,12 +71,13 @@ async def html_to_image(title, content, date_str):
         # 检查内容是否为空
         if not content or not content.strip():
             log_error_msg("内容为空，无法生成HTML")
-            return None, None
+            return None
         
-        # 获取字体路径
+        # 获取字体路径，页面中通过路由地址引用
         font_path = await get_font_path()
         if not font_path:
             log_warning("找不到可用的中文字体")
+        font_url = get_asset_url(font_path) if font_path else ""
         
         # 预处理内容，确保能被正确解析
         processed_content = preprocess_content(content)
@@ -73,7 +85,7 @@ async def html_to_image(title, content, date_str):
         # 如果预处理失败，则使用文本方式生成报告
         if not processed_content:
             log_warning("预处理内容失败，使用文本方式生成报告")
-            return None, None
+            return None
         
         # 解析内容，提取各部分
         log_info("解析内容，提取各部分...")
@@ -90,11 +102,11 @@ async def html_to_image(title, content, date_str):
                 quotes_content=sections["quotes"],
                 summary_content=sections["summary"],
                 date=date_str,
-                font_path=font_path
+                font_url=font_url
             )
         except KeyError as ke:
             log_error_msg(f"格式化HTML时发生KeyError错误: {ke}")
-            log_error_msg(f"尝试的参数: title={title[:20]}..., date={date_str}, font_path={font_path}")
+            log_error_msg(f"尝试的参数: title={title[:20]}..., date={date_str}, font_url={font_url}")
             
             # 第二种尝试方法 - 手动替换关键变量
             try:
@@ -105,63 +117,94 @@ async def html_to_image(title, content, date_str):
                 html_content = html_content.replace("{quotes_content}", sections["quotes"])
                 html_content = html_content.replace("{summary_content}", sections["summary"])
                 html_content = html_content.replace("{date}", date_str)
-                html_content = html_content.replace("{font_path}", font_path)
+                html_content = html_content.replace("{font_url}", font_url)
                 log_info("使用手动替换方法构建HTML成功")
             except Exception as e:
                 log_error_msg(f"手动替换HTML变量失败: {str(e)}")
-                return None, None
-        
-        # 保存HTML文件
-        temp_html_path = os.path.join(DATA_DIR, f"report_{date_str}.html")
-        with open(temp_html_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+                return None
         
-        log_info(f"HTML内容已保存到: {temp_html_path}")
+        # 调试时保存HTML文件，文件名带上标题，不同群的日报不会互相覆盖
+        if SAVE_REPORT_HTML:
+            safe_title = re.sub(r'[^\w-]+', '_', title)[:50]
+            debug_html_path = os.path.join(DATA_DIR, f"report_{date_str}_{safe_title}.html")
+            with open(debug_html_path, 'w', encoding='utf-8') as f:
+                f.write(html_content)
+            log_debug(f"HTML内容已保存到: {debug_html_path}")
         
         # 初始化Playwright
         if not await init_playwright():
             log_warning("初始化Playwright失败，无法生成图片")
-            return temp_html_path, None
+            return None
         
-        # HTML转换为图片
-        temp_img_path = os.path.join(DATA_DIR, f"report_{date_str}.png")
-        if await html_to_screenshot(os.path.abspath(temp_html_path), temp_img_path):
-            # 检查生成的图片文件是否合理
-            try:
-                if os.path.exists(temp_img_path):
-                    file_size = os.path.getsize(temp_img_path)
-                    if file_size < 5000:  # 小于5KB的图片可能是空白或错误
-                        log_warning(f"生成的图片大小异常: {file_size} 字节，可能是空白图片")
-                        return temp_html_path, None
-                    
-                    # 尝试用PIL打开检查图片是否有效
-                    from PIL import Image
-                    try:
-                        with Image.open(temp_img_path) as img:
-                            width, height = img.size
-                            if width < 100 or height < 100:
-                                log_warning(f"生成的图片尺寸异常: {width}x{height}，可能是无效图片")
-                                return temp_html_path, None
-                            log_info(f"图片检查成功: 大小 {file_size/1024:.2f} KB, 尺寸 {width}x{height}")
-                    except Exception as e:
-                        log_warning(f"图片验证失败: {str(e)}")
-                        return temp_html_path, None
-                    
-                    return temp_html_path, temp_img_path
-                else:
-                    log_warning("图片生成函数返回成功，但文件不存在")
-                    return temp_html_path, None
-            except Exception as e:
-                log_warning(f"验证图片时出错: {str(e)}")
-                return temp_html_path, None
-        else:
-            return temp_html_path, None
+        # HTML在内存中渲染为图片
+        image_data = await html_to_png(html_content)
+        if image_data and validate_image_data(image_data):
+            return image_data
+        return None
     except Exception as e:
         import traceback
         error_msg = traceback.format_exc()
         log_error_msg(f"HTML转图片过程中出错: {str(e)}")
         log_error_msg(f"完整错误堆栈:\n{error_msg}")
-        return None, None
+        return None
+
+# 不经过浏览器直接绘制日报图片
+async def render_report_with_pillow(title, content, date_str):
+    """
+    用Pillow直接绘制Bento Grid日报，不需要启动浏览器
+    :param title: 标题
+    :param content: 内容
+    :param date_str: 日期字符串
+    :return: PNG图片数据，失败时返回None
+    """
+    try:
+        log_info("开始使用Pillow绘制日报图片...")
+        
+        font_path = await get_font_path()
+        if not font_path:
+            log_warning("找不到可用的中文字体，无法绘制图片")
+            return None
+        
+        processed_content = preprocess_content(content)
+        if not processed_content:
+            log_warning("预处理内容失败，使用文本方式生成报告")
+            return None
+        sections = parse_content_sections(processed_content)
+        
+        # 绘制是CPU密集的操作，放到线程池中执行，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        image_data = await loop.run_in_executor(
+            None, render_bento_report, title, sections, date_str, font_path
+        )
+        if image_data and validate_image_data(image_data):
+            return image_data
+        return None
+    except Exception as e:
+        log_error_msg(f"Pillow绘制图片过程中出错: {str(e)}")
+        log_error_msg(traceback.format_exc())
+        return None
+
+# 检查图片数据是否有效
+def validate_image_data(image_data):
+    """
+    检查生成的图片数据，过小的数据或尺寸通常是空白或错误的图片
+    :param image_data: 图片数据
+    :return: 是否有效
+    """
+    if len(image_data) < 5000:  # 小于5KB的图片可能是空白或错误
+        log_warning(f"生成的图片大小异常: {len(image_data)} 字节，可能是空白图片")
+        return False
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            width, height = img.size
+    except Exception as e:
+        log_warning(f"图片验证失败: {str(e)}")
+        return False
+    if width < 100 or height < 100:
+        log_warning(f"生成的图片尺寸异常: {width}x{height}，可能是无效图片")
+        return False
+    log_info(f"图片检查成功: 大小 {len(image_data) / 1024:.2f} KB, 尺寸 {width}x{height}")
+    return True
 
 # 解析内容，提取各部分
 def parse_content_sections(content):
@@ -321,195 +364,12 @@ os.makedirs(DATA_DIR, exist_ok=True)
 LOG_DIR = os.path.join(os.path.dirname(__file__), 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
 
-LOG_PATTERN = r'\[(.*?) nonebot\] INFO: Self: (.*?), Message (.*?) from (.*?)@\[群:(.*?)\]: \'(.*?)\'$'
+# AI客户端实例，按配置选择接口
+ai_client = create_ai_client()
 
-# 深度学习客户端
-class DeepSeekClient:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self.base_url = "https://api.deepseek.com/v1/chat/completions"
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        log_info(f"DeepSeekClient 初始化完成，API Key: {'已设置' if api_key else '未设置'}")
-        
-    async def generate(self, prompt, model=AI_MODEL, temperature=AI_TEMPERATURE, max_retries=3, timeout=120.0):
-        log_info(f"开始生成AI摘要，模型: {model}, 温度: {temperature}")
-        log_debug(f"提示词: {prompt[:200]}...")
-        
-        # 记录请求数据大小
-        request_size = len(prompt.encode('utf-8'))
-        log_info(f"请求数据大小: {request_size / 1024:.2f} KB")
-        
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                log_debug(f"尝试API请求 (尝试 {retry_count + 1}/{max_retries})...")
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        self.base_url,
-                        headers=self.headers,
-                        json={
-                            "model": model,
-                            "messages": [{"role": "user", "content": prompt}],
-                            "temperature": temperature
-                        },
-                        timeout=timeout
-                    )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result["choices"][0]["message"]["content"]
-                    log_info(f"AI生成成功，生成内容长度: {len(content)}")
-                    log_debug(f"生成内容前100字符: {content[:100]}...")
-                    return content
-                elif response.status_code == 400:
-                    # 如果是请求过大的错误，尝试减少输入长度
-                    log_warning(f"请求数据过大 (状态码: {response.status_code})，尝试减少输入大小")
-                    
-                    # 裁剪提示词到原来的70%
-                    prompt_parts = prompt.split("聊天记录：\n")
-                    if len(prompt_parts) == 2:
-                        instruction, chat_log = prompt_parts
-                        # 保留前70%的聊天记录
-                        reduced_chat_log = chat_log[:int(len(chat_log) * 0.7)]
-                        prompt = f"{instruction}聊天记录：\n{reduced_chat_log}\n\n[注: 由于长度限制，仅显示部分聊天记录]"
-                        log_info(f"提示词已减少到原来的70%，新大小: {len(prompt.encode('utf-8')) / 1024:.2f} KB")
-                    else:
-                        log_error_msg("无法裁剪提示词，格式不符合预期")
-                        return None
-                else:
-                    log_error_msg(f"DeepSeek API调用失败: {response.status_code} {response.text}")
-                    # 如果不是400错误，可能是其他API问题，尝试重试
-                    retry_count += 1
-                    await asyncio.sleep(2)  # 等待2秒再重试
-            except httpx.TimeoutException:
-                log_warning(f"API请求超时，尝试重试 ({retry_count + 1}/{max_retries})")
-                retry_count += 1
-                await asyncio.sleep(2)  # 等待2秒再重试
-            except Exception as e:
-                log_error_msg(f"DeepSeek API调用出错: {str(e)}")
-                log_error_msg(traceback.format_exc())
-                retry_count += 1
-                await asyncio.sleep(2)  # 等待2秒再重试
-        
-        log_error_msg(f"达到最大重试次数 ({max_retries})，AI生成失败")
-        return None
-
-# AI客户端实例
-ai_client = DeepSeekClient(AI_API_KEY)
-
-# 从系统日志获取群聊消息
-@logged
-async def parse_syslog(log_path, start_time=None, end_time=None, target_group=None):
-    """
-    解析系统日志，提取群聊消息
-    :param log_path: 日志文件路径
-    :param start_time: 开始时间，格式为datetime对象
-    :param end_time: 结束时间，格式为datetime对象
-    :param target_group: 目标群号，为None时解析所有群
-    :return: 解析后的群聊消息字典，格式为 {群号: [{时间, QQ号, 消息内容}, ...]}
-    """
-    if not os.path.exists(log_path):
-        log_error_msg(f"日志文件不存在: {log_path}")
-        return {}
-    
-    log_info(f"开始解析日志文件: {log_path}")
-    log_info(f"时间范围: {start_time} - {end_time}")
-    
-    group_messages = {}
-    line_count = 0
-    matched_count = 0
-    
-    try:
-        # 尝试不同的编码方式
-        encodings = ['utf-8', 'gb18030', 'gbk', 'cp936', 'iso-8859-1']
-        
-        for encoding in encodings:
-            try:
-                log_info(f"尝试使用 {encoding} 编码读取日志文件")
-                with open(log_path, 'r', encoding=encoding, errors='ignore') as f:
-                    for line in f:
-                        line_count += 1
-                        
-                        # 每处理10000行记录一次进度
-                        if line_count % 10000 == 0:
-                            log_debug(f"已处理 {line_count} 行日志，找到 {matched_count} 条群聊消息")
-                        
-                        # 仅处理可能包含群聊消息的行
-                        if 'nonebot' not in line or 'Message' not in line or '@[群:' not in line:
-                            continue
-                        
-                        match = re.search(LOG_PATTERN, line)
-                        if not match:
-                            continue
-                        
-                        matched_count += 1
-                        
-                        # 解析日志
-                        try:
-                            log_time_str, self_id, msg_id, sender_info, group_id, content = match.groups()
-                            
-                            # 解析日志时间
-                            try:
-                                log_time = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S,%f')
-                            except ValueError:
-                                # 尝试其他可能的时间格式
-                                try:
-                                    log_time = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
-                                except ValueError:
-                                    log_warning(f"无法解析日志时间: {log_time_str}，跳过该行")
-                                    continue
-                            
-                            # 时间过滤
-                            if start_time and log_time < start_time:
-                                continue
-                            if end_time and log_time > end_time:
-                                continue
-                            
-                            # 群号过滤
-                            if target_group and group_id != target_group:
-                                continue
-                            
-                            # 解析发送者QQ号
-                            sender_qq = sender_info.split('@')[0]
-                            
-                            # 简化CQ码内容
-                            simplified_content = simplify_cq_code(content)
-                            
-                            # 将消息添加到对应群
-                            if group_id not in group_messages:
-                                group_messages[group_id] = []
-                            
-                            group_messages[group_id].append({
-                                'time': log_time.strftime('%Y-%m-%d %H:%M:%S'),
-                                'qq': sender_qq,
-                                'content': simplified_content
-                            })
-                        except Exception as e:
-                            log_error_msg(f"解析日志行出错: {str(e)}，行内容: {line[:100]}")
-                            continue
-                            
-                # 如果成功读取并找到消息，跳出编码尝试循环
-                if matched_count > 0:
-                    log_info(f"使用编码 {encoding} 成功解析日志")
-                    break
-            except UnicodeDecodeError:
-                log_warning(f"使用 {encoding} 编码读取日志文件失败，尝试下一种编码")
-            except Exception as e:
-                log_error_msg(f"读取日志文件出错: {str(e)}")
-                log_error_msg(traceback.format_exc())
-        
-        log_info(f"日志解析完成，共处理 {line_count} 行，找到 {matched_count} 条群聊消息")
-        log_info(f"解析出 {len(group_messages)} 个群的消息")
-        for group_id, messages in group_messages.items():
-            log_info(f"群 {group_id}: {len(messages)} 条消息")
-    except Exception as e:
-        log_error_msg(f"解析日志文件出错: {str(e)}")
-        log_error_msg(traceback.format_exc())
-    
-    return group_messages
+# 关闭AI客户端，机器人退出时调用
+async def close_ai_client():
+    await ai_client.aclose()
 
 # 保存群聊日志到文件
 @logged
@@ -521,105 +381,102 @@ async def save_group_logs(group_messages, date_str):
     """
     log_info(f"开始保存群聊日志，日期: {date_str}")
     
-    # 确保data目录存在
-    os.makedirs(DATA_DIR, exist_ok=True)
-    
     for group_id, messages in group_messages.items():
         if not messages:
             log_warning(f"群 {group_id} 没有消息，跳过保存")
             continue
         
-        # 简化CQ码
-        simplified_messages = []
-        for msg in messages:
-            simplified_msg = msg.copy()  # 创建消息的副本
-            simplified_msg['content'] = simplify_cq_code(msg['content'])  # 简化内容
-            simplified_messages.append(simplified_msg)
-        
-        file_path = os.path.join(DATA_DIR, f"{group_id}_{date_str}.json")
-        log_info(f"保存群聊日志到文件: {file_path}")
-        
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(simplified_messages, f, ensure_ascii=False, indent=2)
-            log_info(f"保存群 {group_id} 的日志到 {file_path}，共 {len(simplified_messages)} 条消息")
+            # 消息在解析时已经简化过CQ码，这里直接保存
+            save_group_messages(group_id, date_str, messages)
+            log_info(f"保存群 {group_id} 的日志，日期: {date_str}，共 {len(messages)} 条消息")
         except Exception as e:
             log_error_msg(f"保存群聊日志出错: {str(e)}")
             log_error_msg(traceback.format_exc())
 
+# 准备某天的聊天记录
+async def prepare_day_messages(date_str):
+    """
+    确保指定日期的聊天记录已经拆分保存
+    :param date_str: 日期字符串，格式为'YYYY-MM-DD'
+    """
+    # 启用实时捕获时，当天的记录已经按群按天保存，写入缓存即可
+    if date_str == datetime.now().strftime('%Y-%m-%d'):
+        if ENABLE_MESSAGE_CAPTURE:
+            log_info("当天记录来自实时捕获的群消息")
+            await flush_captured_messages()
+        # 当天日志从系统日志增量解析，只处理上次解析之后新增的内容
+        elif os.path.exists(LOG_PATH):
+            log_info(f"当天日志从系统日志增量获取: {LOG_PATH}")
+            await ingest_new_logs(LOG_PATH)
+        else:
+            log_error_msg(f"系统日志路径不存在: {LOG_PATH}")
+        return
+    
+    # 历史日志优先读取已拆分好的记录
+    if is_day_complete(date_str):
+        log_info(f"{date_str} 的聊天记录已完整拆分，直接读取本地记录")
+        return
+    
+    # 每份备份日志都是当时系统日志的完整副本，优先拆分最新的一份
+    # 二分查找跳过该日期之前的内容，一次解析即可覆盖该日期及之后的所有日期
+    day_start = datetime.strptime(date_str, '%Y-%m-%d')
+    backup_log_paths = [find_backup_log(LOG_DIR, date_str), os.path.join(LOG_DIR, f"run_log_{date_str}.log")]
+    for backup_log_path in dict.fromkeys(backup_log_paths):
+        if not backup_log_path or not os.path.exists(backup_log_path):
+            continue
+        log_info(f"历史日志从备份文件获取: {backup_log_path}")
+        await explode_log_file(backup_log_path, start_time=day_start)
+        if is_day_complete(date_str):
+            return
+    
+    log_warning(f"备份日志中没有 {date_str} 的完整记录")
+    
+    # 最后尝试从系统日志获取历史记录（如果系统日志未被清理），同样只解析新增内容
+    # 启用实时捕获时系统日志中的消息已经被捕获过，不再解析，避免重复
+    if ENABLE_MESSAGE_CAPTURE:
+        await flush_captured_messages()
+    elif os.path.exists(LOG_PATH):
+        log_info(f"尝试从系统日志获取历史记录: {LOG_PATH}")
+        await ingest_new_logs(LOG_PATH)
+    else:
+        log_error_msg(f"系统日志路径不存在: {LOG_PATH}")
+
 # 分割日志文件
 @logged
-async def split_log_files(day_offset=0, target_group=None):
+async def split_log_files(day_offset=0, target_group=None, start_time=None, end_time=None):
     """
-    分割日志文件，提取指定日期的群聊消息
+    分割日志文件，提取指定日期或指定时间范围的群聊消息
     :param day_offset: 日期偏移，0表示今天，1表示昨天，以此类推
     :param target_group: 目标群号，为None时解析所有群
+    :param start_time: 开始时间，格式为datetime对象，为None时使用day_offset对应日期的0点
+    :param end_time: 结束时间（包含），格式为datetime对象，为None时使用day_offset对应日期的23:59:59
     """
     # 计算日期范围
-    now = datetime.now()
-    target_date = now - timedelta(days=day_offset)
-    start_time = datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0)
-    end_time = datetime(target_date.year, target_date.month, target_date.day, 23, 59, 59)
-    date_str = target_date.strftime('%Y-%m-%d')
+    if start_time is None or end_time is None:
+        target_date = datetime.now() - timedelta(days=day_offset)
+        start_time = datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0)
+        end_time = datetime(target_date.year, target_date.month, target_date.day, 23, 59, 59)
+    date_str = start_time.strftime('%Y-%m-%d')
     
     log_info(f"开始分割日志文件，目标日期: {date_str}")
     log_info(f"日期偏移: {day_offset}，时间范围: {start_time} - {end_time}")
     
-    # 选择日志源
-    log_source = None
-    group_messages = {}
-    
-    # 当天日志从系统日志获取
-    if day_offset == 0:
-        if os.path.exists(LOG_PATH):
-            log_source = LOG_PATH
-            log_info(f"当天日志从系统日志获取: {log_source}")
-        else:
-            log_error_msg(f"系统日志路径不存在: {LOG_PATH}")
-    # 历史日志从备份文件获取
-    else:
-        # 尝试从备份目录查找日志
-        backup_log_path = os.path.join(LOG_DIR, f"run_log_{date_str}.log")
-        if os.path.exists(backup_log_path):
-            log_source = backup_log_path
-            log_info(f"历史日志从备份文件获取: {log_source}")
-        else:
-            log_warning(f"备份日志文件不存在: {backup_log_path}")
-            
-            # 如果没有备份日志，先检查是否已存在解析好的群聊记录
-            if target_group:
-                local_log_path = os.path.join(DATA_DIR, f"{target_group}_{date_str}.json")
-                if os.path.exists(local_log_path):
-                    log_info(f"在本地找到目标群 {target_group} 的聊天记录文件: {local_log_path}")
-                    try:
-                        with open(local_log_path, 'r', encoding='utf-8') as f:
-                            messages = json.load(f)
-                        group_messages = {target_group: messages}
-                        log_info(f"成功从本地文件加载群 {target_group} 的聊天记录，共 {len(messages)} 条消息")
-                        return group_messages, date_str
-                    except Exception as e:
-                        log_error_msg(f"加载本地聊天记录文件失败: {str(e)}")
-            
-            # 最后尝试从系统日志获取历史记录（如果系统日志未被清理）
-            if os.path.exists(LOG_PATH):
-                log_source = LOG_PATH
-                log_info(f"备份日志不存在，尝试从系统日志获取历史记录: {log_source}")
-            else:
-                log_error_msg(f"系统日志和备份日志都不存在")
+    # 从最近的一天开始准备，当天的增量解析往往已经让之前的日期完整，无需再拆分备份日志
+    day = end_time.date()
+    while day >= start_time.date():
+        await prepare_day_messages(day.strftime('%Y-%m-%d'))
+        day -= timedelta(days=1)
     
-    # 如果找到了日志源，则解析日志
-    if log_source:
-        log_info(f"开始从日志源解析群聊消息: {log_source}")
-        group_messages = await parse_syslog(log_source, start_time, end_time, target_group)
+    # 时间范围内的记录从归档数据库中按索引读取
+    loop = asyncio.get_event_loop()
+    group_messages = await loop.run_in_executor(None, load_window_messages, start_time, end_time, target_group)
     
     # 检查是否有消息
     if not group_messages:
         log_warning(f"没有找到任何群的聊天记录，日期: {date_str}")
         return await load_test_data(date_str)
     
-    # 保存群聊日志
-    await save_group_logs(group_messages, date_str)
-    
     return group_messages, date_str
 
 @logged
@@ -651,92 +508,63 @@ async def load_test_data(date_str):
     
     return group_messages, date_str
 
-# 处理CQ码图片链接，将其简化为[图片]标识
-def simplify_cq_code(content):
-    """
-    将CQ码简化为简单标识
-    :param content: 消息内容
-    :return: 简化后的消息内容
-    """
-    if not isinstance(content, str):
-        return content
-    
-    # 匹配常见的CQ码类型
-    content = re.sub(r'\[CQ:image[^\]]+\]', '[图片]', content)
-    content = re.sub(r'\[CQ:face[^\]]+\]', '[表情]', content)
-    content = re.sub(r'\[CQ:at[^\]]+\]', '[有人@]', content)
-    content = re.sub(r'\[CQ:share[^\]]+\]', '[分享]', content)
-    content = re.sub(r'\[CQ:record[^\]]+\]', '[语音]', content)
-    content = re.sub(r'\[CQ:video[^\]]+\]', '[视频]', content)
-    content = re.sub(r'\[CQ:xml[^\]]+\]', '[XML卡片]', content)
-    content = re.sub(r'\[CQ:json[^\]]+\]', '[JSON卡片]', content)
-    content = re.sub(r'\[CQ:music[^\]]+\]', '[音乐]', content)
-    content = re.sub(r'\[CQ:reply[^\]]+\]', '[回复]', content)
-    content = re.sub(r'\[CQ:forward[^\]]+\]', '[合并转发]', content)
-    content = re.sub(r'\[CQ:redbag[^\]]+\]', '[红包]', content)
-    
-    # 处理其他未知类型的CQ码
-    content = re.sub(r'\[CQ:[^\]]+\]', '[特殊消息]', content)
-    
-    # 去除过长的URL链接
-    content = re.sub(r'https?://\S{30,}', '[链接]', content)
-    
-    # 去除连续的空行
-    content = re.sub(r'\n{3,}', '\n\n', content)
-    
-    return content
-
 # 优化聊天记录格式
 def optimize_chat_format(messages):
     """
     优化聊天记录格式，减少冗余信息，压缩数据
-    :param messages: 原始聊天记录列表
+    :param messages: 消息批次，也可以是消息字典列表或逐条产出消息的迭代器
     :return: 优化后的聊天记录文本
     """
-    if not messages:
-        return ""
-    
     optimized_logs = []
     current_speaker = None
     combined_messages = []
-    last_time = None
+    last_ts = None
     
     # 过滤无意义的短消息和表情包
+    # 原始消息只在过滤结果可能不足10条时才需要保留，用于下面的回退
     filtered_messages = []
-    for msg in messages:
-        content = simplify_cq_code(msg['content'])
+    raw_messages = []
+    total_count = 0
+    for ts, qq, content in iter_message_columns(messages):
+        total_count += 1
+        # 保存的记录已经简化过CQ码，这里只处理没有简化过的测试数据，简化结果有缓存
+        content = simplify_cq_code(content)
+        if raw_messages is not None:
+            raw_messages.append((ts, qq, content))
+            if len(filtered_messages) >= 10:
+                raw_messages = None
         # 过滤仅包含表情、短回复的无意义消息
-        if content in ['[表情]', '[图片]', '6', '？', '?', '。', '哦', '嗯', '啊', 'ok', '666', '???']:
+        if content in LOW_INFO_MESSAGES:
             continue
         # 过滤极短消息（少于2个字符）
         if len(content) < 2:
             continue
-        filtered_messages.append({
-            'time': msg['time'],
-            'qq': msg['qq'],
-            'content': content
-        })
+        filtered_messages.append((ts, qq, content))
+    
+    if total_count == 0:
+        return ""
     
     # 如果过滤后消息太少，使用原始消息
-    if len(filtered_messages) < len(messages) * 0.3 and len(filtered_messages) < 10:
-        filtered_messages = messages
+    if len(filtered_messages) < total_count * 0.3 and len(filtered_messages) < 10:
+        filtered_messages = raw_messages
     
-    for msg in filtered_messages:
-        time_str = msg['time'].split(' ')[1][:5]  # 只取HH:MM部分
-        speaker = msg['qq']
-        content = simplify_cq_code(msg['content'])
+    # 合并复读、刷屏等重复消息
+    if ENABLE_MESSAGE_DEDUP:
+        filtered_messages = collapse_repeats(filtered_messages)
+    
+    for ts, speaker, content in filtered_messages:
+        time_str = ts_to_hm(ts)  # 只取HH:MM部分
         
-        # 如果距离上一条消息时间超过5分钟，不合并
-        current_time = datetime.strptime(msg['time'], '%Y-%m-%d %H:%M:%S')
-        if last_time and (current_time - last_time).seconds > 300:  # 5分钟 = 300秒
+        # 如果距离上一条消息时间超过5分钟（或时间倒退），不合并
+        if last_ts is not None and not 0 <= ts - last_ts <= 300:  # 5分钟 = 300秒
             # 处理之前累积的消息
             if combined_messages:
                 combined_content = " | ".join(combined_messages)
-                optimized_logs.append(f"[{last_time.strftime('%H:%M')}] {current_speaker}: {combined_content}")
+                optimized_logs.append(f"[{ts_to_hm(last_ts)}] {current_speaker}: {combined_content}")
                 combined_messages = []
             current_speaker = None  # 重置当前发言人
         
-        last_time = current_time
+        last_ts = ts
         
         # 如果是同一个发言人的连续消息且内容不太长，合并处理
         if speaker == current_speaker and len(combined_messages) < 3 and sum(len(m) for m in combined_messages) < 100:
@@ -753,77 +581,190 @@ def optimize_chat_format(messages):
     
     # 处理最后一组消息
     if combined_messages:
-        time_str = last_time.strftime('%H:%M') if last_time else "00:00"
+        time_str = ts_to_hm(last_ts) if last_ts is not None else "00:00"
         combined_content = " | ".join(combined_messages)
         optimized_logs.append(f"[{time_str}] {current_speaker}: {combined_content}")
     
     return "\n".join(optimized_logs)
 
+# 优化后的聊天记录行首的时间
+CHAT_TIME_REGEX = re.compile(r'^\[(\d{2}:\d{2})\]')
+
+# 把内容按顺序分组
+def group_chunks(items, chunk_size, separator):
+    """
+    把按时间顺序排列的内容依次分组，每组总长度不超过chunk_size
+    :param items: [(文本, 开始时间, 结束时间), ...]
+    :param chunk_size: 每组的最大长度
+    :param separator: 组内文本的分隔符
+    :return: [(分组文本, 开始时间, 结束时间), ...]
+    """
+    chunks = []
+    group = []
+    size = 0
+    for item in items:
+        if group and size + len(separator) + len(item[0]) > chunk_size:
+            chunks.append((separator.join(text for text, _, _ in group), group[0][1], group[-1][2]))
+            group = []
+            size = 0
+        group.append(item)
+        size += len(separator) + len(item[0])
+    if group:
+        chunks.append((separator.join(text for text, _, _ in group), group[0][1], group[-1][2]))
+    return chunks
+
+# 总结一段聊天记录
+async def summarize_chunk(group_id, chunk, index, total):
+    """
+    总结一段聊天记录（或上一轮的要点），并发请求数由全局AI限流器控制
+    :return: (带时间范围标题的要点, 开始时间, 结束时间)，失败时返回None
+    """
+    text, start, end = chunk
+    time_range = f"{start}-{end}"
+    prompt = MAP_USER_TEMPLATE.format(
+        group_name=group_id,
+        index=index,
+        total=total,
+        time_range=time_range,
+        chat_log=text
+    )
+    log_info(f"群 {group_id} 开始总结第 {index}/{total} 段 ({time_range})，长度: {len(text)}")
+    partial = await ai_client.generate(prompt, system_prompt=MAP_SYSTEM_PROMPT)
+    if not partial:
+        log_warning(f"群 {group_id} 第 {index}/{total} 段 ({time_range}) 总结失败")
+        return None
+    return f"【{time_range}】\n{partial.strip()}", start, end
+
+# 分段总结后合并
+async def map_reduce_summary(group_id, chat_log):
+    """
+    把过长的聊天记录按时间顺序分段，各段并发总结后再合并为完整的日报
+    要点合并后仍然过长时继续分组总结，直到可以一次合并
+    :param group_id: 群号
+    :param chat_log: 优化后的聊天记录文本
+    :return: (摘要内容, 是否所有分段都总结成功)，失败时摘要内容为None
+    """
+    # 每一行带上所在的时间，没有时间的行是上一条消息的后续内容
+    items = []
+    last_time = "00:00"
+    for line in chat_log.split("\n"):
+        match = CHAT_TIME_REGEX.match(line)
+        if match:
+            last_time = match.group(1)
+        items.append((line[:MAP_CHUNK_SIZE], last_time, last_time))
+    
+    separator = "\n"
+    level = 1
+    complete = True
+    while True:
+        chunks = group_chunks(items, MAP_CHUNK_SIZE, separator)
+        log_info(f"群 {group_id} 第 {level} 轮分段总结，共 {len(chunks)} 段")
+        results = await asyncio.gather(*[
+            summarize_chunk(group_id, chunk, i + 1, len(chunks)) for i, chunk in enumerate(chunks)
+        ])
+        partials = [result for result in results if result]
+        if not partials:
+            log_error_msg(f"群 {group_id} 所有分段总结均失败")
+            return None, False
+        if len(partials) < len(results):
+            complete = False
+            log_warning(f"群 {group_id} 有 {len(results) - len(partials)} 段总结失败，这些时段将不会出现在日报中")
+        
+        partial_log = "\n\n".join(text for text, _, _ in partials)
+        # 要点已经足够短，或者分组后没有变少时不再继续
+        if estimate_tokens(partial_log) <= CHAT_LOG_TOKEN_BUDGET or len(partials) == 1 or len(chunks) >= len(items):
+            break
+        items = partials
+        separator = "\n\n"
+        level += 1
+    
+    prompt = REDUCE_PROMPT_PREFIX.format(chunk_count=len(partials)) + SUMMARY_USER_TEMPLATE.format(
+        group_name=group_id,
+        chat_log=partial_log
+    )
+    log_info(f"群 {group_id} 开始合并 {len(partials)} 段要点，长度: {len(partial_log)}")
+    return await ai_client.generate(prompt, system_prompt=SUMMARY_SYSTEM_PROMPT), complete
+
 # 生成群聊摘要
 @logged
-async def generate_summary(group_id, date_str):
+async def generate_summary(group_id, date_str, messages=None, force_refresh=False):
     """
     生成群聊摘要
     :param group_id: 群号
     :param date_str: 日期字符串
+    :param messages: 已经读取的聊天记录，为None时读取该群该日期保存的记录
+    :param force_refresh: 是否忽略缓存重新生成
     :return: 摘要内容
     """
     log_info(f"开始生成群聊摘要，群: {group_id}, 日期: {date_str}")
     
-    file_path = os.path.join(DATA_DIR, f"{group_id}_{date_str}.json")
-    
-    if not os.path.exists(file_path):
-        log_error_msg(f"群聊日志文件不存在: {file_path}")
+    if messages is None and not has_group_messages(group_id, date_str):
+        log_error_msg(f"群 {group_id} 在 {date_str} 的聊天记录不存在")
         return None
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            messages = json.load(f)
-        
-        log_info(f"读取群聊日志文件成功，共 {len(messages)} 条消息")
+        # 构建优化后的聊天记录格式
+        if messages is None:
+            messages = load_group_messages(group_id, date_str)
+        chat_log = optimize_chat_format(messages)
         
-        if not messages:
+        if not chat_log:
             log_warning(f"群 {group_id} 在 {date_str} 没有聊天记录")
             return None
         
-        # 使用优化的聊天记录格式
-        chat_log = optimize_chat_format(messages)
-        log_info(f"构建聊天记录文本完成，长度: {len(chat_log)}")
-        
-        # 如果聊天记录过长，进行截断处理
-        MAX_CHAT_LOG_LENGTH = 50000  # 最大聊天记录长度限制，防止API调用失败
+        tokens = estimate_tokens(chat_log)
+        log_info(f"构建聊天记录文本完成，长度: {len(chat_log)}，估算 {tokens} tokens")
         
-        if len(chat_log) > MAX_CHAT_LOG_LENGTH:
-            log_warning(f"聊天记录超出长度限制 ({len(chat_log)} > {MAX_CHAT_LOG_LENGTH})，将进行截断")
-            
-            # 方式一：保留前后部分
-            # prefix = chat_log[:MAX_CHAT_LOG_LENGTH // 4]
-            # suffix = chat_log[-MAX_CHAT_LOG_LENGTH // 4:]
-            # chat_log = f"{prefix}\n...\n[中间{len(chat_log) - len(prefix) - len(suffix)}字符被省略]\n...\n{suffix}"
-            
-            # 方式二：直接截断尾部
-            chat_log = chat_log[:MAX_CHAT_LOG_LENGTH]
-            chat_log += "\n\n[由于长度限制，部分消息被省略]"
-            
-            log_info(f"截断后的聊天记录长度: {len(chat_log)}")
+        # 超出token预算时先去掉低信息量的内容，尽量让第一次请求就能放下
+        if tokens > CHAT_LOG_TOKEN_BUDGET:
+            chat_log = compact_chat_log(chat_log, CHAT_LOG_TOKEN_BUDGET)
+            tokens = estimate_tokens(chat_log)
+            log_info(f"聊天记录超出token预算 ({CHAT_LOG_TOKEN_BUDGET})，压缩后长度: {len(chat_log)}，估算 {tokens} tokens")
         
-        log_debug(f"聊天记录前200字符: {chat_log[:200]}...")
+        # 聊天记录、提示词和模型参数都没有变化时直接使用缓存的摘要
+        use_map_reduce = ENABLE_MAP_REDUCE and tokens > CHAT_LOG_TOKEN_BUDGET
+        cache_key = None
+        if ENABLE_SUMMARY_CACHE:
+            # token预算决定了聊天记录被截断的位置，也计入缓存键
+            template = f"{CHAT_LOG_TOKEN_BUDGET}\n{SUMMARY_SYSTEM_PROMPT}\n{SUMMARY_USER_TEMPLATE}"
+            if use_map_reduce:
+                template = f"{MAP_CHUNK_SIZE}\n{MAP_SYSTEM_PROMPT}\n{MAP_USER_TEMPLATE}\n{REDUCE_PROMPT_PREFIX}\n{template}"
+            cache_key = make_cache_key(group_id, chat_log, template, f"{AI_BACKEND}:{AI_BASE_URL}:{AI_MODEL}", AI_TEMPERATURE)
+            if not force_refresh:
+                summary = get_cached_summary(cache_key)
+                if summary:
+                    log_info(f"使用缓存的摘要，群: {group_id}, 日期: {date_str}")
+                    return summary
         
         # 检查API Key
-        if not AI_API_KEY:
-            log_error_msg("DeepSeek API Key未设置，无法生成摘要")
+        if not AI_API_KEY and AI_BACKEND != 'mock':
+            log_error_msg("AI API Key未设置，无法生成摘要")
             return None
         
-        # 构建提示词
-        prompt = PROMPT_TEMPLATE.format(
-            group_name=group_id,  # 这里用群号代替群名，实际应用中可以获取真实群名
-            chat_log=chat_log
-        )
-        log_info("构建提示词完成")
-        
-        # 调用AI生成摘要
-        log_info("开始调用AI生成摘要...")
-        summary = await ai_client.generate(prompt)
+        # 聊天记录过长时分段总结后再合并，覆盖全天的内容
+        complete = True
+        if use_map_reduce:
+            log_info(f"聊天记录超出token预算 ({tokens} > {CHAT_LOG_TOKEN_BUDGET})，将分段总结后合并")
+            summary, complete = await map_reduce_summary(group_id, chat_log)
+        else:
+            # 如果聊天记录过长，按token预算截断尾部，防止API调用失败
+            if tokens > CHAT_LOG_TOKEN_BUDGET:
+                log_warning(f"聊天记录超出token预算 ({tokens} > {CHAT_LOG_TOKEN_BUDGET})，将进行截断")
+                chat_log = truncate_chat_log(chat_log, CHAT_LOG_TOKEN_BUDGET)
+                log_info(f"截断后的聊天记录长度: {len(chat_log)}")
+            
+            log_debug(f"聊天记录前200字符: {chat_log[:200]}...")
+            
+            # 构建提示词
+            prompt = SUMMARY_USER_TEMPLATE.format(
+                group_name=group_id,  # 这里用群号代替群名，实际应用中可以获取真实群名
+                chat_log=chat_log
+            )
+            log_info("构建提示词完成")
+            
+            # 调用AI生成摘要
+            log_info("开始调用AI生成摘要...")
+            summary = await ai_client.generate(prompt, system_prompt=SUMMARY_SYSTEM_PROMPT)
         
         if not summary:
             log_error_msg(f"AI生成摘要失败")
@@ -832,6 +773,12 @@ async def generate_summary(group_id, date_str):
         log_info(f"AI生成摘要成功，长度: {len(summary)}")
         log_debug(f"摘要前200字符: {summary[:200]}...")
         
+        # 有分段总结失败时摘要缺少部分时段，不缓存，下次重新生成
+        if cache_key and complete:
+            save_cached_summary(cache_key, summary, group_id)
+        elif cache_key:
+            log_warning(f"群 {group_id} 的摘要缺少部分时段，不写入缓存")
+        
         return summary
     except Exception as e:
         log_error_msg(f"生成群聊摘要出错: {str(e)}")
@@ -860,89 +807,72 @@ async def generate_image_summary(title, content, date_str):
         content_preview = content[:100].replace('\n', ' ')
         log_debug(f"原始内容前100字符: {content_preview}...")
         
-        # 优先使用传统HTML转图片功能
-        if PLAYWRIGHT_AVAILABLE:
-            log_info("使用HTML转图片功能生成日报...")
-            
-            # 增加超时处理
-            try:
-                html_path, image_path = await asyncio.wait_for(
-                    html_to_image(title, content, date_str), 
-                    timeout=60.0  # 60秒超时
-                )
-            except asyncio.TimeoutError:
-                log_warning("生成HTML图片超时(60秒)，将使用文本方式发送")
-                return None
-            except Exception as e:
-                log_warning(f"生成HTML图片时发生异常: {str(e)}")
-                return None
-            
-            log_info(f"HTML路径: {html_path}, 图片路径: {image_path}")
-            
-            if not html_path:
-                log_warning("HTML路径为空，预处理内容可能失败")
-                return None
-                
-            if image_path and os.path.exists(image_path):
-                # 检查图片文件大小，确保不是空白图片
-                file_size = os.path.getsize(image_path)
-                log_info(f"生成图片大小: {file_size} 字节")
-                
-                if file_size < 5000:  # 小于5KB的图片可能是空白或错误
-                    log_warning(f"生成的图片大小异常: {file_size} 字节，可能是空白图片")
-                    return None
-                
-                # 读取图片数据
-                try:
-                    with open(image_path, 'rb') as f:
-                        image_data = f.read()
-                except Exception as e:
-                    log_warning(f"读取图片文件失败: {str(e)}")
-                    return None
-                
-                if len(image_data) < 1000:  # 另一个检查点，确保数据不为空
-                    log_warning(f"图片数据异常小: {len(image_data)} 字节")
-                    return None
-                    
-                log_info(f"图片生成成功，大小: {len(image_data) / 1024:.2f} KB")
-                
-                # 尝试打开图片验证是否有效
-                try:
-                    from PIL import Image
-                    with Image.open(io.BytesIO(image_data)) as img:
-                        width, height = img.size
-                        log_info(f"图片有效，尺寸: {width}x{height}")
-                        if width < 100 or height < 100:
-                            log_warning(f"图片尺寸过小: {width}x{height}，可能无效")
-                            return None
-                except Exception as e:
-                    log_warning(f"图片验证失败: {str(e)}")
-                    # 我们仍然继续，因为有些环境可能没有PIL库
-                
-                # 清理临时文件
-                try:
-                    # 保留HTML文件，删除临时图片
-                    os.remove(image_path)
-                    log_info("临时图片文件已清理")
-                except Exception as e:
-                    log_warning(f"清理临时文件失败: {str(e)}")
-                
-                return image_data
-            else:
-                if html_path:
-                    log_warning("HTML文件生成成功，但图片生成失败")
-                else:
-                    log_warning("HTML和图片均生成失败")
-                return None
+        # 配置为pillow或未安装Playwright时直接绘制，否则用浏览器渲染HTML
+        use_pillow = REPORT_RENDERER == 'pillow' or not PLAYWRIGHT_AVAILABLE
+        if use_pillow:
+            log_info("使用Pillow绘制日报图片...")
+            renderer = render_report_with_pillow
         else:
-            log_warning("Playwright未安装，无法生成HTML图片")
+            log_info("使用HTML转图片功能生成日报...")
+            renderer = html_to_image
+        
+        # 增加超时处理
+        try:
+            image_data = await asyncio.wait_for(
+                renderer(title, content, date_str), 
+                timeout=60.0  # 60秒超时
+            )
+        except asyncio.TimeoutError:
+            log_warning("生成图片超时(60秒)，将使用文本方式发送")
+            return None
+        except Exception as e:
+            log_warning(f"生成图片时发生异常: {str(e)}")
             return None
+        
+        if not image_data:
+            log_warning("图片生成失败")
+            return None
+        
+        log_info(f"图片生成成功，大小: {len(image_data) / 1024:.2f} KB")
+        return image_data
             
     except Exception as e:
         log_error_msg(f"生成图片摘要出错: {str(e)}")
         log_error_msg(traceback.format_exc())
         return None
 
+# 批量生成图片日报
+async def render_report_images(jobs):
+    """
+    并发渲染多个群的图片日报，浏览器渲染时共用常驻浏览器的多个页面，Pillow绘制时使用线程池
+    同时渲染的数量不超过RENDER_CONCURRENCY，为0时按CPU核数设置
+    :param jobs: {群号: (标题, 摘要内容, 日期字符串)}
+    :return: {群号: 图片数据}，生成失败的群为None
+    """
+    if not jobs:
+        return {}
+    
+    concurrency = RENDER_CONCURRENCY or os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(concurrency)
+    log_info(f"开始批量渲染 {len(jobs)} 个群的图片日报，并发数: {concurrency}")
+    start = time.monotonic()
+    
+    async def render(group_id, title, content, date_str):
+        async with semaphore:
+            try:
+                return await generate_image_summary(title, content, date_str)
+            except Exception as e:
+                log_error_msg(f"生成群 {group_id} 的图片日报出错: {str(e)}")
+                log_error_msg(traceback.format_exc())
+                return None
+    
+    results = await asyncio.gather(*(render(group_id, *job) for group_id, job in jobs.items()))
+    images = dict(zip(jobs, results))
+    
+    success_count = sum(1 for image_data in results if image_data)
+    log_info(f"批量渲染完成，成功 {success_count}/{len(jobs)} 个，耗时 {time.monotonic() - start:.1f} 秒")
+    return images
+
 # 执行日报生成
 @logged
 async def execute_daily_summary(bot, target_groups=None, day_offset=0, start_hour=4):
@@ -969,8 +899,8 @@ async def execute_daily_summary(bot, target_groups=None, day_offset=0, start_hou
     log_info(f"开始执行日报生成，时间范围: {start_time} - {end_time}")
     log_info(f"目标群: {target_groups if target_groups else '所有群'}")
     
-    # 分割日志文件
-    group_messages, _ = await split_log_files(day_offset)
+    # 分割日志文件，读取整个统计范围内的记录（不包含结束时刻）
+    group_messages, _ = await split_log_files(day_offset, start_time=start_time, end_time=end_time - timedelta(seconds=1))
     
     if not group_messages:
         log_warning(f"没有找到任何群的聊天记录，无法生成日报")
@@ -995,46 +925,45 @@ async def execute_daily_summary(bot, target_groups=None, day_offset=0, start_hou
         
         groups_to_process[group_id] = messages
     
-    # 创建信号量控制并发
+    title = f"{date_str} 群聊日报"
+    message_prefix = f"统计范围：{start_time.strftime('%m-%d %H:%M')} - {end_time.strftime('%m-%d %H:%M')}\n\n"
+    
+    # 第一阶段：并发生成所有群的摘要，AI请求的并发数由全局限流器根据接口状况自动调整
+    async def summarize_group(group_id, messages):
+        log_info(f"为群 {group_id} 生成摘要...")
+        summary = await generate_summary(group_id, date_str, messages)
+        
+        if not summary:
+            log_warning(f"群 {group_id} 的摘要生成失败，跳过")
+            return None
+        
+        # 日志记录生成的摘要内容，方便调试
+        log_info(f"AI生成的摘要内容:\n{summary[:200]}...")
+        log_debug(f"完整摘要内容:\n{summary}")
+        return summary
+    
+    summary_results = await asyncio.gather(
+        *(summarize_group(group_id, messages) for group_id, messages in groups_to_process.items()),
+        return_exceptions=True
+    )
+    summaries = {}
+    for group_id, result in zip(groups_to_process, summary_results):
+        if isinstance(result, Exception):
+            log_error_msg(f"为群 {group_id} 生成摘要出错: {str(result)}")
+        elif result:
+            summaries[group_id] = result
+    
+    # 第二阶段：所有群的图片一起渲染
+    images = await render_report_images(
+        {group_id: (title, summary, date_str) for group_id, summary in summaries.items()}
+    )
+    
+    # 第三阶段：依次发送日报，用信号量控制同时发送的群数量
     semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
     
-    async def process_group(group_id, messages):
+    async def send_group(group_id, summary, image_data):
         async with semaphore:
-            log_info(f"开始处理群 {group_id} 的日报生成")
-            
-            # 生成摘要
-            log_info(f"为群 {group_id} 生成摘要...")
-            summary = await generate_summary(group_id, date_str)
-            
-            if not summary:
-                log_warning(f"群 {group_id} 的摘要生成失败，跳过")
-                return False
-            
-            # 日志记录生成的摘要内容，方便调试
-            log_info(f"AI生成的摘要内容:\n{summary[:200]}...")
-            log_debug(f"完整摘要内容:\n{summary}")
-            
-            # 发送日报
             try:
-                # 生成标题
-                title = f"{date_str} 群聊日报"
-                message_prefix = f"统计范围：{start_time.strftime('%m-%d %H:%M')} - {end_time.strftime('%m-%d %H:%M')}\n\n"
-                
-                # 尝试生成图片版本
-                image_data = None
-                
-                # 使用传统HTML转图片功能
-                if PLAYWRIGHT_AVAILABLE:
-                    log_info(f"使用传统HTML转图片功能生成日报...")
-                    image_data = await generate_image_summary(title, summary, date_str)
-                    # 增加日志，确认图片数据是否正确
-                    if image_data:
-                        log_info(f"图片生成成功，大小: {len(image_data)/1024:.2f} KB")
-                    else:
-                        log_warning("图片生成失败或内容无法解析，将使用文本方式发送")
-                else:
-                    log_warning("Playwright不可用，使用文本方式发送")
-                
                 # 如果图片生成成功，则发送图片
                 if image_data and len(image_data) > 1000:  # 确保图片有足够的大小，不是空白图片
                     log_info(f"准备向群 {group_id} 发送图片日报...")
@@ -1068,18 +997,18 @@ async def execute_daily_summary(bot, target_groups=None, day_offset=0, start_hou
                 # 添加间隔，避免短时间内发送太多消息
                 await asyncio.sleep(TASK_INTERVAL_SECONDS)
     
-    # 创建所有群的任务
-    tasks = [process_group(group_id, messages) for group_id, messages in groups_to_process.items()]
-    
-    # 等待所有任务完成
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # 等待所有发送任务完成
+    results = await asyncio.gather(
+        *(send_group(group_id, summary, images.get(group_id)) for group_id, summary in summaries.items()),
+        return_exceptions=True
+    )
     
-    # 统计结果
+    # 统计结果，摘要生成失败的群计为失败
     success_count = sum(1 for r in results if r is True)
-    fail_count = sum(1 for r in results if r is False)
+    fail_count = sum(1 for r in results if r is False) + len(groups_to_process) - len(summaries)
     error_count = sum(1 for r in results if isinstance(r, Exception))
     
-    log_info(f"日报生成任务完成，总计 {len(tasks)} 个群，成功 {success_count} 个，失败 {fail_count} 个，错误 {error_count} 个")
+    log_info(f"日报生成任务完成，总计 {len(groups_to_process)} 个群，成功 {success_count} 个，失败 {fail_count} 个，错误 {error_count} 个")
 
 # 获取日报配置状态
 @logged
@@ -1092,7 +1021,9 @@ async def get_daily_config_status():
     status_text += f"定时任务: {'启用' if ENABLE_SCHEDULER else '禁用'}\n"
     status_text += f"发送时间: 每天{SUMMARY_HOUR:02d}:{SUMMARY_MINUTE:02d}\n"
     status_text += f"统计范围: 每天{SUMMARY_START_HOUR:02d}:00到次日{SUMMARY_START_HOUR:02d}:00\n"
-    status_text += f"并发任务数: {MAX_CONCURRENT_TASKS}\n"
+    status_text += f"同时发送群数: {MAX_CONCURRENT_TASKS}\n"
+    status_text += f"{get_ai_limiter().describe()}\n"
+    status_text += f"{ai_client.describe_cache()}\n"
     status_text += f"任务间隔: {TASK_INTERVAL_SECONDS}秒\n"
     
     if DAILY_SUM_GROUPS:
@@ -1108,15 +1039,81 @@ async def get_daily_config_status():
     
     return status_text
 
+# 正在进行的手动日报生成任务，相同的请求共享同一个结果
+_inflight_reports = {}
+
+# 合并相同的并发请求
+async def single_flight(key, factory):
+    """
+    相同key的并发调用只执行一次factory，其余调用等待并共享同一个结果
+    某个调用方被取消时不会影响正在执行的任务和其他调用方
+    :param key: 请求标识
+    :param factory: 无参数的异步函数
+    :return: factory的返回值
+    """
+    future = _inflight_reports.get(key)
+    if future is None:
+        future = asyncio.ensure_future(factory())
+        _inflight_reports[key] = future
+        future.add_done_callback(lambda _: _inflight_reports.pop(key, None))
+    else:
+        log_info(f"相同的日报正在生成中，等待其结果: {key}")
+    return await asyncio.shield(future)
+
+# 生成手动日报的内容
+async def build_manual_report(target_group, day_offset, date_str, title, force_refresh=False):
+    """
+    读取聊天记录、生成摘要并渲染图片
+    :return: (状态, 摘要内容, 图片数据)，状态为'no_messages'、'failed'或'ok'
+    """
+    # 分割日志文件，只处理指定的群
+    log_info(f"分割日志文件，目标群: {target_group}")
+    group_messages, _ = await split_log_files(day_offset, target_group)
+    
+    # 检查目标群是否有消息
+    if not group_messages or target_group not in group_messages:
+        log_warning(f"未找到群 {target_group} 的聊天记录")
+        return 'no_messages', None, None
+    
+    # 生成摘要
+    log_info(f"为群 {target_group} 生成摘要...")
+    summary = await generate_summary(target_group, date_str, group_messages[target_group], force_refresh)
+    
+    if not summary:
+        log_warning(f"群 {target_group} 的摘要生成失败")
+        return 'failed', None, None
+    
+    # 日志记录生成的摘要内容，方便调试
+    log_info(f"AI生成的摘要内容:\n{summary[:200]}...")
+    log_debug(f"完整摘要内容:\n{summary}")
+    
+    # 尝试生成图片版本
+    image_data = None
+    
+    try:
+        image_data = await generate_image_summary(title, summary, date_str)
+    except Exception as e:
+        log_error_msg(f"生成群 {target_group} 的图片日报出错: {str(e)}")
+        log_error_msg(traceback.format_exc())
+    # 增加日志，确认图片数据是否正确
+    if image_data:
+        log_info(f"图片生成成功，大小: {len(image_data)/1024:.2f} KB")
+    else:
+        log_warning("图片生成失败或内容无法解析，将使用文本方式发送")
+    
+    return 'ok', summary, image_data
+
 # 手动触发总结
 @logged
-async def manual_summary(bot, ev, day_offset=0, target_group=None):
+async def manual_summary(bot, ev, day_offset=0, target_group=None, force_refresh=False):
     """
     手动触发总结
+    同一个群、同一时间范围、同一格式的日报同时被多次请求时只生成一次，所有请求共享结果，刷新请求只与刷新请求合并
     :param bot: 机器人实例
     :param ev: 事件对象
     :param day_offset: 日期偏移，0表示今天，1表示昨天，以此类推
     :param target_group: 目标群号，为None时使用当前群
+    :param force_refresh: 是否忽略缓存重新生成
     """
     current_group_id = str(ev['group_id'])
     user_id = str(ev['user_id'])
@@ -1135,49 +1132,27 @@ async def manual_summary(bot, ev, day_offset=0, target_group=None):
     target_date = datetime.now() - timedelta(days=day_offset)
     date_str = target_date.strftime('%Y-%m-%d')
     
-    # 分割日志文件，只处理指定的群
-    log_info(f"分割日志文件，目标群: {target_group}")
-    group_messages, _ = await split_log_files(day_offset, target_group)
+    # 生成标题
+    title = f"{date_str} {'群 '+target_group if target_group != current_group_id else '本群'}聊天日报"
     
-    # 检查目标群是否有消息
-    if not group_messages or target_group not in group_messages:
+    # 标题会渲染进图片，也作为请求标识的一部分
+    report_format = 'pillow' if REPORT_RENDERER == 'pillow' or not PLAYWRIGHT_AVAILABLE else 'playwright'
+    # 刷新请求不能加入正在进行的普通请求，否则会拿到缓存的结果
+    key = (target_group, date_str, report_format, title, force_refresh)
+    status, summary, image_data = await single_flight(
+        key, lambda: build_manual_report(target_group, day_offset, date_str, title, force_refresh)
+    )
+    
+    if status == 'no_messages':
         await bot.send(ev, f"未找到{'指定群 '+target_group if target_group != current_group_id else '本群'}的聊天记录")
-        log_warning(f"未找到群 {target_group} 的聊天记录")
         return
     
-    # 生成摘要
-    log_info(f"为群 {target_group} 生成摘要...")
-    summary = await generate_summary(target_group, date_str)
-    
-    if not summary:
+    if status != 'ok':
         await bot.send(ev, f"生成{'指定群 '+target_group if target_group != current_group_id else '本群'}的日报失败")
-        log_warning(f"群 {target_group} 的摘要生成失败")
         return
     
     # 发送到当前群（触发命令的群）
     try:
-        # 生成标题
-        title = f"{date_str} {'群 '+target_group if target_group != current_group_id else '本群'}聊天日报"
-        
-        # 日志记录生成的摘要内容，方便调试
-        log_info(f"AI生成的摘要内容:\n{summary[:200]}...")
-        log_debug(f"完整摘要内容:\n{summary}")
-        
-        # 尝试生成图片版本
-        image_data = None
-        
-        # 使用传统HTML转图片功能
-        if PLAYWRIGHT_AVAILABLE:
-            log_info(f"使用传统HTML转图片功能生成日报...")
-            image_data = await generate_image_summary(title, summary, date_str)
-            # 增加日志，确认图片数据是否正确
-            if image_data:
-                log_info(f"图片生成成功，大小: {len(image_data)/1024:.2f} KB")
-            else:
-                log_warning("图片生成失败或内容无法解析，将使用文本方式发送")
-        else:
-            log_warning("Playwright不可用，使用文本方式发送")
-        
         # 如果图片生成成功，则发送图片
         if image_data and len(image_data) > 1000:  # 确保图片有足够的大小，不是空白图片
             log_info(f"准备向群 {current_group_id} 发送图片日报...")
@@ -1227,20 +1202,19 @@ async def backup_logs():
         shutil.copy2(LOG_PATH, backup_path)
         log_info(f"日志文件已备份到: {backup_path}")
         
-        # 解析日志并按群保存
-        now = datetime.now()
-        start_time = datetime(now.year, now.month, now.day, 0, 0, 0)
-        end_time = datetime(now.year, now.month, now.day, 23, 59, 59)
-        
-        log_info(f"开始从备份日志解析群聊消息: {backup_path}")
-        group_messages = await parse_syslog(backup_path, start_time, end_time)
+        # 增量解析系统日志并按群保存，备份文件内容与系统日志相同，无需再完整解析一遍
+        if ENABLE_MESSAGE_CAPTURE:
+            log_info("写入实时捕获的群消息")
+            written = await flush_captured_messages()
+        else:
+            log_info(f"开始增量解析系统日志中的群聊消息: {LOG_PATH}")
+            written = await ingest_new_logs(LOG_PATH)
         
-        # 保存群聊日志
-        if group_messages:
-            await save_group_logs(group_messages, today)
-            log_info(f"成功解析并保存了 {len(group_messages)} 个群的聊天记录")
+        group_ids = list_groups(today)
+        if group_ids:
+            log_info(f"成功解析并保存了 {len(group_ids)} 个群的聊天记录，本次新增 {written} 条消息")
         else:
-            log_warning(f"没有从备份日志中解析到任何群聊消息")
+            log_warning(f"没有从系统日志中解析到任何群聊消息")
             
     except Exception as e:
         log_error_msg(f"备份日志文件出错: {str(e)}")
@@ -1260,6 +1234,12 @@ async def handle_daily_report_cmd(bot, ev, msg):
         await bot.send(ev, '抱歉，只有管理员才能使用日报管理功能')
         return
     
+    # 命令中带“刷新”时忽略缓存重新生成
+    parts = msg.split()
+    force_refresh = '刷新' in parts
+    if force_refresh:
+        msg = ' '.join(part for part in parts if part != '刷新')
+    
     # 解析命令
     if msg.startswith(('启用', '开启')):
         # 启用日报功能
@@ -1305,10 +1285,10 @@ async def handle_daily_report_cmd(bot, ev, msg):
         if len(parts) >= 2 and parts[1].isdigit():
             target_group = parts[1]
             # 手动触发日报生成（指定群）
-            await manual_summary(bot, ev, day_offset=0, target_group=target_group)
+            await manual_summary(bot, ev, day_offset=0, target_group=target_group, force_refresh=force_refresh)
         else:
             # 手动触发日报生成（当前群）
-            await manual_summary(bot, ev)
+            await manual_summary(bot, ev, force_refresh=force_refresh)
     
     elif msg.startswith('昨日'):
         # 检查是否指定了群号 - 格式：昨日 群号
@@ -1316,10 +1296,10 @@ async def handle_daily_report_cmd(bot, ev, msg):
         if len(parts) >= 2 and parts[1].isdigit():
             target_group = parts[1]
             # 生成昨天指定群的日报
-            await manual_summary(bot, ev, day_offset=1, target_group=target_group)
+            await manual_summary(bot, ev, day_offset=1, target_group=target_group, force_refresh=force_refresh)
         else:
             # 生成昨天当前群的日报
-            await manual_summary(bot, ev, day_offset=1)
+            await manual_summary(bot, ev, day_offset=1, force_refresh=force_refresh)
     
     elif msg.startswith('前日'):
         # 检查是否指定了群号 - 格式：前日 群号
@@ -1327,10 +1307,10 @@ async def handle_daily_report_cmd(bot, ev, msg):
         if len(parts) >= 2 and parts[1].isdigit():
             target_group = parts[1]
             # 生成前天指定群的日报
-            await manual_summary(bot, ev, day_offset=2, target_group=target_group)
+            await manual_summary(bot, ev, day_offset=2, target_group=target_group, force_refresh=force_refresh)
         else:
             # 生成前天当前群的日报
-            await manual_summary(bot, ev, day_offset=2)
+            await manual_summary(bot, ev, day_offset=2, force_refresh=force_refresh)
         
     elif msg.startswith(('指定', '查询')):
         # 指定日期生成
@@ -1348,10 +1328,10 @@ async def handle_daily_report_cmd(bot, ev, msg):
             if len(parts) >= 3 and parts[2].isdigit():
                 target_group = parts[2]
                 # 生成指定天数前指定群的日报
-                await manual_summary(bot, ev, day_offset=day_offset, target_group=target_group)
+                await manual_summary(bot, ev, day_offset=day_offset, target_group=target_group, force_refresh=force_refresh)
             else:
                 # 生成指定天数前当前群的日报
-                await manual_summary(bot, ev, day_offset=day_offset)
+                await manual_summary(bot, ev, day_offset=day_offset, force_refresh=force_refresh)
         else:
             await bot.send(ev, '日期格式有误，正确格式: 指定 N (N为天数) [群号]')
     
@@ -1407,6 +1387,7 @@ async def handle_daily_report_cmd(bot, ev, msg):
 - 前日 群号：生成指定群前天的日报
 - 指定 N：生成N天前的日报
 - 指定 N 群号：生成指定群N天前的日报
+- 以上生成命令后加 刷新：忽略缓存重新生成，如 昨日 刷新
 - 设置浏览器 路径：设置自定义浏览器路径
 - 初始化playwright：手动初始化Playwright
 - 帮助：显示本帮助信息"""
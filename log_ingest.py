@@ -0,0 +1,366 @@
+import os
+import re
+import json
+import base64
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+from .config import DATA_DIR, PARSE_WORKERS, PARSE_PARALLEL_MIN_BYTES, PARSE_PARALLEL_TIMEOUT
+from .logger_helper import log_info, log_warning, log_debug
+from .log_parser import parse_log_line, parse_log_file, add_message, iter_marked_lines, get_group_marker, sniff_file_encoding
+from .message_batch import MessageBatch
+from .message_store import merge_group_messages, replace_smaller_groups
+
+# 增量解析游标文件，记录每个日志文件已解析到的位置
+INGEST_STATE_PATH = os.path.join(DATA_DIR, 'ingest_state.json')
+
+# 每次从日志读取的块大小
+READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+# 用于识别文件身份的文件头长度
+HEAD_FINGERPRINT_SIZE = 1024
+
+# 备份日志文件名格式
+BACKUP_LOG_REGEX = re.compile(r'^run_log_(\d{4}-\d{2}-\d{2})\.log$')
+
+# 防止多个任务同时解析同一个日志
+_ingest_lock = None
+
+def _get_ingest_lock():
+    global _ingest_lock
+    if _ingest_lock is None:
+        _ingest_lock = asyncio.Lock()
+    return _ingest_lock
+
+# 读取游标状态
+def load_ingest_state():
+    """
+    读取增量解析游标状态
+    :return: 状态字典 {'files': {日志路径: 游标}, 'encodings': {日志路径: 编码缓存},
+             'exploded': {日志路径: 文件身份和已解析的起始时间}, 'complete_days': [已完整解析的日期, ...]}
+    """
+    if os.path.exists(INGEST_STATE_PATH):
+        try:
+            with open(INGEST_STATE_PATH, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if isinstance(state.get('files'), dict):
+                return state
+        except Exception as e:
+            log_warning(f"读取增量解析状态失败，将重新开始解析: {str(e)}")
+    return {'files': {}}
+
+# 保存游标状态
+def save_ingest_state(state):
+    """
+    保存增量解析游标状态（先写临时文件再替换）
+    :param state: 状态字典
+    """
+    temp_path = INGEST_STATE_PATH + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temp_path, INGEST_STATE_PATH)
+
+# 计算文件头指纹
+def _head_fingerprint(f, length):
+    f.seek(0)
+    return hashlib.sha1(f.read(length)).hexdigest()
+
+# 判断游标是否仍然指向同一个文件
+def _check_cursor(f, st, cursor):
+    """
+    检查游标是否仍然有效
+    :return: (是否有效, 无效原因)
+    """
+    if cursor.get('dev') != st.st_dev or cursor.get('ino') != st.st_ino:
+        return False, "日志文件已轮转"
+    if st.st_size < cursor.get('offset', 0):
+        return False, "日志文件被截断"
+    head_len = cursor.get('head_len', 0)
+    if head_len and _head_fingerprint(f, head_len) != cursor.get('head'):
+        return False, "日志文件内容已被替换"
+    return True, None
+
+# 检测文件编码，按文件身份缓存检测结果
+def _detect_encoding_with_cache(log_path, cache):
+    """
+    :param log_path: 日志文件路径
+    :param cache: 编码缓存 {日志路径: {文件身份, 编码}}
+    :return: (编码, 是否更新了缓存)
+    """
+    key = os.path.abspath(log_path)
+    with open(log_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        head_len = min(st.st_size, HEAD_FINGERPRINT_SIZE)
+        head = _head_fingerprint(f, head_len)
+        cached = cache.get(key)
+        if cached and cached.get('dev') == st.st_dev and cached.get('ino') == st.st_ino \
+                and cached.get('head_len') == head_len and cached.get('head') == head:
+            return cached['encoding'], False
+        encoding = sniff_file_encoding(f)
+    cache[key] = {
+        'dev': st.st_dev,
+        'ino': st.st_ino,
+        'head_len': head_len,
+        'head': head,
+        'encoding': encoding,
+    }
+    return encoding, True
+
+# 获取日志文件编码
+async def get_log_encoding(log_path):
+    """
+    获取日志文件编码，只读取文件头部样本检测一次，结果按文件身份保存在增量解析状态中
+    :param log_path: 日志文件路径
+    :return: 编码名称
+    """
+    async with _get_ingest_lock():
+        state = load_ingest_state()
+        cache = state.setdefault('encodings', {})
+        loop = asyncio.get_event_loop()
+        encoding, updated = await loop.run_in_executor(None, _detect_encoding_with_cache, log_path, cache)
+        if updated:
+            save_ingest_state(state)
+            log_info(f"检测到日志文件编码为 {encoding}: {log_path}")
+        return encoding
+
+# 从游标位置读取并解析新增日志
+def read_new_messages(log_path, cursor):
+    """
+    从游标位置开始读取日志文件新增的内容并解析群聊消息
+    :param log_path: 日志文件路径
+    :param cursor: 上次保存的游标，为None时从头开始
+    :return: (分桶消息字典 {(群号, 日期): 消息批次}, 新游标, 统计信息)
+    """
+    bucketed = {}
+    stats = {'bytes': 0, 'lines': 0, 'matched': 0, 'reset': None, 'last_day': None}
+
+    with open(log_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+
+        if cursor:
+            valid, reason = _check_cursor(f, st, cursor)
+            if not valid:
+                stats['reset'] = reason
+                cursor = None
+
+        if cursor:
+            offset = cursor['offset']
+            carry = base64.b64decode(cursor.get('carry', ''))
+            head_len = cursor.get('head_len', 0)
+            head = cursor.get('head')
+            encoding = cursor.get('encoding')
+        else:
+            offset = 0
+            carry = b''
+            head_len = 0
+            head = None
+            encoding = None
+
+        # 编码只在新文件时检测一次，之后沿用游标中记录的编码
+        if not encoding:
+            encoding = sniff_file_encoding(f)
+        marker = get_group_marker(encoding)
+
+        # 文件头不足时补充指纹，便于之后识别文件被替换
+        if head_len < HEAD_FINGERPRINT_SIZE and st.st_size > head_len:
+            head_len = min(st.st_size, HEAD_FINGERPRINT_SIZE)
+            head = _head_fingerprint(f, head_len)
+
+        f.seek(offset)
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            offset += len(chunk)
+            stats['bytes'] += len(chunk)
+
+            data = carry + chunk
+            last_newline = data.rfind(b'\n')
+            if last_newline < 0:
+                carry = data
+                continue
+            carry = data[last_newline + 1:]
+
+            stats['lines'] += data.count(b'\n', 0, last_newline + 1)
+            for raw_line in iter_marked_lines(data, marker, 0, last_newline):
+                line = raw_line.decode(encoding, errors='ignore')
+                try:
+                    parsed = parse_log_line(line)
+                except ValueError as e:
+                    log_warning(f"{str(e)}，跳过该行")
+                    continue
+                if not parsed:
+                    continue
+                stats['matched'] += 1
+                log_time, group_id, sender_qq, content = parsed
+                key = (group_id, log_time.strftime('%Y-%m-%d'))
+                batch = bucketed.get(key)
+                if batch is None:
+                    batch = bucketed[key] = MessageBatch()
+                add_message(batch, log_time, sender_qq, content)
+                if stats['last_day'] is None or key[1] > stats['last_day']:
+                    stats['last_day'] = key[1]
+
+    new_cursor = {
+        'dev': st.st_dev,
+        'ino': st.st_ino,
+        'head_len': head_len,
+        'head': head,
+        'offset': offset,
+        'carry': base64.b64encode(carry).decode('ascii'),
+        'encoding': encoding,
+        'last_day': stats['last_day'],
+    }
+    return bucketed, new_cursor, stats
+
+# 增量解析日志并写入群聊记录
+async def ingest_new_logs(log_path):
+    """
+    只解析日志文件自上次调用以来新增的内容，并合并到按群按天保存的聊天记录中
+    :param log_path: 日志文件路径
+    :return: 本次新增的消息数，日志不存在时返回None
+    """
+    if not os.path.exists(log_path):
+        log_warning(f"日志文件不存在，跳过增量解析: {log_path}")
+        return None
+
+    async with _get_ingest_lock():
+        state = load_ingest_state()
+        state_key = os.path.abspath(log_path)
+        cursor = state['files'].get(state_key)
+
+        loop = asyncio.get_event_loop()
+        bucketed, new_cursor, stats = await loop.run_in_executor(None, read_new_messages, log_path, cursor)
+
+        if stats['reset']:
+            log_info(f"{stats['reset']}，从头开始解析: {log_path}")
+
+        # 首次解析整个文件时覆盖旧的记录，之后的增量内容追加到已有记录
+        replace = cursor is None
+        written = await loop.run_in_executor(None, merge_group_messages, bucketed, replace)
+
+        if stats['last_day']:
+            # 上次解析到的最后一天也可能在本次之后才结束
+            days = {date_str for _, date_str in bucketed.keys()}
+            if cursor and cursor.get('last_day'):
+                days.add(cursor['last_day'])
+            _mark_complete_days(state, days, stats['last_day'])
+        elif cursor:
+            new_cursor['last_day'] = cursor.get('last_day')
+        state['files'][state_key] = new_cursor
+        save_ingest_state(state)
+
+        log_info(f"增量解析完成: 读取 {stats['bytes'] / 1024:.2f} KB, {stats['lines']} 行，新增 {written} 条群聊消息")
+        log_debug(f"新游标位置: {new_cursor['offset']}")
+        return written
+
+# 记录已完整解析的日期
+def _mark_complete_days(state, days, last_day):
+    """
+    日志按时间顺序写入，早于日志最后一天的日期不会再有新消息，记为已完整解析
+    :param state: 状态字典
+    :param days: 本次解析涉及的日期
+    :param last_day: 日志中最后一条消息的日期
+    """
+    complete_days = set(state.get('complete_days', []))
+    complete_days.update(date_str for date_str in days if date_str < last_day)
+    state['complete_days'] = sorted(complete_days)
+
+# 判断某天的记录是否已完整解析
+def is_day_complete(date_str):
+    """
+    判断指定日期的聊天记录是否已经从日志中完整解析出来
+    :param date_str: 日期字符串
+    :return: 是否已完整解析
+    """
+    return date_str in load_ingest_state().get('complete_days', [])
+
+# 查找包含指定日期的备份日志
+def find_backup_log(log_dir, date_str):
+    """
+    查找可能包含指定日期消息的备份日志
+    每份备份都是当时系统日志的完整副本，优先使用最新的一份，一次解析即可覆盖之前的所有日期
+    :param log_dir: 备份日志目录
+    :param date_str: 日期字符串
+    :return: 备份日志路径，找不到时返回None
+    """
+    if not os.path.isdir(log_dir):
+        return None
+    candidates = []
+    for name in os.listdir(log_dir):
+        match = BACKUP_LOG_REGEX.match(name)
+        if match and match.group(1) >= date_str:
+            candidates.append((match.group(1), name))
+    if not candidates:
+        return None
+    return os.path.join(log_dir, max(candidates)[1])
+
+# 解析日志文件的一段时间并按天保存
+def _explode_log_file(log_path, encoding, workers, start_time=None, end_time=None):
+    group_messages, stats = parse_log_file(
+        log_path, start_time=start_time, end_time=end_time, encoding=encoding, workers=workers,
+        min_parallel_bytes=PARSE_PARALLEL_MIN_BYTES, timeout=PARSE_PARALLEL_TIMEOUT
+    )
+    if stats.get('parallel_timeout'):
+        log_warning(f"多进程解析超过 {PARSE_PARALLEL_TIMEOUT} 秒未完成，已改为在当前进程中解析: {log_path}")
+    bucketed = {}
+    for group_id, batch in group_messages.items():
+        for date_str, day_batch in batch.split_by_day().items():
+            bucketed[(group_id, date_str)] = day_batch
+    days = {date_str for _, date_str in bucketed}
+    # 有结束时间时，结束时间所在日期之前的每一天都已完整解析
+    if end_time:
+        last_day = (end_time + timedelta(microseconds=1)).strftime('%Y-%m-%d')
+    else:
+        last_day = max(days) if days else None
+    replaced = replace_smaller_groups(bucketed)
+    return days, len(bucketed), last_day, replaced, stats
+
+# 整体拆分日志文件
+async def explode_log_file(log_path, start_time=None):
+    """
+    一次解析日志文件中start_time之后的全部内容，把其中所有(群, 日期)的消息都写入按群按天保存的聊天记录
+    start_time之前的内容通过二分查找直接跳过，文件未变化时之后只补充解析更早的部分，不会重复解析
+    :param log_path: 日志文件路径
+    :param start_time: 开始时间，格式为datetime对象，为None时解析整个文件
+    :return: 是否进行了解析
+    """
+    if not os.path.exists(log_path):
+        log_warning(f"日志文件不存在，无法拆分: {log_path}")
+        return False
+
+    encoding = await get_log_encoding(log_path)
+
+    async with _get_ingest_lock():
+        state = load_ingest_state()
+        exploded = state.setdefault('exploded', {})
+        key = os.path.abspath(log_path)
+        st = os.stat(log_path)
+        identity = {'dev': st.st_dev, 'ino': st.st_ino, 'size': st.st_size, 'mtime': st.st_mtime}
+
+        # 文件未变化时，已解析过从covered_start到文件末尾的内容，只需解析更早的部分
+        end_time = None
+        previous = exploded.get(key)
+        if previous and all(previous.get(name) == value for name, value in identity.items()):
+            covered_start = previous.get('start')
+            if covered_start is None or (start_time and start_time >= datetime.fromisoformat(covered_start)):
+                log_debug(f"日志文件已拆分过且未变化，跳过: {log_path}")
+                return False
+            end_time = datetime.fromisoformat(covered_start) - timedelta(microseconds=1)
+
+        log_info(f"开始拆分日志文件: {log_path}，时间范围: {start_time or '文件开头'} - {end_time or '文件末尾'}")
+        loop = asyncio.get_event_loop()
+        workers = PARSE_WORKERS or os.cpu_count() or 1
+        days, bucket_count, last_day, replaced, stats = await loop.run_in_executor(
+            None, _explode_log_file, log_path, encoding, workers, start_time, end_time
+        )
+
+        exploded[key] = dict(identity, start=start_time.isoformat() if start_time else None)
+        if last_day:
+            _mark_complete_days(state, days, last_day)
+        save_ingest_state(state)
+
+        log_info(f"日志拆分完成: 共 {stats['lines']} 行，{stats['matched']} 条群聊消息，"
+                 f"{len(days)} 天 {bucket_count} 个(群, 日期)分桶，更新了 {replaced} 个")
+        return True
@@ -0,0 +1,472 @@
+import os
+import re
+import mmap
+import multiprocessing
+from datetime import datetime
+from functools import lru_cache
+
+from .message_batch import MessageBatch
+
+# 群聊消息日志格式
+LOG_PATTERN = r'\[(.*?) nonebot\] INFO: Self: (.*?), Message (.*?) from (.*?)@\[群:(.*?)\]: \'(.*?)\'$'
+LOG_REGEX = re.compile(LOG_PATTERN)
+
+# 日志行首的时间戳，用于在文件中二分查找时间窗口
+LOG_TIME_PREFIX_REGEX = re.compile(rb'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
+
+# 群聊消息行必然包含的标记，在解码前先按字节筛选
+GROUP_MARKER = '@[群:'
+
+# 日志候选编码，gbk和cp936都是gb18030的子集，无需单独尝试
+CANDIDATE_ENCODINGS = ['utf-8', 'gb18030']
+
+# 检测编码时读取的样本大小
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# 解析日志时间
+def parse_log_time(log_time_str):
+    """
+    解析日志中的时间字符串
+    :param log_time_str: 时间字符串，如'2025-06-30 16:51:58,015'
+    :return: datetime对象，无法解析时返回None
+    """
+    # 不使用strptime：它在模块级的锁中维护缓存，fork出的解析进程可能继承一把被其他线程持有的锁而卡死
+    # 带毫秒和不带毫秒的格式都能直接解析，而且快得多
+    try:
+        return datetime.fromisoformat(log_time_str.replace(',', '.'))
+    except ValueError:
+        return None
+
+# 解析单行日志
+def parse_log_line(line):
+    """
+    解析单行日志，提取群聊消息
+    :param line: 日志行
+    :return: (日志时间, 群号, 发送者QQ号, 原始消息内容) 元组，非群聊消息返回None
+    :raises ValueError: 日志时间无法解析
+    """
+    # 仅处理可能包含群聊消息的行
+    if 'nonebot' not in line or 'Message' not in line or '@[群:' not in line:
+        return None
+
+    match = LOG_REGEX.search(line)
+    if not match:
+        return None
+
+    log_time_str, self_id, msg_id, sender_info, group_id, content = match.groups()
+
+    log_time = parse_log_time(log_time_str)
+    if log_time is None:
+        raise ValueError(f"无法解析日志时间: {log_time_str}")
+
+    # 解析发送者QQ号
+    sender_qq = sender_info.split('@')[0]
+
+    return log_time, group_id, sender_qq, content
+
+# CQ码类型对应的简化标识
+CQ_PLACEHOLDERS = {
+    'image': '[图片]',
+    'face': '[表情]',
+    'at': '[有人@]',
+    'share': '[分享]',
+    'record': '[语音]',
+    'video': '[视频]',
+    'xml': '[XML卡片]',
+    'json': '[JSON卡片]',
+    'music': '[音乐]',
+    'reply': '[回复]',
+    'forward': '[合并转发]',
+    'redbag': '[红包]',
+}
+
+# CQ码，已知类型后面的内容单独分组
+CQ_CODE_PATTERN = r'\[CQ:(' + '|'.join(CQ_PLACEHOLDERS) + r')?([^\]]*)\]'
+CQ_CODE_REGEX = re.compile(CQ_CODE_PATTERN)
+
+# 一次扫描同时匹配CQ码、URL和连续的空行
+# URL中间夹着的CQ码整体匹配，简化后的标识不含空白字符，仍算作URL的一部分
+SIMPLIFY_REGEX = re.compile(CQ_CODE_PATTERN + r'|(https?://)((?:\[CQ:[^\]]*\]|\S)*)|\n{3,}')
+
+# 过长URL的最小长度（协议头之后的字符数）
+MIN_LINK_LENGTH = 30
+
+# 简化结果缓存的条目数
+SIMPLIFY_CACHE_SIZE = 16384
+
+def _simplify_cq_match(match):
+    cq_type, rest = match.group(1), match.group(2)
+    # 已知类型后面至少还要有一个字符，否则按未知类型处理；[CQ:]不是CQ码，保持原样
+    if cq_type and rest:
+        return CQ_PLACEHOLDERS[cq_type]
+    if cq_type or rest:
+        return '[特殊消息]'
+    return match.group(0)
+
+def _simplify_match(match):
+    text = match.group(0)
+    if text[0] == '[':
+        return _simplify_cq_match(match)
+    if text[0] == '\n':
+        return '\n\n'
+    tail = match.group(4)
+    if '[CQ:' in tail:
+        tail = CQ_CODE_REGEX.sub(_simplify_cq_match, tail)
+    if len(tail) >= MIN_LINK_LENGTH:
+        return '[链接]'
+    return match.group(3) + tail
+
+@lru_cache(maxsize=SIMPLIFY_CACHE_SIZE)
+def _simplify_text(content):
+    return SIMPLIFY_REGEX.sub(_simplify_match, content)
+
+# 处理CQ码图片链接，将其简化为[图片]标识
+def simplify_cq_code(content):
+    """
+    将CQ码简化为简单标识，同时去除过长的URL链接和连续的空行
+    :param content: 消息内容
+    :return: 简化后的消息内容
+    """
+    if not isinstance(content, str):
+        return content
+
+    # 不含CQ码、链接和连续空行的消息无需处理
+    if '[CQ:' not in content and 'http' not in content and '\n\n\n' not in content:
+        return content
+
+    return _simplify_text(content)
+
+# 添加消息记录
+def add_message(batch, log_time, sender_qq, content):
+    """
+    把解析出的消息追加到消息批次
+    :param batch: 消息批次
+    :param log_time: 消息时间，datetime对象
+    :param sender_qq: 发送者QQ号
+    :param content: 原始消息内容
+    """
+    batch.append(int(log_time.replace(microsecond=0).timestamp()), sender_qq, simplify_cq_code(content))
+
+# 根据样本检测编码
+def detect_encoding(sample):
+    """
+    根据字节样本检测日志编码
+    :param sample: 字节样本
+    :return: 编码名称，均无法严格解码时返回utf-8（解析时忽略错误字节）
+    """
+    # 去掉最后一个不完整的行，避免多字节字符被截断导致误判
+    last_newline = sample.rfind(b'\n')
+    if last_newline > 0:
+        sample = sample[:last_newline]
+    for encoding in CANDIDATE_ENCODINGS:
+        try:
+            sample.decode(encoding)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return CANDIDATE_ENCODINGS[0]
+
+# 检测日志文件编码
+def sniff_file_encoding(f):
+    """
+    读取文件头部样本检测编码，头部全是ASCII时改用尾部样本
+    :param f: 以二进制方式打开的文件对象
+    :return: 编码名称
+    """
+    size = os.fstat(f.fileno()).st_size
+    f.seek(0)
+    sample = f.read(ENCODING_SAMPLE_SIZE)
+    if sample.isascii() and size > ENCODING_SAMPLE_SIZE:
+        f.seek(max(ENCODING_SAMPLE_SIZE, size - ENCODING_SAMPLE_SIZE))
+        tail = f.read(ENCODING_SAMPLE_SIZE)
+        # 去掉第一个不完整的行
+        sample = tail[tail.find(b'\n') + 1:]
+    return detect_encoding(sample)
+
+# 每次从日志读取的块大小
+RANGE_READ_SIZE = 4 * 1024 * 1024
+
+# 打开只读内存映射
+def open_log_mmap(f):
+    """
+    以只读方式映射日志文件
+    :param f: 以二进制方式打开的文件对象
+    :return: mmap对象，空文件返回None
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# 获取指定编码下的群聊消息标记
+def get_group_marker(encoding):
+    """
+    获取指定编码下群聊消息标记的字节串
+    :param encoding: 日志文件编码
+    :return: 标记字节串，该编码无法表示时返回None
+    """
+    try:
+        return GROUP_MARKER.encode(encoding)
+    except (UnicodeEncodeError, LookupError):
+        return None
+
+# 查找包含标记的行
+def iter_marked_lines(data, marker, start=0, end=None):
+    """
+    在字节数据中查找包含标记的行，不包含标记的行不会被解码
+    :param data: 字节数据或mmap对象
+    :param marker: 标记字节串
+    :param start: 起始位置（行首）
+    :param end: 结束位置（行首或数据末尾）
+    :return: 生成器，依次产出包含标记的行（不含换行符，CRLF换行时也不含行尾的\r）
+    """
+    if end is None:
+        end = len(data)
+    pos = data.find(marker, start, end)
+    while pos >= 0:
+        line_start = data.rfind(b'\n', start, pos) + 1
+        if line_start == 0:
+            line_start = start
+        line_end = data.find(b'\n', pos, end)
+        if line_end < 0:
+            line_end = end
+        next_pos = line_end
+        # Windows下的日志以CRLF换行
+        if line_end > line_start and data[line_end - 1] == 13:
+            line_end -= 1
+        yield data[line_start:line_end]
+        pos = data.find(marker, next_pos, end)
+
+# 获取某个位置之后第一行的时间戳
+def _timestamp_at(mm, pos, limit):
+    """
+    从pos所在位置之后的第一个行首开始，向后查找第一行带时间戳的日志
+    堆栈等多行输出没有时间戳，会一直向后查找，直到行首到达limit为止
+    :return: (时间戳字节串, 该行之后下一行的行首位置)，limit之前找不到时返回(None, limit)
+    """
+    if pos > 0:
+        newline = mm.find(b'\n', pos - 1)
+        if newline < 0:
+            return None, limit
+        pos = newline + 1
+    while pos < limit:
+        line_end = mm.find(b'\n', pos)
+        if line_end < 0:
+            line_end = len(mm)
+        # 行首可能有其他程序输出的残留内容，只在行首附近查找时间戳
+        match = LOG_TIME_PREFIX_REGEX.search(mm, pos, min(line_end, pos + 64))
+        if match:
+            return match.group(1), line_end + 1
+        pos = line_end + 1
+    return None, limit
+
+# 二分查找第一条满足条件的行
+def _bisect_log(mm, size, predicate):
+    """
+    在按时间顺序写入的日志中二分查找，返回第一个使predicate(时间戳)成立的行首位置
+    没有时间戳的行属于之前最近一条带时间戳的日志
+    """
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # hi之后第一行带时间戳的日志满足条件（或者不存在），只需查找到hi为止
+        timestamp, next_pos = _timestamp_at(mm, mid, hi)
+        if timestamp is None or predicate(timestamp):
+            hi = mid
+        else:
+            # 跳过不满足条件的行以及它之前没有时间戳的行
+            lo = min(hi, max(mid + 1, next_pos))
+    if lo == 0:
+        return 0
+    newline = mm.find(b'\n', lo - 1)
+    return size if newline < 0 else newline + 1
+
+# 查找时间窗口对应的字节区间
+def find_time_window(mm, start_time=None, end_time=None):
+    """
+    利用日志按时间顺序写入的特点，二分查找时间窗口在文件中的字节区间
+    返回的区间可能略大于时间窗口（精确到秒），区间内的消息仍需按时间过滤
+    :param mm: 日志文件的mmap对象
+    :param start_time: 开始时间，格式为datetime对象
+    :param end_time: 结束时间，格式为datetime对象
+    :return: (起始字节位置, 结束字节位置)
+    """
+    size = len(mm)
+    range_start, range_end = 0, size
+    if start_time:
+        start_key = start_time.strftime('%Y-%m-%d %H:%M:%S').encode('ascii')
+        range_start = _bisect_log(mm, size, lambda ts: ts >= start_key)
+    if end_time:
+        end_key = end_time.strftime('%Y-%m-%d %H:%M:%S').encode('ascii')
+        range_end = _bisect_log(mm, size, lambda ts: ts > end_key)
+    return range_start, max(range_start, range_end)
+
+# 按换行符切分文件
+def split_file_ranges(log_path, parts, start=0, end=None):
+    """
+    将文件的[start, end)字节区间切分为若干个以换行符对齐的子区间
+    :param log_path: 日志文件路径
+    :param parts: 期望切分的份数
+    :param start: 起始字节位置
+    :param end: 结束字节位置，为None时到文件末尾
+    :return: 字节区间列表 [(起始, 结束), ...]
+    """
+    if end is None:
+        end = os.path.getsize(log_path)
+    if end <= start:
+        return []
+
+    parts = max(1, parts)
+    step = (end - start) // parts
+    boundaries = [start]
+    with open(log_path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(start + step * i)
+            f.readline()  # 跳到下一行的行首
+            pos = min(f.tell(), end)
+            if pos > boundaries[-1]:
+                boundaries.append(pos)
+    if boundaries[-1] < end:
+        boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# 解析日志文件的一个字节区间
+def parse_log_range(log_path, range_start, range_end, start_time=None, end_time=None, target_group=None, encoding='utf-8'):
+    """
+    解析日志文件的[range_start, range_end)区间，区间边界需位于行首
+    只有包含群聊消息标记的行才会被解码和匹配
+    :param log_path: 日志文件路径
+    :param range_start: 起始字节位置
+    :param range_end: 结束字节位置
+    :param start_time: 开始时间，格式为datetime对象
+    :param end_time: 结束时间，格式为datetime对象
+    :param target_group: 目标群号，为None时解析所有群
+    :param encoding: 日志文件编码
+    :return: (群聊消息字典 {群号: 消息批次}, 统计信息)
+    """
+    group_messages = {}
+    stats = {'lines': 0, 'matched': 0, 'bad_time': 0}
+
+    marker = get_group_marker(encoding)
+    if marker is None or range_end <= range_start:
+        return group_messages, stats
+
+    with open(log_path, 'rb') as f:
+        mm = open_log_mmap(f)
+        if mm is None:
+            return group_messages, stats
+        try:
+            range_end = min(range_end, len(mm))
+            stats['lines'] = _count_lines(mm, range_start, range_end)
+
+            for raw_line in iter_marked_lines(mm, marker, range_start, range_end):
+                line = raw_line.decode(encoding, errors='ignore')
+                try:
+                    parsed = parse_log_line(line)
+                except ValueError:
+                    stats['bad_time'] += 1
+                    continue
+                if not parsed:
+                    continue
+                stats['matched'] += 1
+
+                log_time, group_id, sender_qq, content = parsed
+
+                # 时间过滤
+                if start_time and log_time < start_time:
+                    continue
+                if end_time and log_time > end_time:
+                    continue
+
+                # 群号过滤
+                if target_group and group_id != target_group:
+                    continue
+
+                batch = group_messages.get(group_id)
+                if batch is None:
+                    batch = group_messages[group_id] = MessageBatch()
+                add_message(batch, log_time, sender_qq, content)
+        finally:
+            mm.close()
+
+    return group_messages, stats
+
+# 分块统计区间内的行数
+def _count_lines(mm, start, end):
+    count = 0
+    for pos in range(start, end, RANGE_READ_SIZE):
+        count += mm[pos:min(pos + RANGE_READ_SIZE, end)].count(b'\n')
+    return count
+
+# 获取可用于多进程解析的进程上下文
+def _get_pool_context():
+    # spawn和forkserver方式会在子进程中重新导入机器人的启动脚本和整个插件，因此只使用fork
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+# 合并多个区间的解析结果
+def merge_range_results(results):
+    """
+    按时间顺序合并多个区间的解析结果
+    :param results: parse_log_range返回值的列表，按文件顺序排列
+    :return: (群聊消息字典, 统计信息)
+    """
+    stats = {'lines': 0, 'matched': 0, 'bad_time': 0}
+    per_group = {}
+    for group_messages, range_stats in results:
+        for key in stats:
+            stats[key] += range_stats[key]
+        for group_id, messages in group_messages.items():
+            per_group.setdefault(group_id, []).append(messages)
+
+    merged = {group_id: MessageBatch.merge(batches) for group_id, batches in per_group.items()}
+    return merged, stats
+
+# 多进程解析日志文件
+def parse_log_file(log_path, start_time=None, end_time=None, target_group=None, encoding='utf-8', workers=1, min_parallel_bytes=0, timeout=None):
+    """
+    解析日志文件，先定位时间窗口所在的字节区间，区间较大时再切分并使用多进程并行解析
+    子进程是从多线程的机器人进程fork出来的，可能因为继承了被其他线程持有的锁而卡住，超时后结束子进程并改为在当前进程中解析
+    :param log_path: 日志文件路径
+    :param start_time: 开始时间，格式为datetime对象
+    :param end_time: 结束时间，格式为datetime对象
+    :param target_group: 目标群号，为None时解析所有群
+    :param encoding: 日志文件编码
+    :param workers: 进程数，小于等于1时不使用多进程
+    :param min_parallel_bytes: 文件大小超过该值时才使用多进程
+    :param timeout: 多进程解析的最长秒数，为None时不限制
+    :return: (群聊消息字典 {群号: 消息批次}, 统计信息)，多进程解析超时时统计信息中parallel_timeout为True
+    """
+    # 先二分查找时间窗口对应的字节区间，只解析窗口内的内容
+    with open(log_path, 'rb') as f:
+        mm = open_log_mmap(f)
+        if mm is None:
+            return {}, {'lines': 0, 'matched': 0, 'bad_time': 0}
+        try:
+            range_start, range_end = find_time_window(mm, start_time, end_time)
+        finally:
+            mm.close()
+
+    context = _get_pool_context()
+
+    if workers <= 1 or range_end - range_start < min_parallel_bytes or context is None:
+        return parse_log_range(log_path, range_start, range_end, start_time, end_time, target_group, encoding)
+
+    # 区间数量多于进程数，让先完成的进程继续处理剩余区间
+    ranges = split_file_ranges(log_path, workers * 4, range_start, range_end)
+    tasks = [
+        (log_path, part_start, part_end, start_time, end_time, target_group, encoding)
+        for part_start, part_end in ranges
+    ]
+    # 退出with时会强制结束所有子进程，包括卡住的
+    with context.Pool(workers) as pool:
+        try:
+            results = pool.starmap_async(parse_log_range, tasks, chunksize=1).get(timeout)
+        except multiprocessing.TimeoutError:
+            results = None
+
+    if results is None:
+        group_messages, stats = parse_log_range(log_path, range_start, range_end, start_time, end_time, target_group, encoding)
+        stats['parallel_timeout'] = True
+        return group_messages, stats
+    return merge_range_results(results)
@@ -31,7 +31,10 @@ def log_start(func_name, **kwargs):
 def log_end(func_name, result=None):
     """记录函数执行结束"""
     if result is not None:
-        if isinstance(result, (dict, list)) and len(str(result)) > 200:
+        if isinstance(result, (bytes, bytearray)):
+            # 图片等二进制数据只记录大小
+            plugin_logger.info(f"函数 {func_name} 执行完成，返回二进制数据，大小: {len(result)} 字节")
+        elif isinstance(result, (dict, list)) and len(str(result)) > 200:
             plugin_logger.info(f"函数 {func_name} 执行完成，返回大型对象，长度: {len(str(result))}")
         else:
             plugin_logger.info(f"函数 {func_name} 执行完成，返回: {result}")
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from .message_batch import MessageBatch, iter_message_columns
+
+# 群聊消息归档数据库
+class MessageArchive:
+    """基于SQLite的群聊消息归档，按(群号, 时间)建立索引，支持任意时间窗口的查询"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'group_id TEXT NOT NULL, ts INTEGER NOT NULL, qq TEXT NOT NULL, content TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_group_ts ON messages (group_id, ts)')
+            # 记录出现过的群，查询所有群时不必扫描整个消息表
+            conn.execute('CREATE TABLE IF NOT EXISTS archive_groups (group_id TEXT PRIMARY KEY)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def is_empty(self):
+        """
+        判断归档是否为空
+        :return: 是否为空
+        """
+        with self._lock:
+            conn = self._connect()
+            return conn.execute('SELECT 1 FROM messages LIMIT 1').fetchone() is None
+
+    def insert_messages(self, bucketed_messages):
+        """
+        在一个事务中批量写入消息
+        :param bucketed_messages: 分桶消息字典 {(群号, 日期): [消息, ...]}
+        :return: 写入的消息数
+        """
+        rows = [
+            (group_id, ts, qq, content)
+            for (group_id, _), messages in bucketed_messages.items()
+            for ts, qq, content in iter_message_columns(messages)
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany('INSERT INTO messages (group_id, ts, qq, content) VALUES (?, ?, ?, ?)', rows)
+                self._add_groups(conn, bucketed_messages)
+        return len(rows)
+
+    def replace_days(self, bucketed_messages):
+        """
+        在一个事务中用新的记录替换对应(群号, 日期)的全部消息
+        :param bucketed_messages: 分桶消息字典 {(群号, 日期): [消息, ...]}
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for (group_id, date_str), messages in bucketed_messages.items():
+                    day_start = datetime.strptime(date_str, '%Y-%m-%d')
+                    conn.execute(
+                        'DELETE FROM messages WHERE group_id = ? AND ts >= ? AND ts < ?',
+                        (group_id, int(day_start.timestamp()), int((day_start + timedelta(days=1)).timestamp()))
+                    )
+                    conn.executemany(
+                        'INSERT INTO messages (group_id, ts, qq, content) VALUES (?, ?, ?, ?)',
+                        [(group_id, ts, qq, content) for ts, qq, content in iter_message_columns(messages)]
+                    )
+                self._add_groups(conn, bucketed_messages)
+
+    def _add_groups(self, conn, bucketed_messages):
+        group_ids = {group_id for group_id, _ in bucketed_messages}
+        conn.executemany('INSERT OR IGNORE INTO archive_groups (group_id) VALUES (?)', [(g,) for g in group_ids])
+
+    def query_window(self, start_time, end_time, target_group=None):
+        """
+        查询时间窗口内的消息，每个群都是一次索引范围扫描
+        :param start_time: 开始时间，格式为datetime对象
+        :param end_time: 结束时间（包含），格式为datetime对象
+        :param target_group: 目标群号，为None时查询所有群
+        :return: 群聊消息字典 {群号: 消息批次}
+        """
+        start_ts = int(start_time.timestamp())
+        end_ts = int(end_time.timestamp())
+        group_messages = {}
+        with self._lock:
+            conn = self._connect()
+            if target_group:
+                group_ids = [target_group]
+            else:
+                group_ids = [row[0] for row in conn.execute('SELECT group_id FROM archive_groups')]
+            for group_id in group_ids:
+                cursor = conn.execute(
+                    'SELECT ts, qq, content FROM messages WHERE group_id = ? AND ts >= ? AND ts <= ? ORDER BY ts, rowid',
+                    (group_id, start_ts, end_ts)
+                )
+                batch = MessageBatch.from_columns(cursor)
+                if batch:
+                    group_messages[group_id] = batch
+        return group_messages
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
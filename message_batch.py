@@ -0,0 +1,230 @@
+import sys
+import heapq
+from array import array
+from functools import lru_cache
+from operator import itemgetter
+from datetime import datetime, timedelta
+
+# 时间字符串转时间戳
+def time_str_to_ts(time_str):
+    """
+    将'YYYY-MM-DD HH:MM:SS'格式的时间字符串转换为时间戳，比strptime快得多
+    :param time_str: 时间字符串
+    :return: 时间戳（秒）
+    """
+    return int(datetime(
+        int(time_str[0:4]), int(time_str[5:7]), int(time_str[8:10]),
+        int(time_str[11:13]), int(time_str[14:16]), int(time_str[17:19])
+    ).timestamp())
+
+# 时间戳转时间字符串
+def ts_to_time_str(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+# 时间戳所在分钟的HH:MM，同一分钟内的消息只格式化一次
+@lru_cache(maxsize=4096)
+def _minute_to_hm(minute):
+    return datetime.fromtimestamp(minute * 60).strftime('%H:%M')
+
+def ts_to_hm(ts):
+    return _minute_to_hm(ts // 60)
+
+# 消息批次中的一行
+class MessageRow:
+    """消息批次中一行的只读视图，兼容按'time'、'qq'、'content'取值的字典用法"""
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def ts(self):
+        return self.batch.ts[self.index]
+
+    @property
+    def qq(self):
+        return self.batch.qq[self.index]
+
+    @property
+    def content(self):
+        return self.batch.content[self.index]
+
+    @property
+    def time(self):
+        return ts_to_time_str(self.ts)
+
+    def __getitem__(self, key):
+        if key in ('time', 'qq', 'content'):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ('time', 'qq', 'content')
+
+    def to_dict(self):
+        return {'time': self.time, 'qq': self.qq, 'content': self.content}
+
+    def __eq__(self, other):
+        if isinstance(other, (MessageRow, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, MessageRow) else other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"MessageRow({self.to_dict()!r})"
+
+# 按列存储的消息批次
+class MessageBatch:
+    """
+    按列存储一批消息：时间戳保存在整数数组中，发送者QQ号驻留为共享字符串，内容保存在列表中
+    比每条消息一个字典节省数倍内存，时间也不需要反复解析
+    """
+    __slots__ = ('ts', 'qq', 'content')
+
+    def __init__(self):
+        self.ts = array('q')
+        self.qq = []
+        self.content = []
+
+    @classmethod
+    def from_columns(cls, rows):
+        """
+        从(时间戳, QQ号, 内容)元组构建消息批次
+        :param rows: 可迭代的(时间戳, QQ号, 内容)元组
+        :return: MessageBatch
+        """
+        batch = cls()
+        for ts, qq, content in rows:
+            batch.append(ts, qq, content)
+        return batch
+
+    @classmethod
+    def from_messages(cls, messages):
+        """
+        从消息字典列表（或另一个消息批次）构建消息批次
+        :param messages: 消息批次，或可迭代的消息字典 {time, qq, content}
+        :return: MessageBatch，传入的已经是消息批次时直接返回
+        """
+        if isinstance(messages, cls):
+            return messages
+        return cls.from_columns(iter_message_columns(messages))
+
+    @classmethod
+    def merge(cls, batches):
+        """
+        按时间顺序合并多个消息批次，时间相同的消息保持原有先后顺序
+        :param batches: 消息批次列表
+        :return: MessageBatch
+        """
+        batches = [batch for batch in batches if batch]
+        if len(batches) == 1:
+            return batches[0]
+        # 各批次首尾相接时直接拼接
+        if all(prev.ts[-1] <= batch.ts[0] for prev, batch in zip(batches, batches[1:])):
+            merged = cls()
+            for batch in batches:
+                merged.extend(batch)
+            return merged
+        return cls.from_columns(heapq.merge(*(batch.iter_columns() for batch in batches), key=itemgetter(0)))
+
+    def append(self, ts, qq, content):
+        self.ts.append(ts)
+        self.qq.append(sys.intern(qq))
+        self.content.append(content)
+
+    def extend(self, messages):
+        """
+        追加另一批消息
+        :param messages: 消息批次，或可迭代的消息字典
+        """
+        if isinstance(messages, MessageBatch):
+            self.ts.extend(messages.ts)
+            self.qq.extend(messages.qq)
+            self.content.extend(messages.content)
+        else:
+            for ts, qq, content in iter_message_columns(messages):
+                self.append(ts, qq, content)
+
+    def iter_columns(self):
+        return zip(self.ts, self.qq, self.content)
+
+    def filter_window(self, start_ts, end_ts):
+        """
+        筛选时间范围内的消息
+        :param start_ts: 开始时间戳
+        :param end_ts: 结束时间戳（包含）
+        :return: MessageBatch
+        """
+        return MessageBatch.from_columns(row for row in self.iter_columns() if start_ts <= row[0] <= end_ts)
+
+    def split_by_day(self):
+        """
+        按消息所在日期拆分
+        :return: 字典 {日期字符串: MessageBatch}
+        """
+        days = {}
+        day_start = day_end = None
+        current = None
+        for ts, qq, content in self.iter_columns():
+            if day_start is None or not day_start <= ts < day_end:
+                day = datetime.fromtimestamp(ts).date()
+                day_start = int(datetime(day.year, day.month, day.day).timestamp())
+                day_end = int((datetime(day.year, day.month, day.day) + timedelta(days=1)).timestamp())
+                current = days.setdefault(day.strftime('%Y-%m-%d'), MessageBatch())
+            current.append(ts, qq, content)
+        return days
+
+    def to_dicts(self):
+        return [{'time': ts_to_time_str(ts), 'qq': qq, 'content': content} for ts, qq, content in self.iter_columns()]
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __iter__(self):
+        for index in range(len(self.ts)):
+            yield MessageRow(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            batch = MessageBatch()
+            batch.ts = self.ts[index]
+            batch.qq = self.qq[index]
+            batch.content = self.content[index]
+            return batch
+        if index < 0:
+            index += len(self.ts)
+        if not 0 <= index < len(self.ts):
+            raise IndexError('消息序号超出范围')
+        return MessageRow(self, index)
+
+    def __eq__(self, other):
+        if isinstance(other, MessageBatch):
+            return self.ts == other.ts and self.qq == other.qq and self.content == other.content
+        if isinstance(other, list):
+            return self.to_dicts() == [msg.to_dict() if isinstance(msg, MessageRow) else msg for msg in other]
+        return NotImplemented
+
+    def __repr__(self):
+        return f"MessageBatch({len(self)} 条消息)"
+
+# 逐条取出消息的各列
+def iter_message_columns(messages):
+    """
+    统一消息批次和消息字典列表的读取方式
+    :param messages: 消息批次，或可迭代的消息字典 {time, qq, content}
+    :return: 生成器，依次产出(时间戳, QQ号, 内容)元组
+    """
+    if isinstance(messages, MessageBatch):
+        yield from messages.iter_columns()
+        return
+    for msg in messages:
+        if isinstance(msg, MessageRow):
+            yield msg.ts, msg.qq, msg.content
+        else:
+            yield time_str_to_ts(msg['time']), msg['qq'], msg['content']
@@ -0,0 +1,98 @@
+import time
+import asyncio
+import traceback
+
+from .config import CAPTURE_BATCH_SIZE, CAPTURE_FLUSH_INTERVAL
+from .logger_helper import log_debug, log_error_msg
+from .log_parser import simplify_cq_code
+from .message_batch import MessageBatch, ts_to_time_str
+from .message_store import merge_group_messages
+
+# 批量写入实时捕获的群消息
+class MessageCaptureWriter:
+    """实时捕获的群消息先缓存在内存中，攒够一批或到达时间间隔后再追加写入按群按天保存的聊天记录"""
+    def __init__(self, batch_size=CAPTURE_BATCH_SIZE, flush_interval=CAPTURE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = {}
+        self._pending = 0
+        self._timer = None
+        self._lock = None
+
+    def add(self, group_id, ts, qq, content):
+        """
+        添加一条消息
+        :param group_id: 群号
+        :param ts: 消息时间戳（秒）
+        :param qq: 发送者QQ号
+        :param content: 简化后的消息内容
+        """
+        key = (group_id, ts_to_time_str(ts)[:10])
+        batch = self._buffer.get(key)
+        if batch is None:
+            batch = self._buffer[key] = MessageBatch()
+        batch.append(ts, qq, content)
+        self._pending += 1
+
+        loop = asyncio.get_event_loop()
+        if self._pending >= self.batch_size:
+            loop.create_task(self.flush())
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, lambda: loop.create_task(self.flush()))
+
+    async def flush(self):
+        """
+        把缓存的消息写入文件
+        :return: 写入的消息数
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return 0
+
+            bucketed, self._buffer, self._pending = self._buffer, {}, 0
+            try:
+                loop = asyncio.get_event_loop()
+                written = await loop.run_in_executor(None, merge_group_messages, bucketed, False)
+                log_debug(f"已写入 {written} 条实时捕获的群消息")
+                return written
+            except Exception as e:
+                log_error_msg(f"写入实时捕获的群消息失败，稍后重试: {str(e)}")
+                log_error_msg(traceback.format_exc())
+                # 写入失败的消息放回缓存，排在写入期间新收到的消息之前
+                for key, batch in bucketed.items():
+                    newer = self._buffer.get(key)
+                    self._buffer[key] = MessageBatch.merge([batch, newer]) if newer else batch
+                    self._pending += len(batch)
+                if self._timer is None:
+                    self._timer = loop.call_later(self.flush_interval, lambda: loop.create_task(self.flush()))
+                return 0
+
+# 全局写入器
+capture_writer = MessageCaptureWriter()
+
+# 捕获群消息
+def capture_group_message(ev):
+    """
+    将收到的群消息加入批量写入队列
+    :param ev: 群消息事件
+    """
+    ts = int(ev['time']) if ev.get('time') else int(time.time())
+    raw_message = ev.get('raw_message')
+    if raw_message is None:
+        raw_message = str(ev['message'])
+
+    capture_writer.add(str(ev['group_id']), ts, str(ev['user_id']), simplify_cq_code(raw_message))
+
+# 写入所有缓存的消息
+async def flush_captured_messages():
+    """
+    立即写入所有缓存的消息，生成日报前和机器人退出时调用
+    :return: 写入的消息数
+    """
+    return await capture_writer.flush()
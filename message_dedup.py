@@ -0,0 +1,98 @@
+import zlib
+from collections import OrderedDict
+
+from .config import DEDUP_WINDOW_SIZE, DEDUP_WINDOW_SECONDS, DEDUP_SIMILARITY
+from .token_budget import NORMALIZE_REGEX
+
+# 内容至少有这么多个字符才做近似匹配，更短的只做完全匹配
+NEAR_DUP_MIN_LENGTH = 6
+
+# MinHash签名保留的最小哈希数，也是近似匹配的分桶数
+MINHASH_SIZE = 4
+
+# 窗口中的一条消息及其重复次数
+class _RepeatEntry:
+    __slots__ = ('ts', 'qq', 'content', 'count', 'last_ts', 'key', 'shingles', 'signature')
+
+    def __init__(self, ts, qq, content, key, shingles, signature):
+        self.ts = ts
+        self.qq = qq
+        self.content = content
+        self.count = 1
+        self.last_ts = ts
+        self.key = key
+        self.shingles = shingles
+        self.signature = signature
+
+# 合并重复消息
+def collapse_repeats(rows):
+    """
+    流式合并复读、刷屏等重复消息，不要求重复消息连续出现，也不要求来自同一个发言人
+    每条消息只和滑动窗口内的消息比较：内容规范化后完全相同，或字符二元组的Jaccard相似度达到阈值即视为重复
+    近似匹配的候选通过MinHash签名分桶查找，每条消息的处理时间与窗口大小无关，整体为线性时间
+    :param rows: 可迭代的(时间戳, QQ号, 内容)元组，按时间排序
+    :return: (时间戳, QQ号, 内容)元组列表，重复多次的消息保留第一次出现的位置，内容后加上“(×次数)”
+    """
+    entries = []
+    # 按最近一次出现的先后排序的窗口
+    window = OrderedDict()
+    exact_index = {}
+    bucket_index = {}
+
+    def evict():
+        old, _ = window.popitem(last=False)
+        if exact_index.get(old.key) is old:
+            del exact_index[old.key]
+        for value in old.signature:
+            if bucket_index.get(value) is old:
+                del bucket_index[value]
+
+    for ts, qq, content in rows:
+        # 移出超出时间范围的消息
+        while window and ts - next(iter(window)).last_ts > DEDUP_WINDOW_SECONDS:
+            evict()
+
+        key = NORMALIZE_REGEX.sub('', content).lower() or content
+        entry = exact_index.get(key)
+
+        shingles = signature = ()
+        if entry is None and len(key) >= NEAR_DUP_MIN_LENGTH:
+            shingles = frozenset(map(str.__add__, key, key[1:]))
+            # 不使用内置hash，字符串的hash值每次启动都不同，合并结果和摘要缓存键会随之变化
+            signature = sorted(zlib.crc32(shingle.encode('utf-8')) for shingle in shingles)[:MINHASH_SIZE]
+            size = len(shingles)
+            checked = set()
+            for value in signature:
+                candidate = bucket_index.get(value)
+                if candidate is None or candidate in checked:
+                    continue
+                checked.add(candidate)
+                other_size = len(candidate.shingles)
+                # 集合大小相差太多时相似度不可能达到阈值
+                if min(size, other_size) < DEDUP_SIMILARITY * max(size, other_size):
+                    continue
+                common = len(shingles & candidate.shingles)
+                if common >= DEDUP_SIMILARITY * (size + other_size - common):
+                    entry = candidate
+                    break
+
+        if entry is not None:
+            entry.count += 1
+            entry.last_ts = ts
+            # 重复的消息移到窗口末尾，持续刷屏时不会被移出窗口
+            window.move_to_end(entry)
+            continue
+
+        entry = _RepeatEntry(ts, qq, content, key, shingles, signature)
+        entries.append(entry)
+        window[entry] = None
+        exact_index[key] = entry
+        for value in signature:
+            bucket_index[value] = entry
+        if len(window) > DEDUP_WINDOW_SIZE:
+            evict()
+
+    return [
+        (entry.ts, entry.qq, f"{entry.content} (×{entry.count})" if entry.count > 1 else entry.content)
+        for entry in entries
+    ]
@@ -0,0 +1,348 @@
+import os
+import re
+import json
+import threading
+from datetime import timedelta
+
+from .config import DATA_DIR, STORE_SEGMENT_MAX_BYTES, ENABLE_MESSAGE_ARCHIVE, ARCHIVE_DB_PATH
+from .message_archive import MessageArchive
+from .message_batch import MessageBatch, iter_message_columns, time_str_to_ts
+
+# 按天保存的群聊记录目录，结构为 messages/{日期}/{群号}-{分段号}.jsonl
+STORE_DIR = os.path.join(DATA_DIR, 'messages')
+
+# 分段文件名格式
+SEGMENT_REGEX = re.compile(r'^(\d+)-(\d{3})\.jsonl$')
+
+# 旧版本保存的整个JSON数组文件，格式为 {群号}_{日期}.json
+LEGACY_FILE_REGEX = re.compile(r'^(\d+)_(\d{4}-\d{2}-\d{2})\.json$')
+
+# 同一进程内的写入互斥，避免实时捕获和日志解析同时写同一个分段
+_write_lock = threading.Lock()
+
+# 归档数据库实例，首次使用时创建
+_archive = None
+_archive_lock = threading.Lock()
+
+# 确保目录存在
+os.makedirs(STORE_DIR, exist_ok=True)
+
+# 编码一条消息，时间保存为时间戳
+def _encode_message(ts, qq, content):
+    return json.dumps([ts, qq, content], ensure_ascii=False, separators=(',', ':')) + '\n'
+
+# 解码一条消息，兼容时间保存为字符串的旧分段
+def _decode_message(line):
+    ts, qq, content = json.loads(line)
+    if isinstance(ts, str):
+        ts = time_str_to_ts(ts)
+    return ts, qq, content
+
+# 编码一批消息
+def _encode_messages(messages):
+    return ''.join(_encode_message(ts, qq, content) for ts, qq, content in iter_message_columns(messages))
+
+# 旧版本的群聊日志文件路径
+def legacy_log_path(group_id, date_str):
+    return os.path.join(DATA_DIR, f"{group_id}_{date_str}.json")
+
+# 某个群某天的分段文件路径
+def _segment_path(group_id, date_str, index):
+    return os.path.join(STORE_DIR, date_str, f"{group_id}-{index:03d}.jsonl")
+
+# 列出某个群某天的所有分段
+def _list_segments(group_id, date_str):
+    day_dir = os.path.join(STORE_DIR, date_str)
+    if not os.path.isdir(day_dir):
+        return []
+    segments = []
+    for name in os.listdir(day_dir):
+        match = SEGMENT_REGEX.match(name)
+        if match and match.group(1) == str(group_id):
+            segments.append((int(match.group(2)), os.path.join(day_dir, name)))
+    return [path for _, path in sorted(segments)]
+
+# 一次性写入一个新的分段文件
+def _write_segment(path, messages):
+    """
+    先写临时文件再替换，读取方不会看到写了一半的分段
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(_encode_messages(messages))
+    os.replace(temp_path, path)
+
+# 把旧版本的JSON文件迁移为分段
+def _migrate_legacy(group_id, date_str):
+    legacy_path = legacy_log_path(group_id, date_str)
+    if not os.path.exists(legacy_path) or _list_segments(group_id, date_str):
+        return
+    with open(legacy_path, 'r', encoding='utf-8') as f:
+        messages = json.load(f)
+    _write_segment(_segment_path(group_id, date_str, 0), messages)
+    os.remove(legacy_path)
+
+# 逐条读取群聊日志
+def iter_group_messages(group_id, date_str):
+    """
+    流式读取指定群指定日期的聊天记录，不会把整天的记录一次性读入内存
+    :param group_id: 群号
+    :param date_str: 日期字符串，格式为'YYYY-MM-DD'
+    :return: 生成器，依次产出(时间戳, QQ号, 内容)元组
+    """
+    segments = _list_segments(group_id, date_str)
+    if not segments:
+        legacy_path = legacy_log_path(group_id, date_str)
+        if os.path.exists(legacy_path):
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                yield from iter_message_columns(json.load(f))
+        return
+
+    for path in segments:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # 末尾没有换行符的行可能正在写入，跳过
+                if not line.endswith('\n'):
+                    break
+                yield _decode_message(line)
+
+# 判断是否有群聊日志
+def has_group_messages(group_id, date_str):
+    return bool(_list_segments(group_id, date_str)) or os.path.exists(legacy_log_path(group_id, date_str))
+
+# 读取群聊日志
+def load_group_messages(group_id, date_str):
+    """
+    读取指定群指定日期的聊天记录
+    :param group_id: 群号
+    :param date_str: 日期字符串
+    :return: 消息批次，没有记录时返回None
+    """
+    if not has_group_messages(group_id, date_str):
+        return None
+    return MessageBatch.from_columns(iter_group_messages(group_id, date_str))
+
+# 统计群聊日志的消息数
+def count_group_messages(group_id, date_str):
+    """
+    统计指定群指定日期的消息数，只数行数不解析内容
+    :param group_id: 群号
+    :param date_str: 日期字符串
+    :return: 消息数
+    """
+    segments = _list_segments(group_id, date_str)
+    if not segments:
+        messages = load_group_messages(group_id, date_str)
+        return len(messages) if messages else 0
+    count = 0
+    for path in segments:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                count += block.count(b'\n')
+    return count
+
+# 获取归档数据库
+def get_archive():
+    """
+    获取归档数据库实例，数据库为空时先导入已有的按天保存的记录
+    写入记录前需要先获取，避免刚写入的记录被导入后又重复写入归档
+    :return: MessageArchive实例，未启用归档时返回None
+    """
+    global _archive
+    if not ENABLE_MESSAGE_ARCHIVE:
+        return None
+    with _archive_lock:
+        if _archive is None:
+            archive = MessageArchive(ARCHIVE_DB_PATH)
+            if archive.is_empty():
+                for date_str in list_days():
+                    archive.replace_days({
+                        (group_id, date_str): load_group_messages(group_id, date_str)
+                        for group_id in list_groups(date_str)
+                    })
+            _archive = archive
+    return _archive
+
+# 写入群聊日志文件
+def _save_segments(group_id, date_str, messages):
+    with _write_lock:
+        first_segment = _segment_path(group_id, date_str, 0)
+        for path in _list_segments(group_id, date_str):
+            if path != first_segment:
+                os.remove(path)
+        _write_segment(first_segment, messages)
+
+        legacy_path = legacy_log_path(group_id, date_str)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+# 追加群聊日志文件
+def _append_segments(group_id, date_str, messages):
+    with _write_lock:
+        _migrate_legacy(group_id, date_str)
+        segments = _list_segments(group_id, date_str)
+        if not segments:
+            _write_segment(_segment_path(group_id, date_str, 0), messages)
+            return
+
+        last_segment = segments[-1]
+        if os.path.getsize(last_segment) >= STORE_SEGMENT_MAX_BYTES:
+            index = int(SEGMENT_REGEX.match(os.path.basename(last_segment)).group(2)) + 1
+            _write_segment(_segment_path(group_id, date_str, index), messages)
+            return
+
+        data = _encode_messages(messages)
+        with open(last_segment, 'a', encoding='utf-8') as f:
+            f.write(data)
+
+# 写入群聊日志
+def save_group_messages(group_id, date_str, messages):
+    """
+    覆盖写入指定群指定日期的聊天记录
+    :param group_id: 群号
+    :param date_str: 日期字符串
+    :param messages: 消息批次或消息字典列表
+    """
+    archive = get_archive()
+    _save_segments(group_id, date_str, messages)
+    if archive:
+        archive.replace_days({(group_id, date_str): messages})
+
+# 追加群聊日志
+def append_group_messages(group_id, date_str, messages):
+    """
+    追加写入指定群指定日期的聊天记录，只写入新消息，不重写已有内容
+    当前分段超过大小限制时新建下一个分段
+    :param group_id: 群号
+    :param date_str: 日期字符串
+    :param messages: 新消息批次或消息字典列表
+    """
+    if not messages:
+        return
+    archive = get_archive()
+    if archive:
+        archive.insert_messages({(group_id, date_str): messages})
+    _append_segments(group_id, date_str, messages)
+
+# 列出有记录的日期
+def list_days():
+    """
+    列出所有有聊天记录的日期
+    :return: 日期字符串列表
+    """
+    days = {name for name in os.listdir(STORE_DIR) if os.path.isdir(os.path.join(STORE_DIR, name))}
+    for name in os.listdir(DATA_DIR):
+        match = LEGACY_FILE_REGEX.match(name)
+        if match:
+            days.add(match.group(2))
+    return sorted(days)
+
+# 列出某天有记录的群
+def list_groups(date_str):
+    """
+    列出指定日期有聊天记录的群
+    :param date_str: 日期字符串
+    :return: 群号列表
+    """
+    groups = set()
+    day_dir = os.path.join(STORE_DIR, date_str)
+    if os.path.isdir(day_dir):
+        for name in os.listdir(day_dir):
+            match = SEGMENT_REGEX.match(name)
+            if match:
+                groups.add(match.group(1))
+    for name in os.listdir(DATA_DIR):
+        match = LEGACY_FILE_REGEX.match(name)
+        if match and match.group(2) == date_str:
+            groups.add(match.group(1))
+    return sorted(groups)
+
+# 读取某天的群聊记录
+def load_day_messages(date_str, target_group=None):
+    """
+    读取指定日期所有群（或指定群）的聊天记录
+    :param date_str: 日期字符串
+    :param target_group: 目标群号，为None时读取所有群
+    :return: 群聊消息字典 {群号: 消息批次}
+    """
+    group_ids = [target_group] if target_group else list_groups(date_str)
+    group_messages = {}
+    for group_id in group_ids:
+        messages = load_group_messages(group_id, date_str)
+        if messages:
+            group_messages[group_id] = messages
+    return group_messages
+
+# 合并新消息到群聊日志
+def merge_group_messages(bucketed_messages, replace=False):
+    """
+    将按(群号, 日期)分桶的新消息合并到对应的群聊日志
+    :param bucketed_messages: 分桶消息字典 {(群号, 日期): [消息, ...]}
+    :param replace: 为True时覆盖已有记录，否则追加到已有记录之后
+    :return: 新写入的消息总数
+    """
+    archive = get_archive()
+    bucketed_messages = {key: messages for key, messages in bucketed_messages.items() if messages}
+
+    # 所有分桶在一个事务中先写入归档，写入失败时分段还没有追加，调用方重试不会重复写入分段
+    if archive and bucketed_messages:
+        if replace:
+            archive.replace_days(bucketed_messages)
+        else:
+            archive.insert_messages(bucketed_messages)
+
+    for (group_id, date_str), messages in bucketed_messages.items():
+        if replace:
+            _save_segments(group_id, date_str, messages)
+        else:
+            _append_segments(group_id, date_str, messages)
+    return sum(len(messages) for messages in bucketed_messages.values())
+
+# 用更完整的记录替换群聊日志
+def replace_smaller_groups(bucketed_messages):
+    """
+    用完整解析得到的分桶消息替换已有记录，只有新记录比已有记录更多时才替换
+    同一天的记录来自同一份不断增长的日志，消息更多的一份即更完整的一份
+    :param bucketed_messages: 分桶消息字典 {(群号, 日期): [消息, ...]}
+    :return: 被替换的分桶数
+    """
+    archive = get_archive()
+    replaced = {}
+    for (group_id, date_str), messages in bucketed_messages.items():
+        if not messages:
+            continue
+        if count_group_messages(group_id, date_str) >= len(messages):
+            continue
+        _save_segments(group_id, date_str, messages)
+        replaced[(group_id, date_str)] = messages
+
+    if archive and replaced:
+        archive.replace_days(replaced)
+    return len(replaced)
+
+# 读取时间范围内的群聊记录
+def load_window_messages(start_time, end_time, target_group=None):
+    """
+    读取任意时间范围内所有群（或指定群）的聊天记录
+    启用归档时每个群只需一次索引范围查询，否则逐天读取按天保存的记录再按时间过滤
+    :param start_time: 开始时间，格式为datetime对象
+    :param end_time: 结束时间（包含），格式为datetime对象
+    :param target_group: 目标群号，为None时读取所有群
+    :return: 群聊消息字典 {群号: 消息批次}
+    """
+    archive = get_archive()
+    if archive:
+        return archive.query_window(start_time, end_time, target_group)
+
+    start_ts = int(start_time.timestamp())
+    end_ts = int(end_time.timestamp())
+    group_messages = {}
+    day = start_time.date()
+    while day <= end_time.date():
+        for group_id, batch in load_day_messages(day.strftime('%Y-%m-%d'), target_group).items():
+            batch = batch.filter_window(start_ts, end_ts)
+            if batch:
+                group_messages.setdefault(group_id, MessageBatch()).extend(batch)
+        day += timedelta(days=1)
+    return group_messages
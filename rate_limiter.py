@@ -0,0 +1,163 @@
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+from .config import (
+    AI_REQUESTS_PER_MINUTE, AI_TOKENS_PER_MINUTE, AI_MIN_CONCURRENCY, AI_MAX_CONCURRENCY,
+    AI_INITIAL_CONCURRENCY, AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY
+)
+from .logger_helper import log_debug, log_info, log_warning
+
+# 令牌桶
+class TokenBucket:
+    """按分钟额度匀速补充的令牌桶，额度为0表示不限制"""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        计算取出指定数量的令牌还需要等待的秒数
+        :param amount: 令牌数，超过桶容量时按桶容量计算，避免永远等不到
+        :return: 需要等待的秒数，0表示可以立即取出
+        """
+        if not self.capacity:
+            return 0
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0
+
+    def take(self, amount):
+        """取出令牌，允许欠账，欠下的部分由之后的补充抵消"""
+        if self.capacity:
+            self._refill()
+            self.level -= amount
+
+# 解析Retry-After响应头
+def parse_retry_after(value):
+    """
+    解析Retry-After响应头，支持秒数和HTTP日期两种格式
+    :param value: 响应头的值
+    :return: 需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# AI请求限流器
+class AdaptiveLimiter:
+    """
+    进程内所有AI请求共用的限流器：
+    1. 请求数和token数两个令牌桶，限制每分钟的请求量
+    2. 并发上限按AIMD调整，请求成功时缓慢增加，遇到429或5xx时减半
+    3. 服务端返回Retry-After时，所有请求都暂停到指定时间
+    """
+    def __init__(self):
+        self.request_bucket = TokenBucket(AI_REQUESTS_PER_MINUTE)
+        self.token_bucket = TokenBucket(AI_TOKENS_PER_MINUTE)
+        self.limit = float(AI_INITIAL_CONCURRENCY)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, tokens):
+        """
+        等待到并发、请求数和token数都有余量时占用一个请求名额
+        :param tokens: 本次请求预计消耗的token数
+        """
+        async with self._condition:
+            while True:
+                delay = max(
+                    self.paused_until - time.monotonic(),
+                    self.request_bucket.wait_time(1),
+                    self.token_bucket.wait_time(tokens)
+                )
+                if self.in_flight < int(self.limit) and delay <= 0:
+                    break
+                try:
+                    # 有请求结束时会被唤醒，令牌不足时等到补充够为止
+                    await asyncio.wait_for(self._condition.wait(), timeout=delay if delay > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            self.in_flight += 1
+            self.request_bucket.take(1)
+            self.token_bucket.take(tokens)
+
+    async def release(self, status, estimated_tokens=0, actual_tokens=None):
+        """
+        释放请求名额，并根据请求结果调整并发上限
+        :param status: 'ok' 请求成功，'overload' 服务端过载（429、5xx或超时），其他值不调整并发上限
+        :param estimated_tokens: 占用名额时预计的token数
+        :param actual_tokens: 实际消耗的token数，用于修正token桶
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if actual_tokens is not None:
+                self.token_bucket.take(actual_tokens - estimated_tokens)
+            if status == 'ok':
+                # 加性增加：每个并发上限数量的成功请求增加1
+                self.limit = min(AI_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            elif status == 'overload':
+                self._decrease()
+            self._condition.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        # 同一批并发请求一起失败时只减半一次
+        if now - self._last_decrease < AI_RETRY_BASE_DELAY:
+            return
+        self._last_decrease = now
+        old_limit = self.limit
+        self.limit = max(AI_MIN_CONCURRENCY, self.limit / 2)
+        log_warning(f"AI接口过载，并发上限从 {int(old_limit)} 降到 {int(self.limit)}")
+
+    async def pause(self, seconds):
+        """
+        所有请求暂停指定秒数，用于服务端返回Retry-After的情况
+        :param seconds: 暂停秒数
+        """
+        async with self._condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+        log_info(f"AI接口要求等待 {seconds:.1f} 秒后重试，暂停所有请求")
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """
+        计算重试前等待的秒数：带随机抖动的指数退避，服务端指定了Retry-After时至少等待该时间
+        :param attempt: 已经失败的次数，从1开始
+        :param retry_after: 服务端要求等待的秒数
+        :return: 等待秒数
+        """
+        delay = random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        log_debug(f"第 {attempt} 次失败，{delay:.1f} 秒后重试")
+        return delay
+
+    def describe(self):
+        return f"AI并发上限: {int(self.limit)}（当前 {self.in_flight} 个请求）"
+
+# 全局限流器，第一次使用时创建
+_ai_limiter = None
+
+def get_ai_limiter():
+    global _ai_limiter
+    if _ai_limiter is None:
+        _ai_limiter = AdaptiveLimiter()
+    return _ai_limiter
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import hashlib
+
+from .config import DATA_DIR, SUMMARY_CACHE_TTL, SUMMARY_CACHE_MAX_ENTRIES
+from .logger_helper import log_debug, log_warning
+
+# 摘要缓存目录，每条缓存一个文件，文件名为缓存键
+SUMMARY_CACHE_DIR = os.path.join(DATA_DIR, 'summary_cache')
+
+# 确保目录存在
+os.makedirs(SUMMARY_CACHE_DIR, exist_ok=True)
+
+# 计算缓存键
+def make_cache_key(group_id, chat_log, template, model, temperature):
+    """
+    根据群号、聊天记录、提示词模板和模型参数计算缓存键，任意一项变化都会得到新的键
+    群号会作为群名写进提示词，内容相同的不同群也不能共用缓存
+    :param group_id: 群号
+    :param chat_log: 优化后的聊天记录文本
+    :param template: 提示词模板
+    :param model: 模型名称
+    :param temperature: 生成温度
+    :return: 缓存键（sha256十六进制字符串）
+    """
+    data = json.dumps([group_id, chat_log, template, model, temperature], ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+# 缓存文件路径
+def _cache_path(key):
+    return os.path.join(SUMMARY_CACHE_DIR, f"{key}.json")
+
+# 读取缓存的摘要
+def get_cached_summary(key):
+    """
+    读取缓存的摘要，过期的缓存视为不存在
+    :param key: 缓存键
+    :return: 摘要内容，没有可用缓存时返回None
+    """
+    path = _cache_path(key)
+    try:
+        # 文件修改时间即最近一次使用的时间
+        if time.time() - os.path.getmtime(path) > SUMMARY_CACHE_TTL:
+            os.remove(path)
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        os.utime(path)
+        return entry.get('summary')
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_warning(f"读取摘要缓存失败: {str(e)}")
+        return None
+
+# 保存摘要到缓存
+def save_cached_summary(key, summary, group_id=None):
+    """
+    保存摘要到缓存，并清理过期和超出数量限制的缓存
+    :param key: 缓存键
+    :param summary: 摘要内容
+    :param group_id: 群号，仅用于排查问题
+    """
+    path = _cache_path(key)
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'group_id': group_id, 'created': time.time(), 'summary': summary}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except Exception as e:
+        log_warning(f"保存摘要缓存失败: {str(e)}")
+        return
+    prune_summary_cache()
+
+# 清理缓存
+def prune_summary_cache():
+    """
+    删除过期的缓存，数量超出限制时按最近使用时间删除最旧的缓存
+    :return: 删除的缓存数
+    """
+    now = time.time()
+    entries = []
+    removed = 0
+    for name in os.listdir(SUMMARY_CACHE_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(SUMMARY_CACHE_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+            if now - mtime > SUMMARY_CACHE_TTL:
+                os.remove(path)
+                removed += 1
+            else:
+                entries.append((mtime, path))
+        except FileNotFoundError:
+            continue
+
+    if len(entries) > SUMMARY_CACHE_MAX_ENTRIES:
+        entries.sort()
+        for _, path in entries[:len(entries) - SUMMARY_CACHE_MAX_ENTRIES]:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                continue
+
+    if removed:
+        log_debug(f"已清理 {removed} 条摘要缓存")
+    return removed
@@ -7,6 +7,8 @@ from datetime import datetime
 import traceback
 from pathlib import Path
 import re # Added for preprocess_content
+from functools import lru_cache
+from urllib.parse import unquote
 
 # 导入第三方库
 try:
@@ -17,7 +19,8 @@ try:
 except ImportError:
     PLAYWRIGHT_AVAILABLE = False
 
-from .logger_helper import log_info, log_warning, log_error_msg
+from .config import BROWSER_POOL_SIZE, BROWSER_IDLE_TIMEOUT, RENDER_READY_TIMEOUT, RENDER_FALLBACK_WAIT
+from .logger_helper import log_debug, log_info, log_warning, log_error_msg
 
 # 数据目录
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -89,106 +92,387 @@ async def install_playwright_deps():
         log_warning(f"安装Playwright依赖时出错: {str(e)}")
         return False
 
-async def html_to_screenshot(html_path, output_path):
+# 报告模板中@font-face声明的字体名
+REPORT_FONT_FAMILY = "CustomFont"
+
+# 判断页面是否可以截图：字体和图片加载完成，并且报告容器的尺寸连续两帧不再变化
+# 字体加载失败时document.fonts.ready同样会完成，需要另外检查字体是否真正可用
+READY_SCRIPT = """
+async ({timeout, fontFamily}) => {
+    const deadline = performance.now() + timeout;
+    await document.fonts.ready;
+    const fontLoaded = Array.from(document.fonts).every(face => face.status !== 'error')
+        && document.fonts.check(`16px "${fontFamily}"`);
+    await Promise.all(Array.from(document.images).map(img => img.complete ? null :
+        new Promise(resolve => { img.onload = img.onerror = resolve; })));
+    const el = document.querySelector('.bento-container') || document.body;
+    let last = null;
+    let stable = 0;
+    while (stable < 2 && performance.now() < deadline) {
+        await new Promise(resolve => requestAnimationFrame(resolve));
+        const rect = el.getBoundingClientRect();
+        const size = rect.width + 'x' + rect.height;
+        stable = size === last ? stable + 1 : 0;
+        last = size;
+    }
+    return {stable: stable >= 2, fontLoaded};
+}
+"""
+
+# 页面引用字体等本地文件时使用的地址，请求由页面路由直接返回文件内容，不经过网络
+ASSET_BASE_URL = "http://dailysum.render/"
+
+# 可以通过ASSET_BASE_URL访问的本地文件 {文件名: 文件路径}
+_asset_paths = {}
+
+# 按扩展名返回的文件类型，未列出的按二进制文件返回
+ASSET_CONTENT_TYPES = {
+    '.ttf': 'font/ttf',
+    '.ttc': 'font/collection',
+    '.otf': 'font/otf',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+}
+
+# 本地文件的访问地址
+def get_asset_url(path):
     """
-    使用Playwright将HTML转换为图片
-    :param html_path: HTML文件路径
-    :param output_path: 输出图片路径
-    :return: 是否成功
+    获取本地文件在渲染页面中的访问地址
+    通过set_content加载的页面不能引用file://地址的文件，需要经由页面路由返回
+    :param path: 文件路径
+    :return: 访问地址
     """
-    if not PLAYWRIGHT_AVAILABLE:
-        log_warning("缺少Playwright库，无法进行HTML转图片，请安装: pip install playwright")
-        return False
-    
-    try:
-        log_info("使用Playwright将HTML转换为图片...")
-        async with async_playwright() as p:
+    name = os.path.basename(path)
+    _asset_paths[name] = os.path.abspath(path)
+    return ASSET_BASE_URL + "assets/" + name
+
+@lru_cache(maxsize=8)
+def _read_asset(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+# 页面路由：返回本地文件
+async def _serve_asset(route):
+    name = unquote(route.request.url[len(ASSET_BASE_URL):].split('/', 1)[-1])
+    path = _asset_paths.get(name)
+    if not path or not os.path.exists(path):
+        await route.fulfill(status=404, body=b"")
+        return
+    # set_content加载的页面来源是about:blank，与ASSET_BASE_URL不同源，而字体按CORS方式请求，需要允许跨域
+    content_type = ASSET_CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+    await route.fulfill(
+        status=200,
+        body=_read_asset(path),
+        content_type=content_type,
+        headers={"Access-Control-Allow-Origin": "*"}
+    )
+
+# 常驻浏览器和页面池
+class BrowserPool:
+    """
+    常驻的Chromium浏览器和可复用的页面池，第一次渲染时才启动浏览器
+    页面用完后放回池中，浏览器崩溃时下次使用自动重新启动，空闲一段时间后自动关闭
+    """
+    def __init__(self, size=BROWSER_POOL_SIZE, idle_timeout=BROWSER_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._playwright = None
+        self._browser = None
+        self._idle_pages = []
+        self._active = 0
+        self._last_used = 0.0
+        self._lock = None
+        self._semaphore = None
+        self._idle_task = None
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.size)
+        return self._lock
+
+    def is_alive(self):
+        return self._browser is not None and self._browser.is_connected()
+
+    async def _ensure_browser(self):
+        """
+        确保浏览器在运行，没有启动或已经崩溃时重新启动
+        """
+        async with self._get_lock():
+            if self.is_alive():
+                return self._browser
+            if self._browser is not None:
+                log_warning("浏览器已断开连接，正在重新启动...")
+                await self._shutdown()
+            
+            log_info("启动常驻浏览器...")
+            self._playwright = await async_playwright().start()
             # 检查是否有自定义浏览器路径
             if CUSTOM_BROWSER_PATH and os.path.exists(CUSTOM_BROWSER_PATH):
                 log_info(f"使用自定义Chromium: {CUSTOM_BROWSER_PATH}")
-                browser = await p.chromium.launch(executable_path=CUSTOM_BROWSER_PATH)
+                self._browser = await self._playwright.chromium.launch(executable_path=CUSTOM_BROWSER_PATH)
             else:
-                browser = await p.chromium.launch()
-                
-            page = await browser.new_page()
-            
-            # 添加控制台消息监听
-            page.on("console", lambda msg: log_info(f"浏览器控制台: {msg.text}"))
-            
-            # 加载HTML文件
-            try:
-                log_info(f"正在加载HTML文件: {html_path}")
-                await page.goto(f"file://{html_path}", timeout=30000)  # 增加超时时间到30秒
-            except Exception as e:
-                log_error_msg(f"加载HTML文件失败: {str(e)}")
-                await browser.close()
-                return False
-            
-            # 等待内容加载
-            try:
-                log_info("等待页面网络空闲...")
-                await page.wait_for_load_state("networkidle", timeout=30000)
-                
-                # 增加等待时间，确保页面完全渲染
-                log_info("等待页面渲染...")
-                await page.wait_for_timeout(3000)  # 等待3秒钟
-            except Exception as e:
-                log_warning(f"等待页面加载时出错: {str(e)}，尝试继续...")
-            
-            screenshot_success = False
+                self._browser = await self._playwright.chromium.launch()
             
-            # 只截取报告容器部分，去掉周围的白边
-            try:
-                log_info("尝试截取Bento容器部分...")
-                container = await page.query_selector('.bento-container')
-                if container:
-                    await container.screenshot(path=output_path)
-                    log_info("成功截取Bento Grid容器部分")
-                    screenshot_success = True
-                else:
-                    # 如果找不到容器，则截取整个页面
-                    log_warning("未找到Bento容器，将尝试截取整个页面")
-            except Exception as e:
-                log_warning(f"截取容器时出错: {str(e)}，尝试截取整个页面...")
-            
-            # 如果容器截图失败，尝试截取整个页面
-            if not screenshot_success:
-                try:
-                    log_info("尝试截取整个页面...")
-                    await page.screenshot(path=output_path, full_page=True)
-                    log_info("成功截取整个页面")
-                    screenshot_success = True
-                except Exception as e:
-                    log_error_msg(f"截取整个页面失败: {str(e)}")
-                    screenshot_success = False
-            
-            await browser.close()
-            
-        if screenshot_success and os.path.exists(output_path):
-            log_info(f"HTML转图片成功，输出到: {output_path}")
+            if self._idle_task is None or self._idle_task.done():
+                self._idle_task = asyncio.get_event_loop().create_task(self._close_when_idle())
+            return self._browser
+
+    async def _new_page(self, browser):
+        # 每个页面使用独立的上下文，互不影响
+        context = await browser.new_context()
+        page = await context.new_page()
+        page.on("console", lambda msg: log_info(f"浏览器控制台: {msg.text}"))
+        await page.route(ASSET_BASE_URL + "**", _serve_asset)
+        return page
+
+    async def _is_healthy(self, page):
+        if page.is_closed() or not self.is_alive():
+            return False
+        try:
+            await asyncio.wait_for(page.evaluate("1"), timeout=5)
             return True
-        else:
-            log_warning("HTML转图片失败，未能生成有效的图片文件")
+        except Exception:
             return False
+
+    async def _close_page(self, page):
+        try:
+            await page.context.close()
+        except Exception:
+            pass
+
+    async def acquire(self):
+        """
+        取出一个可用的页面，池中没有空闲页面时新建，页面数达到上限时等待其他渲染完成
+        :return: 页面对象，用完后需要调用release放回
+        """
+        self._get_lock()
+        await self._semaphore.acquire()
+        self._active += 1
+        try:
+            browser = await self._ensure_browser()
+            while self._idle_pages:
+                page = self._idle_pages.pop()
+                if await self._is_healthy(page):
+                    return page
+                log_debug("丢弃失效的渲染页面")
+                await self._close_page(page)
+            return await self._new_page(browser)
+        except BaseException:
+            self._active -= 1
+            self._semaphore.release()
+            raise
+
+    async def release(self, page, discard=False):
+        """
+        放回页面
+        :param page: acquire取出的页面
+        :param discard: 页面出错时丢弃，不再复用
+        """
+        try:
+            if discard or page.is_closed() or not self.is_alive():
+                await self._close_page(page)
+            else:
+                self._idle_pages.append(page)
+        finally:
+            self._active -= 1
+            self._last_used = asyncio.get_event_loop().time()
+            self._semaphore.release()
+
+    async def _close_when_idle(self):
+        """
+        定期检查，没有渲染任务且空闲超时后关闭浏览器
+        """
+        while self._browser is not None:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            idle = asyncio.get_event_loop().time() - self._last_used
+            if self._active == 0 and idle >= self.idle_timeout:
+                async with self._get_lock():
+                    if self._active == 0 and self._browser is not None:
+                        log_info(f"浏览器空闲超过 {self.idle_timeout} 秒，自动关闭")
+                        await self._shutdown()
+                return
+
+    async def _shutdown(self):
+        pages, self._idle_pages = self._idle_pages, []
+        for page in pages:
+            await self._close_page(page)
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+        except Exception as e:
+            log_warning(f"关闭浏览器失败: {str(e)}")
+        try:
+            if self._playwright is not None:
+                await self._playwright.stop()
+        except Exception as e:
+            log_warning(f"停止Playwright失败: {str(e)}")
+        self._browser = None
+        self._playwright = None
+
+    async def close(self):
+        """
+        关闭浏览器，机器人退出时调用
+        """
+        if self._idle_task is not None and not self._idle_task.done():
+            self._idle_task.cancel()
+        if self._browser is not None:
+            async with self._get_lock():
+                await self._shutdown()
+                log_info("常驻浏览器已关闭")
+
+# 全局浏览器池，第一次渲染时创建
+_browser_pool = None
+
+def get_browser_pool():
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserPool()
+    return _browser_pool
+
+# 关闭浏览器池，机器人退出时调用
+async def close_browser_pool():
+    if _browser_pool is not None:
+        await _browser_pool.close()
+
+async def html_to_png(html_content):
+    """
+    使用Playwright将HTML渲染为PNG图片，页面来自常驻的浏览器池，全程不读写文件
+    :param html_content: HTML内容，引用的本地文件需要使用get_asset_url获取的地址
+    :return: PNG图片数据，失败时返回None
+    """
+    if not PLAYWRIGHT_AVAILABLE:
+        log_warning("缺少Playwright库，无法进行HTML转图片，请安装: pip install playwright")
+        return None
+    
+    pool = get_browser_pool()
+    # 浏览器在渲染过程中崩溃时，重新启动后再试一次
+    for attempt in range(2):
+        try:
+            page = await pool.acquire()
+        except Exception as e:
+            log_error_msg(f"启动浏览器失败: {str(e)}")
+            log_error_msg(traceback.format_exc())
+            return None
+        
+        image_data = None
+        try:
+            log_info("使用Playwright将HTML转换为图片...")
+            image_data = await _render_page(page, html_content)
+        except Exception as e:
+            log_error_msg(f"HTML转图片失败: {str(e)}")
+            if attempt == 0 and not pool.is_alive():
+                log_warning("浏览器在渲染过程中崩溃，重新启动后重试")
+                continue
+            log_error_msg(traceback.format_exc())
+            return None
+        finally:
+            # 渲染失败的页面不再复用
+            await pool.release(page, discard=image_data is None)
+        
+        if image_data is None and attempt == 0 and not pool.is_alive():
+            log_warning("浏览器在渲染过程中崩溃，重新启动后重试")
+            continue
+        if image_data:
+            log_info(f"HTML转图片成功，大小: {len(image_data) / 1024:.2f} KB")
+            return image_data
+        log_warning("HTML转图片失败，未能生成有效的图片")
+        return None
+    return None
+
+# 等待页面渲染就绪
+async def _wait_until_ready(page):
+    """
+    等待页面字体加载完成、布局稳定，超时后只再固定等待一小段时间
+    """
+    start = asyncio.get_event_loop().time()
+    try:
+        # 页面内的脚本自己也会在超时后返回，外层的超时用于字体等资源一直加载不完的情况
+        result = await asyncio.wait_for(
+            page.evaluate(READY_SCRIPT, {"timeout": RENDER_READY_TIMEOUT * 1000, "fontFamily": REPORT_FONT_FAMILY}),
+            timeout=RENDER_READY_TIMEOUT + 1
+        )
+    except asyncio.TimeoutError:
+        result = {"stable": False, "fontLoaded": True}
     except Exception as e:
-        log_error_msg(f"HTML转图片失败: {str(e)}")
-        log_error_msg(traceback.format_exc())
-        return False
+        log_warning(f"等待页面渲染时出错: {str(e)}，尝试继续...")
+        return
+    
+    if not result["fontLoaded"]:
+        log_warning(f"字体 {REPORT_FONT_FAMILY} 加载失败，图片中的文字将使用备用字体")
+    
+    if result["stable"]:
+        log_debug(f"页面渲染就绪，耗时 {(asyncio.get_event_loop().time() - start) * 1000:.0f}ms")
+    else:
+        log_warning(f"页面 {RENDER_READY_TIMEOUT} 秒内未就绪，再等待 {RENDER_FALLBACK_WAIT} 秒后截图")
+        await page.wait_for_timeout(RENDER_FALLBACK_WAIT * 1000)
+
+# 在页面中加载HTML并截图
+async def _render_page(page, html_content):
+    """
+    :return: PNG图片数据，失败时返回None
+    """
+    # 直接设置页面内容，不需要先写入文件
+    try:
+        await page.set_content(html_content, wait_until="load", timeout=30000)
+    except Exception as e:
+        log_error_msg(f"加载HTML内容失败: {str(e)}")
+        return None
+    
+    # 等待字体加载完成、布局稳定
+    await _wait_until_ready(page)
+    
+    # 只截取报告容器部分，去掉周围的白边
+    try:
+        container = await page.query_selector('.bento-container')
+        if container:
+            image_data = await container.screenshot(type="png")
+            log_info("成功截取Bento Grid容器部分")
+            return image_data
+        # 如果找不到容器，则截取整个页面
+        log_warning("未找到Bento容器，将尝试截取整个页面")
+    except Exception as e:
+        log_warning(f"截取容器时出错: {str(e)}，尝试截取整个页面...")
+    
+    # 如果容器截图失败，尝试截取整个页面
+    try:
+        image_data = await page.screenshot(type="png", full_page=True)
+        log_info("成功截取整个页面")
+        return image_data
+    except Exception as e:
+        log_error_msg(f"截取整个页面失败: {str(e)}")
+        return None
+
+# Playwright依赖是否已经检查过，每个进程只需要检查一次
+_playwright_ready = False
+_playwright_init_lock = None
 
 async def init_playwright():
-    """初始化Playwright"""
+    """初始化Playwright，并发调用时只检查一次依赖"""
+    global _playwright_ready, _playwright_init_lock
     if not PLAYWRIGHT_AVAILABLE:
         log_warning("Playwright未安装，请运行: pip install playwright")
         return False
-    
-    try:
-        # 不再尝试获取版本号，直接安装依赖
-        log_info("初始化Playwright并检查依赖...")
-        await install_playwright_deps()
+    if _playwright_ready:
         return True
-    except Exception as e:
-        log_error_msg(f"初始化Playwright失败: {str(e)}")
-        return False
+    
+    if _playwright_init_lock is None:
+        _playwright_init_lock = asyncio.Lock()
+    async with _playwright_init_lock:
+        if _playwright_ready:
+            return True
+        try:
+            # 不再尝试获取版本号，直接安装依赖
+            log_info("初始化Playwright并检查依赖...")
+            await install_playwright_deps()
+            _playwright_ready = True
+            return True
+        except Exception as e:
+            log_error_msg(f"初始化Playwright失败: {str(e)}")
+            return False
 
 async def get_font_path():
     """获取字体路径"""
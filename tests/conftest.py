@@ -0,0 +1,73 @@
+import os
+import sys
+import types
+import logging
+import importlib.util
+
+import pytest
+
+# 插件目录本身就是一个包，__init__.py会注册HoshinoBot的命令和定时任务
+# 测试时只注册包路径，不执行__init__.py，各模块通过dailySum.xxx导入
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = 'dailySum'
+
+if PACKAGE_NAME not in sys.modules:
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules[PACKAGE_NAME] = package
+
+# 测试环境通常没有安装HoshinoBot，提供插件用到的最小接口，使依赖日志器和定时器的模块可以导入
+def _stub_package(modules):
+    """modules为{模块名: 属性}，第一个为顶层包，已安装时不做替换"""
+    top = next(iter(modules))
+    if top in sys.modules or importlib.util.find_spec(top) is not None:
+        return
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+
+class _StubScheduler:
+    def scheduled_job(self, *args, **kwargs):
+        return lambda func: func
+
+    def remove_job(self, *args, **kwargs):
+        pass
+
+class _StubPriv:
+    ADMIN = 1
+
+    def check_priv(self, ev, required):
+        return True
+
+class _StubMessageSegment:
+    @staticmethod
+    def image(file):
+        return file
+
+def _stub_get_bot():
+    raise RuntimeError('测试环境没有机器人实例')
+
+_stub_package({'hoshino': {'logger': logging.getLogger('hoshino'), 'priv': _StubPriv(), 'get_bot': _stub_get_bot}})
+_stub_package({'nonebot': {'scheduler': _StubScheduler()}, 'nonebot.message': {'MessageSegment': _StubMessageSegment}})
+_stub_package({'apscheduler': {}, 'apscheduler.triggers': {}, 'apscheduler.triggers.cron': {'CronTrigger': object}})
+
+# 生成一行群聊消息日志
+def make_log_line(log_time, group_id, sender_qq, content):
+    return f"[{log_time} nonebot] INFO: Self: 10000, Message 1 from {sender_qq}@[群:{group_id}]: '{content}'"
+
+@pytest.fixture
+def crlf_log(tmp_path):
+    """Windows下FileHandler写出的CRLF换行日志，包含3条群聊消息"""
+    lines = [
+        make_log_line('2025-07-09 10:00:00,001', '100', '111', '早上好'),
+        '[2025-07-09 10:00:01,002 nonebot] INFO: 其他日志',
+        make_log_line('2025-07-09 10:01:00,003', '100', '222', '午饭吃什么'),
+        make_log_line('2025-07-09 10:02:00,004', '200', '333', 'hello'),
+    ]
+    path = tmp_path / 'run.log'
+    path.write_bytes(('\r\n'.join(lines) + '\r\n').encode('utf-8'))
+    return str(path)
@@ -0,0 +1,131 @@
+import json
+import asyncio
+import importlib
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+ai_backend = importlib.import_module('dailySum.ai_backend')
+rate_limiter = importlib.import_module('dailySum.rate_limiter')
+
+PROMPT = "群聊：【100】\n\n聊天记录：\n[10:00] 111: 早上好\n"
+
+@pytest.fixture(autouse=True)
+def fresh_limiter(monkeypatch):
+    # 限流器中的Condition绑定在创建它的事件循环上，每个测试使用新的限流器
+    monkeypatch.setattr(rate_limiter, '_ai_limiter', None)
+
+# 流式输出的SSE响应
+def sse_response(text):
+    chunk = {"choices": [{"delta": {"content": text}, "finish_reason": "stop"}]}
+    body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+    return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+def make_client(handler, **kwargs):
+    return ai_backend.ChatCompletionClient('key', 'http://test/v1', transport=httpx.MockTransport(handler), **kwargs)
+
+def test_persistent_400_is_bounded():
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(400, text='{"error": "invalid parameter"}')
+
+    client = make_client(handler)
+    assert asyncio.run(client.generate(PROMPT, max_retries=3)) is None
+    assert len(requests) == 3
+
+def test_stream_options_only_when_enabled():
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return sse_response("摘要")
+
+    assert asyncio.run(make_client(handler).generate(PROMPT, stream=True)) == "摘要"
+    assert asyncio.run(make_client(handler, stream_usage=True).generate(PROMPT, stream=True)) == "摘要"
+    assert "stream_options" not in requests[0]
+    assert requests[1]["stream_options"] == {"include_usage": True}
+
+def test_stream_options_rejected_is_disabled():
+    requests = []
+
+    def handler(request):
+        payload = json.loads(request.content)
+        requests.append(payload)
+        if "stream_options" in payload:
+            return httpx.Response(400, text='{"error": "Unrecognized request argument supplied: stream_options"}')
+        return sse_response("摘要")
+
+    client = make_client(handler, stream_usage=True)
+    assert asyncio.run(client.generate(PROMPT, stream=True)) == "摘要"
+    assert not client.stream_usage
+    assert len(requests) == 2
+    # 之后的请求直接不带stream_options
+    assert asyncio.run(client.generate(PROMPT, stream=True)) == "摘要"
+    assert len(requests) == 3
+
+def send_mock_requests(transport, count):
+    async def run():
+        async with httpx.AsyncClient(transport=transport, base_url='http://mock/v1') as client:
+            for i in range(count):
+                await client.post('/chat/completions', json={'model': 'mock', 'messages': [{'role': 'user', 'content': f'群 {i}'}]})
+    asyncio.run(run())
+
+def test_mock_attempts_forgotten_after_success():
+    transport = ai_backend.MockChatTransport(latency=0, tokens_per_second=0, error_rate=0)
+    send_mock_requests(transport, 50)
+    assert transport.request_count == 50
+    assert not transport._attempts
+
+def test_mock_attempts_bounded(monkeypatch):
+    monkeypatch.setattr(ai_backend, 'MOCK_ATTEMPTS_MAX', 10)
+    transport = ai_backend.MockChatTransport(latency=0, tokens_per_second=0, error_rate=1)
+    send_mock_requests(transport, 50)
+    assert len(transport._attempts) == 10
+
+def test_requests_share_one_pooled_client():
+    client = make_client(lambda request: sse_response("摘要"))
+
+    async def run():
+        await client.generate(PROMPT, stream=True)
+        pooled = client._client
+        await client.generate(PROMPT, stream=True)
+        assert client._client is pooled
+        await client.aclose()
+        assert pooled.is_closed and client._client is None
+
+    asyncio.run(run())
+
+def sse_body(chunks, done=True):
+    body = ''.join(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks)
+    return body + ("data: [DONE]\n\n" if done else "")
+
+def test_stream_joins_chunks_and_records_usage():
+    chunks = [
+        {"choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]},
+        {"choices": [{"delta": {"content": "今日"}, "finish_reason": None}]},
+        {"choices": [{"delta": {"content": "热点"}, "finish_reason": "stop"}]},
+        {"choices": [], "usage": {"prompt_tokens": 30, "prompt_cache_hit_tokens": 20, "completion_tokens": 4, "total_tokens": 34}},
+    ]
+    # 冒号开头的保持连接注释需要跳过
+    body = ": keep-alive\n\n" + sse_body(chunks)
+    client = make_client(lambda request: httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"}))
+
+    assert asyncio.run(client.generate(PROMPT, stream=True)) == "今日热点"
+    metrics = client.last_metrics
+    assert metrics["ttft"] is not None and metrics["ttft"] <= metrics["elapsed"]
+    assert metrics["completion_tokens"] == 4
+    assert client.describe_cache().endswith("20/30 tokens (67%)")
+
+def test_interrupted_stream_is_retried(monkeypatch):
+    monkeypatch.setattr(rate_limiter.AdaptiveLimiter, 'backoff_delay', lambda self, attempt, retry_after=None: 0)
+    responses = [
+        sse_body([{"choices": [{"delta": {"content": "今日"}, "finish_reason": None}]}], done=False),
+        sse_body([{"choices": [{"delta": {"content": "完整摘要"}, "finish_reason": "stop"}]}]),
+    ]
+    client = make_client(lambda request: httpx.Response(200, text=responses.pop(0), headers={"Content-Type": "text/event-stream"}))
+
+    # 没有收到finish_reason的内容不完整，不能作为结果返回
+    assert asyncio.run(client.generate(PROMPT, stream=True)) == "完整摘要"
+    assert not responses
@@ -0,0 +1,48 @@
+import io
+import importlib
+
+import pytest
+from PIL import Image, ImageFont
+
+bento_renderer = importlib.import_module('dailySum.bento_renderer')
+dailysum = importlib.import_module('dailySum.dailysum')
+
+SUMMARY = (
+    "【今日热点话题】\n1. 新版本发布计划：讨论了 release-2025.07 的时间表，大家认为下周发布比较合适。\n2. 午饭吃什么\n"
+    "【重要消息】\n1. 周五晚上服务器维护\n"
+    "【金句】\n1. 早睡早起身体好\n"
+    "【今日总结】\n今天群里主要讨论了发布计划，气氛轻松。"
+)
+
+@pytest.fixture
+def font_path(monkeypatch):
+    # 测试环境不一定有中文字体，使用Pillow内置字体，只检查排版逻辑
+    monkeypatch.setattr(bento_renderer, 'get_font', lambda path, size: ImageFont.load_default(size=size))
+    monkeypatch.setattr(bento_renderer, '_glyph_widths', {})
+    monkeypatch.setattr(bento_renderer, '_glyph_masks', {})
+    return 'builtin-font'
+
+def test_wrap_text(font_path):
+    text = "今天群里讨论了 release-2025.07 的发布计划，大家都同意下周发布。" * 3
+    max_width = 200
+    lines = bento_renderer.wrap_text(text, font_path, 15, max_width)
+    assert len(lines) > 1
+    assert "".join(lines).replace(" ", "") == text.replace(" ", "")
+    widest_punctuation = max(bento_renderer.text_width(font_path, 15, char) for char in bento_renderer.NO_LINE_START)
+    for line in lines:
+        assert bento_renderer.text_width(font_path, 15, line) <= max_width + widest_punctuation
+        assert line[:1] not in bento_renderer.NO_LINE_START
+    # 英文单词不拆开
+    assert any("release-2025.07" in line for line in lines)
+
+def test_render_bento_report(font_path):
+    sections = dailysum.parse_content_sections(dailysum.preprocess_content(SUMMARY))
+    image_data = bento_renderer.render_bento_report("2025-07-09 群聊日报", sections, "2025-07-09", font_path)
+    image = Image.open(io.BytesIO(image_data))
+    assert image.format == 'PNG'
+    assert image.width == bento_renderer.CANVAS_WIDTH
+
+    # 内容更多时图片更高
+    longer = dailysum.parse_content_sections(dailysum.preprocess_content(SUMMARY + "今天还讨论了很多别的话题。" * 50))
+    taller = Image.open(io.BytesIO(bento_renderer.render_bento_report("2025-07-09 群聊日报", longer, "2025-07-09", font_path)))
+    assert taller.height > image.height
@@ -0,0 +1,173 @@
+import asyncio
+import importlib
+
+dailysum = importlib.import_module('dailySum.dailysum')
+ai_backend = importlib.import_module('dailySum.ai_backend')
+rate_limiter = importlib.import_module('dailySum.rate_limiter')
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_group_msg(self, group_id, message):
+        self.sent.append(group_id)
+
+def test_summaries_not_capped_by_task_semaphore(monkeypatch):
+    groups = {str(100 + i): ['消息'] for i in range(dailysum.MAX_CONCURRENT_TASKS * 2)}
+    running = []
+    peak = []
+
+    async def fake_split_log_files(*args, **kwargs):
+        return groups, '2025-07-09'
+
+    async def fake_generate_summary(group_id, date_str, messages):
+        running.append(group_id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(group_id)
+        return f"群 {group_id} 的摘要"
+
+    async def fake_render_report_images(jobs):
+        return {}
+
+    monkeypatch.setattr(dailysum, 'split_log_files', fake_split_log_files)
+    monkeypatch.setattr(dailysum, 'generate_summary', fake_generate_summary)
+    monkeypatch.setattr(dailysum, 'render_report_images', fake_render_report_images)
+    monkeypatch.setattr(dailysum, 'DAILY_SUM_GROUPS', [])
+    monkeypatch.setattr(dailysum, 'TASK_INTERVAL_SECONDS', 0)
+
+    bot = FakeBot()
+    asyncio.run(dailysum.execute_daily_summary(bot))
+    # AI请求的并发只由全局限流器控制，不受每次任务的信号量限制
+    assert max(peak) == len(groups)
+    assert sorted(bot.sent) == sorted(int(group_id) for group_id in groups)
+
+class FakeAIClient:
+    def __init__(self, fail_chunks=()):
+        self.fail_chunks = set(fail_chunks)
+        self.prompts = []
+
+    async def generate(self, prompt, system_prompt=None, **kwargs):
+        self.prompts.append((system_prompt, prompt))
+        if system_prompt == dailysum.MAP_SYSTEM_PROMPT:
+            index = len([1 for system, _ in self.prompts if system == dailysum.MAP_SYSTEM_PROMPT])
+            return None if index in self.fail_chunks else f"要点{index}"
+        return "合并后的日报"
+
+def make_chat_log(lines):
+    return "\n".join(f"[10:{i % 60:02d}] 111: 第{i}条消息" for i in range(lines))
+
+def test_group_chunks_respects_size():
+    items = [(f"line{i}", f"10:{i:02d}", f"10:{i:02d}") for i in range(10)]
+    chunks = dailysum.group_chunks(items, 20, "\n")
+    assert all(len(text) <= 20 for text, _, _ in chunks)
+    assert "\n".join(text for text, _, _ in chunks) == "\n".join(text for text, _, _ in items)
+    assert chunks[0][1] == "10:00" and chunks[-1][2] == "10:09"
+
+def test_map_reduce_summary(monkeypatch):
+    fake = FakeAIClient()
+    monkeypatch.setattr(dailysum, 'ai_client', fake)
+    monkeypatch.setattr(dailysum, 'MAP_CHUNK_SIZE', 200)
+
+    summary, complete = asyncio.run(dailysum.map_reduce_summary('100', make_chat_log(50)))
+    assert (summary, complete) == ("合并后的日报", True)
+    map_prompts = [prompt for system, prompt in fake.prompts if system == dailysum.MAP_SYSTEM_PROMPT]
+    assert len(map_prompts) > 1
+    # 合并请求包含每一段的要点和时间范围
+    reduce_prompt = fake.prompts[-1][1]
+    assert all(f"要点{i}" in reduce_prompt for i in range(1, len(map_prompts) + 1))
+    assert "【10:00-" in reduce_prompt
+
+def test_map_reduce_summary_reports_failed_chunks(monkeypatch):
+    monkeypatch.setattr(dailysum, 'ai_client', FakeAIClient(fail_chunks={2}))
+    monkeypatch.setattr(dailysum, 'MAP_CHUNK_SIZE', 200)
+
+    summary, complete = asyncio.run(dailysum.map_reduce_summary('100', make_chat_log(50)))
+    assert summary == "合并后的日报"
+    assert not complete
+
+def test_single_flight_shares_one_result():
+    calls = []
+
+    async def build():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def run():
+        results = await asyncio.gather(*(dailysum.single_flight(('100', '2025-07-09'), build) for _ in range(5)))
+        assert results == [1] * 5
+        assert not dailysum._inflight_reports
+        # 上一次完成后再次请求会重新生成
+        assert await dailysum.single_flight(('100', '2025-07-09'), build) == 2
+
+    asyncio.run(run())
+
+def test_single_flight_survives_cancelled_caller():
+    async def build():
+        await asyncio.sleep(0.02)
+        return '日报'
+
+    async def run():
+        first = asyncio.ensure_future(dailysum.single_flight('key', build))
+        second = asyncio.ensure_future(dailysum.single_flight('key', build))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == '日报'
+
+    asyncio.run(run())
+
+def test_prompts_share_a_fixed_prefix(monkeypatch):
+    fake = FakeAIClient()
+    monkeypatch.setattr(dailysum, 'ai_client', fake)
+    monkeypatch.setattr(dailysum, 'ENABLE_SUMMARY_CACHE', False)
+    monkeypatch.setattr(dailysum, 'AI_API_KEY', 'key')
+    messages = [{'time': '2025-07-09 10:00:00', 'qq': '111', 'content': '今天讨论发布计划'}]
+
+    for group_id in ('100', '200'):
+        assert asyncio.run(dailysum.generate_summary(group_id, '2025-07-09', messages)) == "合并后的日报"
+
+    # 不同群的请求只有系统消息之后的用户消息不同
+    (system_a, prompt_a), (system_b, prompt_b) = fake.prompts
+    assert system_a == system_b == dailysum.SUMMARY_SYSTEM_PROMPT
+    assert '【100】' in prompt_a and '【200】' in prompt_b
+    assert '100' not in system_a
+
+def test_mock_backend_reports_prefix_cache_hits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, '_ai_limiter', None)
+    transport = ai_backend.MockChatTransport(latency=0, tokens_per_second=0, error_rate=0)
+    client = ai_backend.ChatCompletionClient('key', 'http://mock/v1', transport=transport)
+
+    async def run():
+        for group_id in ('100', '200'):
+            prompt = dailysum.SUMMARY_USER_TEMPLATE.format(group_name=group_id, chat_log='[10:00] 111: 早上好')
+            assert await client.generate(prompt, system_prompt=dailysum.SUMMARY_SYSTEM_PROMPT, stream=False)
+        await client.aclose()
+
+    asyncio.run(run())
+    assert client.last_metrics['cache_hit_tokens'] > 0
+    assert client.cache_hit_tokens_total == client.last_metrics['cache_hit_tokens']
+
+def test_render_report_images_runs_jobs_concurrently(monkeypatch):
+    running = []
+    peak = []
+
+    async def fake_generate_image_summary(title, content, date_str):
+        running.append(title)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(title)
+        if content == '失败':
+            raise RuntimeError('渲染失败')
+        return f'{title}.png'.encode('utf-8')
+
+    monkeypatch.setattr(dailysum, 'generate_image_summary', fake_generate_image_summary)
+    monkeypatch.setattr(dailysum, 'RENDER_CONCURRENCY', 3)
+    jobs = {str(100 + i): (f'日报{i}', '失败' if i == 0 else '摘要', '2025-07-09') for i in range(6)}
+
+    images = asyncio.run(dailysum.render_report_images(jobs))
+    assert max(peak) == 3
+    # 单个群渲染出错不影响其他群
+    assert images['100'] is None
+    assert images['105'] == '日报5.png'.encode('utf-8')
+    assert list(images) == list(jobs)
@@ -0,0 +1,186 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+html_report = importlib.import_module('dailySum.test_html_report_2')
+
+class FakeRoute:
+    def __init__(self, url):
+        self.request = SimpleNamespace(url=url)
+        self.fulfilled = None
+
+    async def fulfill(self, **kwargs):
+        self.fulfilled = kwargs
+
+def test_serve_font_allows_cross_origin(tmp_path):
+    font_path = tmp_path / 'report font.ttf'
+    font_path.write_bytes(b'\x00\x01\x00\x00')
+    url = html_report.get_asset_url(str(font_path))
+    assert url.startswith(html_report.ASSET_BASE_URL)
+
+    # 页面中的地址经过URL编码
+    route = FakeRoute(url.replace(' ', '%20'))
+    asyncio.run(html_report._serve_asset(route))
+    assert route.fulfilled['status'] == 200
+    assert route.fulfilled['body'] == b'\x00\x01\x00\x00'
+    assert route.fulfilled['content_type'] == 'font/ttf'
+    assert route.fulfilled['headers']['Access-Control-Allow-Origin'] == '*'
+
+def test_serve_unknown_asset_is_404():
+    route = FakeRoute(html_report.ASSET_BASE_URL + 'assets/missing.ttf')
+    asyncio.run(html_report._serve_asset(route))
+    assert route.fulfilled['status'] == 404
+
+# 模拟Playwright的浏览器、上下文和页面
+class FakePage:
+    def __init__(self, context, ready=None):
+        self.context = context
+        self.closed = False
+        self.ready = ready or {'stable': True, 'fontLoaded': True}
+        self.content = None
+        self.routes = []
+
+    def on(self, event, handler):
+        pass
+
+    async def route(self, pattern, handler):
+        self.routes.append(pattern)
+
+    def is_closed(self):
+        return self.closed
+
+    async def evaluate(self, script, arg=None):
+        if arg is None:
+            return 1
+        return self.ready
+
+    async def set_content(self, html, wait_until=None, timeout=None):
+        self.content = html
+
+    async def query_selector(self, selector):
+        return self
+
+    async def screenshot(self, type=None, full_page=False):
+        return b'PNG' + self.content.encode('utf-8')
+
+    async def wait_for_timeout(self, ms):
+        pass
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    async def new_page(self):
+        self.page = FakePage(self)
+        return self.page
+
+    async def close(self):
+        self.closed = True
+        self.page.closed = True
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+        self.contexts = []
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_context(self):
+        self.contexts.append(FakeContext())
+        return self.contexts[-1]
+
+    async def close(self):
+        self.connected = False
+
+class FakePlaywright:
+    def __init__(self):
+        self.browsers = []
+        self.chromium = self
+
+    async def start(self):
+        return self
+
+    async def launch(self, **kwargs):
+        self.browsers.append(FakeBrowser())
+        return self.browsers[-1]
+
+    async def stop(self):
+        pass
+
+@pytest.fixture
+def fake_playwright(monkeypatch):
+    playwright = FakePlaywright()
+    monkeypatch.setattr(html_report, 'async_playwright', lambda: playwright, raising=False)
+    return playwright
+
+def test_browser_pool_reuses_pages(fake_playwright):
+    async def run():
+        pool = html_report.BrowserPool(size=2, idle_timeout=3600)
+        page = await pool.acquire()
+        assert page.routes == [html_report.ASSET_BASE_URL + '**']
+        await pool.release(page)
+        assert await pool.acquire() is page
+        # 出错的页面不再复用
+        await pool.release(page, discard=True)
+        assert page.context.closed
+        assert await pool.acquire() is not page
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(fake_playwright.browsers) == 1
+
+def test_browser_pool_restarts_crashed_browser(fake_playwright):
+    async def run():
+        pool = html_report.BrowserPool(size=2, idle_timeout=3600)
+        await pool.release(await pool.acquire())
+        fake_playwright.browsers[0].connected = False
+        await pool.release(await pool.acquire())
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(fake_playwright.browsers) == 2
+
+def test_browser_pool_limits_pages(fake_playwright):
+    async def run():
+        pool = html_report.BrowserPool(size=2, idle_timeout=3600)
+        pages = [await pool.acquire(), await pool.acquire()]
+        waiter = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await pool.release(pages[0])
+        assert await asyncio.wait_for(waiter, 1) is pages[0]
+        await pool.close()
+
+    asyncio.run(run())
+
+def test_ready_page_is_captured_without_fallback_wait():
+    waits = []
+    page = FakePage(FakeContext(), {'stable': True, 'fontLoaded': True})
+
+    async def wait_for_timeout(ms):
+        waits.append(ms)
+
+    page.wait_for_timeout = wait_for_timeout
+    assert asyncio.run(html_report._render_page(page, '<div class="bento-container">日报</div>')).startswith(b'PNG')
+    assert not waits
+
+def test_unstable_page_waits_before_capture():
+    waits = []
+    page = FakePage(FakeContext(), {'stable': False, 'fontLoaded': True})
+
+    async def wait_for_timeout(ms):
+        waits.append(ms)
+
+    page.wait_for_timeout = wait_for_timeout
+    assert asyncio.run(html_report._render_page(page, '<div>日报</div>'))
+    assert waits == [html_report.RENDER_FALLBACK_WAIT * 1000]
+
+def test_failed_font_is_reported(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(html_report, 'log_warning', warnings.append)
+    page = FakePage(FakeContext(), {'stable': True, 'fontLoaded': False})
+    assert asyncio.run(html_report._render_page(page, '<div>日报</div>'))
+    assert any(html_report.REPORT_FONT_FAMILY in warning for warning in warnings)
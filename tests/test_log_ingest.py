@@ -0,0 +1,89 @@
+import asyncio
+import importlib
+from datetime import datetime
+
+from conftest import make_log_line
+
+log_ingest = importlib.import_module('dailySum.log_ingest')
+
+def test_read_new_messages_crlf(crlf_log):
+    bucketed, cursor, stats = log_ingest.read_new_messages(crlf_log, None)
+    assert stats['matched'] == 3
+    assert sorted(bucketed) == [('100', '2025-07-09'), ('200', '2025-07-09')]
+    contents = [message.content for message in bucketed[('100', '2025-07-09')]]
+    assert contents == ['早上好', '午饭吃什么']
+    assert cursor['carry'] == ''
+
+def test_explode_log_file_skips_earlier_days(monkeypatch, tmp_path):
+    monkeypatch.setattr(log_ingest, 'INGEST_STATE_PATH', str(tmp_path / 'ingest_state.json'))
+    monkeypatch.setattr(log_ingest, 'PARSE_WORKERS', 1)
+    saved = []
+    monkeypatch.setattr(log_ingest, 'replace_smaller_groups', lambda bucketed: saved.append(sorted(bucketed)) or len(bucketed))
+    parsed_lines = []
+    parse_log_file = log_ingest.parse_log_file
+    def record_parse(*args, **kwargs):
+        group_messages, stats = parse_log_file(*args, **kwargs)
+        parsed_lines.append(stats['lines'])
+        return group_messages, stats
+    monkeypatch.setattr(log_ingest, 'parse_log_file', record_parse)
+
+    lines = []
+    for day in range(7, 11):
+        for minute in range(50):
+            lines.append(make_log_line(f'2025-07-{day:02d} 10:{minute:02d}:00,000', '100', '111', f'消息{minute}'))
+            lines.extend(['Traceback (most recent call last):', '  File "x.py", line 1'])
+    log_path = tmp_path / 'run_log_2025-07-10.log'
+    log_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    # 只解析7月9日及之后的内容
+    assert asyncio.run(log_ingest.explode_log_file(str(log_path), datetime(2025, 7, 9)))
+    assert saved == [[('100', '2025-07-09'), ('100', '2025-07-10')]]
+    # 二分查找跳过了之前两天，区间从7月8日最后一条消息之后的堆栈开始
+    assert parsed_lines == [len(lines) // 2 + 2]
+    assert log_ingest.is_day_complete('2025-07-09')
+    assert not log_ingest.is_day_complete('2025-07-08')
+
+    # 文件未变化时只补充解析更早的部分
+    assert asyncio.run(log_ingest.explode_log_file(str(log_path), datetime(2025, 7, 7)))
+    assert saved[1] == [('100', '2025-07-07'), ('100', '2025-07-08')]
+    assert parsed_lines[1] == len(lines) // 2 - 2
+    assert log_ingest.is_day_complete('2025-07-07') and log_ingest.is_day_complete('2025-07-08')
+    assert not asyncio.run(log_ingest.explode_log_file(str(log_path), datetime(2025, 7, 8)))
+
+def test_encoding_detected_once_per_file(crlf_log):
+    cache = {}
+    assert log_ingest._detect_encoding_with_cache(crlf_log, cache) == ('utf-8', True)
+    assert log_ingest._detect_encoding_with_cache(crlf_log, cache) == ('utf-8', False)
+
+def test_read_new_messages_resumes_from_cursor(tmp_path):
+    log_path = tmp_path / 'run.log'
+    first = make_log_line('2025-07-09 10:00:00,000', '100', '111', '早上好') + '\n'
+    second = make_log_line('2025-07-09 10:01:00,000', '100', '222', '午饭吃什么') + '\n'
+    # 第二行还没写完
+    log_path.write_bytes((first + second[:20]).encode('utf-8'))
+    bucketed, cursor, stats = log_ingest.read_new_messages(str(log_path), None)
+    assert stats['matched'] == 1
+    assert cursor['carry']
+
+    with open(log_path, 'ab') as f:
+        f.write(second[20:].encode('utf-8'))
+    bucketed, cursor, stats = log_ingest.read_new_messages(str(log_path), cursor)
+    assert stats['matched'] == 1 and stats['reset'] is None
+    assert [message.content for message in bucketed[('100', '2025-07-09')]] == ['午饭吃什么']
+    assert cursor['offset'] == len((first + second).encode('utf-8'))
+
+    # 没有新内容时不重复解析
+    bucketed, cursor, stats = log_ingest.read_new_messages(str(log_path), cursor)
+    assert not bucketed and stats['bytes'] == 0
+
+def test_read_new_messages_restarts_after_rotation(tmp_path):
+    log_path = tmp_path / 'run.log'
+    log_path.write_text(make_log_line('2025-07-09 10:00:00,000', '100', '111', '早上好') + '\n', encoding='utf-8')
+    _, cursor, _ = log_ingest.read_new_messages(str(log_path), None)
+
+    # 日志被轮转，新文件比游标位置短
+    log_path.unlink()
+    log_path.write_text(make_log_line('2025-07-10 09:00:00,000', '100', '111', '新的一天') + '\n', encoding='utf-8')
+    bucketed, cursor, stats = log_ingest.read_new_messages(str(log_path), cursor)
+    assert stats['reset']
+    assert sorted(bucketed) == [('100', '2025-07-10')]
@@ -0,0 +1,132 @@
+import importlib
+from datetime import datetime
+
+import os
+import re
+import time
+import random
+
+import pytest
+
+from conftest import make_log_line
+
+log_parser = importlib.import_module('dailySum.log_parser')
+
+def test_iter_marked_lines_strips_cr():
+    data = b"a @[\xe7\xbe\xa4:1] x\r\nb\r\nc @[\xe7\xbe\xa4:2] y\r\n"
+    marker = log_parser.get_group_marker('utf-8')
+    assert list(log_parser.iter_marked_lines(data, marker)) == [
+        b"a @[\xe7\xbe\xa4:1] x",
+        b"c @[\xe7\xbe\xa4:2] y",
+    ]
+
+def test_parse_log_file_crlf(crlf_log):
+    group_messages, stats = log_parser.parse_log_file(crlf_log)
+    assert stats['matched'] == 3
+    assert len(group_messages['100']) == 2
+    assert len(group_messages['200']) == 1
+
+def test_parse_log_file_window_with_long_traceback(tmp_path):
+    lines = []
+    # 窗口前后各有一天的消息，窗口中间有一段很长的没有时间戳的堆栈
+    for i in range(60):
+        lines.append(make_log_line(f'2025-07-08 12:{i:02d}:00,000', '100', '111', f'前一天{i}'))
+    for i in range(60):
+        lines.append(make_log_line(f'2025-07-09 10:{i:02d}:00,000', '100', '111', f'上午{i}'))
+    lines.append('[2025-07-09 11:00:00,000 nonebot] ERROR: Traceback (most recent call last):')
+    lines.extend(f'  File "module{i}.py", line {i}, in func' for i in range(200))
+    for i in range(60):
+        lines.append(make_log_line(f'2025-07-09 12:{i:02d}:00,000', '100', '222', f'下午{i}'))
+    for i in range(60):
+        lines.append(make_log_line(f'2025-07-10 12:{i:02d}:00,000', '100', '111', f'后一天{i}'))
+    path = tmp_path / 'run.log'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    start_time = datetime(2025, 7, 9, 4)
+    end_time = datetime(2025, 7, 10, 3, 59, 59)
+    group_messages, _ = log_parser.parse_log_file(str(path), start_time, end_time)
+    assert len(group_messages['100']) == 120
+
+def test_parse_log_time_formats():
+    assert log_parser.parse_log_time('2025-06-30 16:51:58,015') == datetime(2025, 6, 30, 16, 51, 58, 15000)
+    assert log_parser.parse_log_time('2025-06-30 16:51:58') == datetime(2025, 6, 30, 16, 51, 58)
+    assert log_parser.parse_log_time('not a time') is None
+
+PARENT_PID = os.getpid()
+parse_log_range = log_parser.parse_log_range
+
+# 模拟子进程卡住，当前进程中的解析不受影响
+def stuck_in_child(*args):
+    if os.getpid() != PARENT_PID:
+        time.sleep(60)
+    return parse_log_range(*args)
+
+@pytest.mark.skipif(log_parser._get_pool_context() is None, reason='需要fork')
+def test_parse_log_file_parallel_timeout_falls_back(monkeypatch, crlf_log):
+    monkeypatch.setattr(log_parser, 'parse_log_range', stuck_in_child)
+    started = time.monotonic()
+    group_messages, stats = log_parser.parse_log_file(crlf_log, workers=2, timeout=1)
+    assert time.monotonic() - started < 10
+    assert stats['parallel_timeout']
+    assert stats['matched'] == 3
+    assert len(group_messages['100']) == 2
+
+@pytest.mark.skipif(log_parser._get_pool_context() is None, reason='需要fork')
+def test_parse_log_file_parallel_matches_serial(tmp_path):
+    lines = []
+    for i in range(3000):
+        lines.append(make_log_line(f'2025-07-09 {10 + i // 600:02d}:{i // 10 % 60:02d}:{i % 10:02d},000', str(100 + i % 3), '111', f'消息{i}'))
+        if i % 100 == 0:
+            lines.append('Traceback (most recent call last):')
+    log_path = tmp_path / 'run.log'
+    log_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    serial, serial_stats = log_parser.parse_log_file(str(log_path))
+    parallel, parallel_stats = log_parser.parse_log_file(str(log_path), workers=4)
+    assert parallel_stats == serial_stats
+    assert sorted(parallel) == ['100', '101', '102']
+    assert all(parallel[group_id] == serial[group_id] for group_id in serial)
+
+    start, end = datetime(2025, 7, 9, 11), datetime(2025, 7, 9, 11, 59, 59)
+    window, _ = log_parser.parse_log_file(str(log_path), start, end, workers=4)
+    assert sum(len(batch) for batch in window.values()) == 600
+
+def test_detect_encoding():
+    line = make_log_line('2025-07-09 10:00:00,000', '100', '111', '早上好') + '\n'
+    assert log_parser.detect_encoding(line.encode('utf-8')) == 'utf-8'
+    assert log_parser.detect_encoding(line.encode('gbk')) == 'gb18030'
+    # 样本末尾被截断的多字节字符不影响判断
+    assert log_parser.detect_encoding((line * 2).encode('utf-8')[:-3]) == 'utf-8'
+
+def test_sniff_file_encoding_uses_tail_after_ascii_head(tmp_path):
+    head = '[2025-07-09 09:00:00,000 nonebot] INFO: startup\n' * 2000
+    tail = make_log_line('2025-07-09 10:00:00,000', '100', '111', '早上好') + '\n'
+    path = tmp_path / 'run.log'
+    path.write_bytes(head.encode('ascii') + tail.encode('gbk'))
+    assert len(head) > log_parser.ENCODING_SAMPLE_SIZE
+    with open(path, 'rb') as f:
+        assert log_parser.sniff_file_encoding(f) == 'gb18030'
+
+# 逐个re.sub的旧实现，作为单次扫描实现的对照
+def simplify_cq_code_reference(content):
+    for cq_type, placeholder in log_parser.CQ_PLACEHOLDERS.items():
+        content = re.sub(r'\[CQ:' + cq_type + r'[^\]]+\]', placeholder, content)
+    content = re.sub(r'\[CQ:[^\]]+\]', '[特殊消息]', content)
+    content = re.sub(r'https?://\S{30,}', '[链接]', content)
+    return re.sub(r'\n{3,}', '\n\n', content)
+
+def test_simplify_cq_code_examples():
+    assert log_parser.simplify_cq_code('普通消息') == '普通消息'
+    assert log_parser.simplify_cq_code('[CQ:image,file=abc.jpg]好看') == '[图片]好看'
+    assert log_parser.simplify_cq_code('[CQ:at,qq=123] 在吗') == '[有人@] 在吗'
+    assert log_parser.simplify_cq_code('[CQ:poke,qq=1]') == '[特殊消息]'
+    assert log_parser.simplify_cq_code('看 https://example.com/' + 'a' * 40 + ' 这个') == '看 [链接] 这个'
+    assert log_parser.simplify_cq_code('a\n\n\n\nb') == 'a\n\nb'
+
+def test_simplify_cq_code_matches_reference():
+    rng = random.Random(0)
+    tokens = ['[CQ:image,file=1.jpg]', '[CQ:at,qq=1]', '[CQ:face,id=2]', '[CQ:poke]', '[CQ:]', '[CQ:image]',
+              'https://', 'http://x.cn/', 'a' * 12, 'b', ' ', '\n', ']', '[', '链接']
+    for _ in range(2000):
+        content = ''.join(rng.choice(tokens) for _ in range(rng.randint(1, 12)))
+        assert log_parser.simplify_cq_code(content) == simplify_cq_code_reference(content), content
@@ -0,0 +1,41 @@
+import importlib
+from datetime import datetime
+
+message_archive = importlib.import_module('dailySum.message_archive')
+
+def make_messages(day, hours, qq='111'):
+    return [{'time': f'2025-07-{day:02d} {hour:02d}:00:00', 'qq': qq, 'content': f'{day}日{hour}点'} for hour in hours]
+
+def test_query_window_across_days(tmp_path):
+    archive = message_archive.MessageArchive(str(tmp_path / 'messages.db'))
+    try:
+        assert archive.is_empty()
+        archive.insert_messages({
+            ('100', '2025-07-09'): make_messages(9, [3, 10, 23]),
+            ('100', '2025-07-10'): make_messages(10, [2, 5]),
+            ('200', '2025-07-10'): make_messages(10, [1]),
+        })
+        # 日报的统计范围是前一天4点到当天4点
+        window = archive.query_window(datetime(2025, 7, 9, 4), datetime(2025, 7, 10, 3, 59, 59))
+        assert sorted(window) == ['100', '200']
+        assert [message.content for message in window['100']] == ['9日10点', '9日23点', '10日2点']
+
+        only = archive.query_window(datetime(2025, 7, 9, 4), datetime(2025, 7, 10, 3, 59, 59), target_group='200')
+        assert list(only) == ['200']
+    finally:
+        archive.close()
+
+def test_replace_days_only_touches_that_day(tmp_path):
+    archive = message_archive.MessageArchive(str(tmp_path / 'messages.db'))
+    try:
+        archive.insert_messages({
+            ('100', '2025-07-09'): make_messages(9, [10, 11]),
+            ('100', '2025-07-10'): make_messages(10, [10]),
+        })
+        archive.replace_days({('100', '2025-07-09'): make_messages(9, [10, 11, 12], qq='222')})
+        window = archive.query_window(datetime(2025, 7, 9), datetime(2025, 7, 10, 23, 59, 59))
+        assert [(message.qq, message.content) for message in window['100']] == [
+            ('222', '9日10点'), ('222', '9日11点'), ('222', '9日12点'), ('111', '10日10点'),
+        ]
+    finally:
+        archive.close()
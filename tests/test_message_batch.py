@@ -0,0 +1,39 @@
+import importlib
+
+message_batch = importlib.import_module('dailySum.message_batch')
+MessageBatch = message_batch.MessageBatch
+
+def make_batch(rows):
+    return MessageBatch.from_messages([{'time': time, 'qq': qq, 'content': content} for time, qq, content in rows])
+
+def test_round_trip_and_dict_access():
+    rows = [('2025-07-09 10:00:00', '111', '早上好'), ('2025-07-09 10:01:00', '222', '午饭吃什么')]
+    batch = make_batch(rows)
+    assert len(batch) == 2
+    assert batch[0]['content'] == '早上好'
+    assert batch[-1].get('qq') == '222'
+    assert batch.to_dicts() == [{'time': time, 'qq': qq, 'content': content} for time, qq, content in rows]
+    assert batch == batch.to_dicts()
+    # 相同的QQ号共用一个字符串
+    other = make_batch([('2025-07-09 11:00:00', '1' * 3, '晚上好')])
+    assert other.qq[0] is batch.qq[0]
+
+def test_merge_keeps_time_order_and_ties():
+    first = make_batch([('2025-07-09 10:00:00', '111', 'a'), ('2025-07-09 10:02:00', '111', 'c')])
+    second = make_batch([('2025-07-09 10:01:00', '222', 'b'), ('2025-07-09 10:02:00', '222', 'd')])
+    merged = MessageBatch.merge([first, MessageBatch(), second])
+    assert merged.content == ['a', 'b', 'c', 'd']
+
+def test_split_by_day_and_filter_window():
+    batch = make_batch([
+        ('2025-07-09 23:59:59', '111', 'a'),
+        ('2025-07-10 00:00:00', '111', 'b'),
+        ('2025-07-10 04:00:00', '111', 'c'),
+    ])
+    days = batch.split_by_day()
+    assert {day: day_batch.content for day, day_batch in days.items()} == {'2025-07-09': ['a'], '2025-07-10': ['b', 'c']}
+
+    start_ts = message_batch.time_str_to_ts('2025-07-10 00:00:00')
+    end_ts = message_batch.time_str_to_ts('2025-07-10 03:59:59')
+    assert batch.filter_window(start_ts, end_ts).content == ['b']
+    assert message_batch.ts_to_hm(start_ts) == '00:00'
@@ -0,0 +1,52 @@
+import asyncio
+import importlib
+
+message_capture = importlib.import_module('dailySum.message_capture')
+
+def test_flush_keeps_messages_when_write_fails(monkeypatch):
+    written = []
+    failures = [RuntimeError('磁盘已满')]
+
+    def merge_group_messages(bucketed, replace):
+        if failures:
+            raise failures.pop()
+        written.append(bucketed)
+        return sum(len(batch) for batch in bucketed.values())
+
+    monkeypatch.setattr(message_capture, 'merge_group_messages', merge_group_messages)
+
+    async def run():
+        writer = message_capture.MessageCaptureWriter(batch_size=100, flush_interval=60)
+        writer.add('100', 1760000000, '111', '第一条')
+        assert await writer.flush() == 0
+        writer.add('100', 1760000001, '222', '第二条')
+        assert await writer.flush() == 2
+
+    asyncio.run(run())
+    (bucketed,) = written
+    (batch,) = bucketed.values()
+    assert list(batch.content) == ['第一条', '第二条']
+
+def test_capture_batches_by_group_and_day(monkeypatch):
+    written = []
+    monkeypatch.setattr(message_capture, 'merge_group_messages',
+                        lambda bucketed, replace: written.append((bucketed, replace)) or sum(map(len, bucketed.values())))
+
+    async def run():
+        writer = message_capture.MessageCaptureWriter(batch_size=3, flush_interval=60)
+        monkeypatch.setattr(message_capture, 'capture_writer', writer)
+        message_capture.capture_group_message({'time': 1760000000, 'group_id': 100, 'user_id': 111,
+                                               'raw_message': '[CQ:image,file=a.jpg]'})
+        message_capture.capture_group_message({'time': 1760000001, 'group_id': 200, 'user_id': 222, 'message': '你好'})
+        assert not written
+        # 攒够一批后自动写入
+        message_capture.capture_group_message({'time': 1760000002, 'group_id': 100, 'user_id': 333, 'raw_message': '好看'})
+        await asyncio.sleep(0.05)
+        assert await message_capture.flush_captured_messages() == 0
+
+    asyncio.run(run())
+    ((bucketed, replace),) = written
+    assert not replace
+    date_str = message_capture.ts_to_time_str(1760000000)[:10]
+    assert bucketed[('100', date_str)].content == ['[图片]', '好看']
+    assert bucketed[('200', date_str)].qq == ['222']
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import random
+import subprocess
+import importlib
+
+message_dedup = importlib.import_module('dailySum.message_dedup')
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 生成带近似重复的聊天记录，每条消息与之前的某条消息只差一个字
+def make_rows():
+    rng = random.Random(42)
+    alphabet = '的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年'
+    rows = []
+    texts = []
+    for i in range(300):
+        if texts and rng.random() < 0.7:
+            chars = list(rng.choice(texts))
+            chars[rng.randrange(len(chars))] = rng.choice(alphabet)
+            text = ''.join(chars)
+        else:
+            text = ''.join(rng.choice(alphabet) for _ in range(25))
+        texts.append(text)
+        rows.append((1760000000 + i * 5, str(1000 + i % 7), text))
+    return rows
+
+def test_collapse_repeats_merges_near_duplicates():
+    rows = [
+        (1760000000, '1', '今天晚上一起打游戏吗'),
+        (1760000001, '2', '今天晚上一起打游戏吗！'),
+        (1760000002, '3', '今天晚上一起打游戏吗'),
+        (1760000003, '4', '完全不同的一句话内容'),
+    ]
+    assert message_dedup.collapse_repeats(rows) == [
+        (1760000000, '1', '今天晚上一起打游戏吗 (×3)'),
+        (1760000003, '4', '完全不同的一句话内容'),
+    ]
+
+def test_collapse_repeats_independent_of_hash_seed():
+    script = (
+        "import json, conftest, importlib, test_message_dedup as t\n"
+        "print(json.dumps(importlib.import_module('dailySum.message_dedup').collapse_repeats(t.make_rows()), ensure_ascii=False))\n"
+    )
+    outputs = set()
+    for seed in ('0', '1', '12345'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=TESTS_DIR, env=env,
+            capture_output=True, text=True, check=True
+        )
+        outputs.add(result.stdout)
+    expected = json.dumps(message_dedup.collapse_repeats(make_rows()), ensure_ascii=False) + '\n'
+    assert outputs == {expected}
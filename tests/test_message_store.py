@@ -0,0 +1,74 @@
+import os
+import json
+import importlib
+
+import pytest
+
+message_store = importlib.import_module('dailySum.message_store')
+
+class FailingArchive:
+    def __init__(self, failures):
+        self.failures = failures
+        self.inserted = []
+
+    def insert_messages(self, bucketed_messages):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.inserted.append(bucketed_messages)
+
+@pytest.fixture
+def store_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(message_store, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(message_store, 'STORE_DIR', str(tmp_path / 'messages'))
+    return tmp_path
+
+def test_merge_retry_after_archive_failure_does_not_duplicate(monkeypatch, store_dir):
+    archive = FailingArchive([RuntimeError('database is locked')])
+    monkeypatch.setattr(message_store, 'get_archive', lambda: archive)
+    bucketed = {('100', '2025-07-09'): [
+        {'time': '2025-07-09 10:00:00', 'qq': '111', 'content': '早上好'},
+        {'time': '2025-07-09 10:01:00', 'qq': '222', 'content': '午饭吃什么'},
+    ]}
+
+    with pytest.raises(RuntimeError):
+        message_store.merge_group_messages(bucketed)
+    # 调用方把整批消息放回后重试
+    assert message_store.merge_group_messages(bucketed) == 2
+    assert message_store.count_group_messages('100', '2025-07-09') == 2
+    assert len(archive.inserted) == 1
+
+def make_messages(start_minute, count):
+    return [
+        {'time': f'2025-07-09 10:{minute:02d}:00', 'qq': '111', 'content': f'消息{minute}'}
+        for minute in range(start_minute, start_minute + count)
+    ]
+
+def test_append_rolls_over_segments(monkeypatch, store_dir):
+    monkeypatch.setattr(message_store, 'get_archive', lambda: None)
+    monkeypatch.setattr(message_store, 'STORE_SEGMENT_MAX_BYTES', 100)
+    for start in range(0, 30, 10):
+        message_store.append_group_messages('100', '2025-07-09', make_messages(start, 10))
+
+    assert len(message_store._list_segments('100', '2025-07-09')) == 3
+    messages = message_store.load_group_messages('100', '2025-07-09')
+    assert [message.content for message in messages] == [f'消息{minute}' for minute in range(30)]
+    assert message_store.count_group_messages('100', '2025-07-09') == 30
+
+def test_append_migrates_legacy_file(monkeypatch, store_dir):
+    monkeypatch.setattr(message_store, 'get_archive', lambda: None)
+    legacy_path = message_store.legacy_log_path('100', '2025-07-09')
+    with open(legacy_path, 'w', encoding='utf-8') as f:
+        json.dump(make_messages(0, 2), f, ensure_ascii=False)
+    assert message_store.list_groups('2025-07-09') == ['100']
+
+    message_store.append_group_messages('100', '2025-07-09', make_messages(2, 1))
+    assert not os.path.exists(legacy_path)
+    assert message_store.count_group_messages('100', '2025-07-09') == 3
+
+def test_partial_last_line_is_skipped(monkeypatch, store_dir):
+    monkeypatch.setattr(message_store, 'get_archive', lambda: None)
+    message_store.append_group_messages('100', '2025-07-09', make_messages(0, 2))
+    # 模拟另一个进程正在追加一行
+    with open(message_store._list_segments('100', '2025-07-09')[-1], 'a', encoding='utf-8') as f:
+        f.write('[1752026520,"222","写了一')
+    assert len(list(message_store.iter_group_messages('100', '2025-07-09'))) == 2
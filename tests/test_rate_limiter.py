@@ -0,0 +1,62 @@
+import time
+import asyncio
+import importlib
+from email.utils import formatdate
+
+rate_limiter = importlib.import_module('dailySum.rate_limiter')
+
+def test_parse_retry_after():
+    assert rate_limiter.parse_retry_after(None) is None
+    assert rate_limiter.parse_retry_after('3') == 3.0
+    assert rate_limiter.parse_retry_after('-1') == 0.0
+    assert rate_limiter.parse_retry_after('soon') is None
+    assert 0 < rate_limiter.parse_retry_after(formatdate(usegmt=True, timeval=time.time() + 60)) <= 60
+
+def test_token_bucket_wait_time():
+    bucket = rate_limiter.TokenBucket(60)
+    assert bucket.wait_time(60) == 0
+    bucket.take(61)
+    # 每秒补充1个令牌，欠下的1个也要补上
+    assert 1.9 < bucket.wait_time(1) <= 2
+    assert rate_limiter.TokenBucket(0).wait_time(10 ** 6) == 0
+
+def test_limit_grows_on_success_and_halves_on_overload(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'AI_REQUESTS_PER_MINUTE', 0)
+    monkeypatch.setattr(rate_limiter, 'AI_TOKENS_PER_MINUTE', 0)
+    monkeypatch.setattr(rate_limiter, 'AI_INITIAL_CONCURRENCY', 4)
+    monkeypatch.setattr(rate_limiter, 'AI_MAX_CONCURRENCY', 8)
+
+    async def run():
+        limiter = rate_limiter.AdaptiveLimiter()
+        for _ in range(100):
+            await limiter.acquire(10)
+            await limiter.release('ok')
+        assert limiter.limit == 8
+
+        await limiter.acquire(10)
+        await limiter.release('overload')
+        assert limiter.limit == 4
+        # 同一批请求一起失败时只减半一次
+        await limiter.acquire(10)
+        await limiter.release('overload')
+        assert limiter.limit == 4
+
+    asyncio.run(run())
+
+def test_acquire_waits_for_free_slot(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'AI_REQUESTS_PER_MINUTE', 0)
+    monkeypatch.setattr(rate_limiter, 'AI_TOKENS_PER_MINUTE', 0)
+    monkeypatch.setattr(rate_limiter, 'AI_INITIAL_CONCURRENCY', 2)
+
+    async def run():
+        limiter = rate_limiter.AdaptiveLimiter()
+        await limiter.acquire(1)
+        await limiter.acquire(1)
+        waiter = asyncio.ensure_future(limiter.acquire(1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await limiter.release(None)
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 2
+
+    asyncio.run(run())
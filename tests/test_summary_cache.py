@@ -0,0 +1,33 @@
+import os
+import importlib
+
+summary_cache = importlib.import_module('dailySum.summary_cache')
+
+def test_cache_key_depends_on_group():
+    args = ('聊天记录', '模板', 'deepseek::deepseek-chat', 1.0)
+    assert summary_cache.make_cache_key('100', *args) == summary_cache.make_cache_key('100', *args)
+    assert summary_cache.make_cache_key('100', *args) != summary_cache.make_cache_key('200', *args)
+
+def test_cache_round_trip_and_pruning(monkeypatch, tmp_path):
+    monkeypatch.setattr(summary_cache, 'SUMMARY_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(summary_cache, 'SUMMARY_CACHE_MAX_ENTRIES', 2)
+    keys = [summary_cache.make_cache_key('100', f'聊天记录{i}', '模板', 'model', 1.0) for i in range(3)]
+    assert summary_cache.get_cached_summary(keys[0]) is None
+
+    for i, key in enumerate(keys):
+        summary_cache.save_cached_summary(key, f'摘要{i}', '100')
+        # 最近使用时间按文件修改时间计算
+        os.utime(summary_cache._cache_path(key), (1000 + i, 1000 + i))
+    monkeypatch.setattr(summary_cache, 'SUMMARY_CACHE_TTL', 10 ** 10)
+    summary_cache.prune_summary_cache()
+
+    assert summary_cache.get_cached_summary(keys[0]) is None
+    assert summary_cache.get_cached_summary(keys[2]) == '摘要2'
+
+def test_expired_cache_is_ignored(monkeypatch, tmp_path):
+    monkeypatch.setattr(summary_cache, 'SUMMARY_CACHE_DIR', str(tmp_path))
+    key = summary_cache.make_cache_key('100', '聊天记录', '模板', 'model', 1.0)
+    summary_cache.save_cached_summary(key, '摘要', '100')
+    os.utime(summary_cache._cache_path(key), (0, 0))
+    assert summary_cache.get_cached_summary(key) is None
+    assert not os.path.exists(summary_cache._cache_path(key))
@@ -0,0 +1,38 @@
+import importlib
+
+token_budget = importlib.import_module('dailySum.token_budget')
+
+def test_estimate_tokens():
+    assert token_budget.estimate_tokens('') == 0
+    assert token_budget.estimate_tokens('a' * 10) == 3
+    assert token_budget.estimate_tokens('中' * 10) == 6
+    assert token_budget.estimate_tokens('ab中文') == 2
+
+def test_compact_chat_log_within_budget_is_unchanged():
+    chat_log = "[10:00] 111: 早上好\n[10:01] 222: [表情]"
+    assert token_budget.compact_chat_log(chat_log, 1000) is chat_log
+
+def test_compact_chat_log_drops_low_information_first():
+    lines = [
+        "[10:00] 111: 今天讨论一下新版本的发布计划",
+        "[10:01] 222: [表情] | 好的，我来整理需求",
+        "[10:02] 333: 哦",
+        "[10:03] 444: 今天讨论一下新版本的发布计划！",
+        "[10:04] 555: https://example.com/a/very/long/link",
+    ]
+    chat_log = "\n".join(lines)
+    # 预算刚好放下去掉无信息片段后的内容时，不再去掉重复行和链接
+    without_filler = "\n".join([lines[0], "[10:01] 222: 好的，我来整理需求", lines[3], lines[4]])
+    budget = token_budget.estimate_tokens(without_filler) + 4
+    assert token_budget.compact_chat_log(chat_log, budget) == without_filler
+
+    compacted = token_budget.compact_chat_log(chat_log, 1)
+    assert compacted == "\n".join([lines[0], "[10:01] 222: 好的，我来整理需求"])
+
+def test_truncate_chat_log():
+    chat_log = "\n".join(f"[10:{i:02d}] 111: 第{i}条消息" for i in range(100))
+    assert token_budget.truncate_chat_log(chat_log, 10 ** 6) == chat_log
+    truncated = token_budget.truncate_chat_log(chat_log, 200)
+    assert truncated.endswith("[由于长度限制，部分消息被省略]")
+    assert token_budget.estimate_tokens(truncated) <= 200 + truncated.count("\n")
+    assert chat_log.startswith(truncated.split("\n\n")[0])
@@ -0,0 +1,122 @@
+import re
+import math
+
+# 每个字符对应的token数（估算值）：英文字符约0.3个token，中文字符约0.6个token
+ASCII_TOKEN_RATIO = 0.3
+WIDE_TOKEN_RATIO = 0.6
+
+# 没有实际信息的短消息
+LOW_INFO_MESSAGES = {'[表情]', '[图片]', '6', '？', '?', '。', '哦', '嗯', '啊', 'ok', '666', '???'}
+
+# 压缩时视为无信息的消息片段，比过滤短消息时更激进
+FILLER_PARTS = LOW_INFO_MESSAGES | {'[特殊消息]', '[回复]', '[有人@]', '[视频]', '[语音]', '[红包]'}
+
+# 优化后的聊天记录行：[HH:MM] 发言人: 内容1 | 内容2
+CHAT_LINE_REGEX = re.compile(r'^(\[\d{2}:\d{2}\] [^:]*: )(.*)$', re.S)
+
+# 只有链接的消息片段
+LINK_ONLY_REGEX = re.compile(r'^(?:\[链接\]|https?://\S+|\s)+$')
+
+# 判断近似重复时忽略的字符
+NORMALIZE_REGEX = re.compile(r'[\s\W_]+')
+
+# 估算token数
+def estimate_tokens(text):
+    """
+    离线估算文本的token数，不需要加载分词器
+    ASCII字符占1个UTF-8字节，中文等宽字符占3个字节，据此在C层面统计出两类字符的数量
+    :param text: 文本
+    :return: 估算的token数
+    """
+    char_count = len(text)
+    wide_count = min(char_count, (len(text.encode('utf-8')) - char_count) // 2)
+    return math.ceil((char_count - wide_count) * ASCII_TOKEN_RATIO + wide_count * WIDE_TOKEN_RATIO)
+
+# 压缩聊天记录
+def compact_chat_log(chat_log, token_budget):
+    """
+    聊天记录超出token预算时，依次去掉信息量低的内容，直到符合预算：
+    1. 表情、图片、短回复等无信息的消息片段
+    2. 与之前内容近似重复的行
+    3. 只有链接的消息片段
+    所有步骤完成后仍可能超出预算，由调用方决定分段总结或截断
+    :param chat_log: 优化后的聊天记录文本
+    :param token_budget: token预算
+    :return: 压缩后的聊天记录文本
+    """
+    lines = chat_log.split('\n')
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    total = sum(costs)
+    if total <= token_budget:
+        return chat_log
+
+    def drop_parts(predicate):
+        nonlocal total
+        for i, line in enumerate(lines):
+            if total <= token_budget:
+                return
+            if line is None:
+                continue
+            match = CHAT_LINE_REGEX.match(line)
+            if not match:
+                continue
+            prefix, content = match.groups()
+            parts = content.split(' | ')
+            kept = [part for part in parts if not predicate(part.strip())]
+            if len(kept) == len(parts):
+                continue
+            new_line = prefix + ' | '.join(kept) if kept else None
+            new_cost = estimate_tokens(new_line) + 1 if kept else 0
+            total -= costs[i] - new_cost
+            lines[i] = new_line
+            costs[i] = new_cost
+
+    # 去掉无信息的消息片段
+    drop_parts(lambda part: part in FILLER_PARTS or len(part) < 2)
+
+    # 去掉近似重复的行，保留第一次出现的
+    seen = set()
+    for i, line in enumerate(lines):
+        if total <= token_budget:
+            break
+        if line is None:
+            continue
+        match = CHAT_LINE_REGEX.match(line)
+        if not match:
+            continue
+        key = NORMALIZE_REGEX.sub('', match.group(2)).lower()
+        if not key:
+            continue
+        if key in seen:
+            total -= costs[i]
+            lines[i] = None
+            costs[i] = 0
+        else:
+            seen.add(key)
+
+    # 去掉只有链接的消息片段
+    drop_parts(lambda part: bool(LINK_ONLY_REGEX.match(part)))
+
+    return '\n'.join(line for line in lines if line is not None)
+
+# 按token预算截断聊天记录
+def truncate_chat_log(chat_log, token_budget, note="\n\n[由于长度限制，部分消息被省略]"):
+    """
+    按行截断聊天记录，使其连同提示说明不超过token预算
+    :param chat_log: 聊天记录文本
+    :param token_budget: token预算
+    :param note: 截断后追加的说明
+    :return: 截断后的聊天记录文本
+    """
+    budget = token_budget - estimate_tokens(note)
+    kept = []
+    total = 0
+    for line in chat_log.split('\n'):
+        cost = estimate_tokens(line) + 1
+        if total + cost > budget:
+            break
+        kept.append(line)
+        total += cost
+    if len(kept) == chat_log.count('\n') + 1:
+        return chat_log
+    return '\n'.join(kept) + note